@@ -5,6 +5,8 @@ import re
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import PyPDFLoader, WebBaseLoader
 from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
+import faiss
 from langchain_community.embeddings import OpenAIEmbeddings
 # Sử dụng LLM và Embedding của Google
 from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
@@ -14,30 +16,40 @@ from langchain_community.tools.tavily_search import TavilySearchResults
 from langchain.tools.retriever import create_retriever_tool
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain.retrievers import EnsembleRetriever
-from langchain_community.retrievers import BM25Retriever
 from langchain.tools import tool
+from langchain_core.documents import Document
+from embedding_cache import CachedEmbeddings
+from clients import get_client, get_openai_client, get_async_openai_client
+from embedding_scheduler import EmbeddingScheduler
+from vector_index import create_faiss_store, VECTOR_INDEX_TYPE
+from sparse_bm25 import SparseBM25Retriever
+from hybrid_retriever import HybridRetriever, HYBRID_WEIGHTS, MMR_FETCH_K
+from query_router import QueryRouter, RAGAnswerer
+from tool_cache import CachedWebSearchTool, get_web_search_cache, memoize_tool_per_run
+from fake_web_search import FakeWebSearchTool
+from metrics import span, metrics_callback
+from pdf_extract import PDF_EXTRACT_WORKERS, extract_pages_parallel, preprocess_text, warm_up_pdf_extract_pool
+from logging_setup import get_logger
 
 import json
 
-# --- Hàm tiền xử lý văn bản để cải thiện chất lượng ---
-def preprocess_text(text):
-    """Làm sạch và chuẩn hóa văn bản từ PDF"""
-    # Loại bỏ ký tự đặc biệt và khoảng trắng thừa
-    text = re.sub(r'\s+', ' ', text)  # Nhiều khoảng trắng thành 1
-    text = re.sub(r'\n+', '\n', text)  # Nhiều xuống dòng thành 1
-    
-    # Loại bỏ header/footer thường gặp
-    text = re.sub(r'Trang \d+', '', text)
-    text = re.sub(r'Page \d+', '', text)
-    
-    # Chuẩn hóa dấu câu
-    text = re.sub(r'\s+([.,;:])', r'\1', text)
-    
-    return text.strip()
+logger = get_logger("agent_core")
+
+# --- Trích xuất PDF song song theo trang (process pool dùng chung, xem pdf_extract.py) ---
+def _load_pdf_parallel(file_path, max_workers):
+    """Trích xuất các trang PDF trên process pool, giữ nguyên thứ tự trang"""
+    page_texts = extract_pages_parallel(file_path, max_workers)
+    if page_texts is None:
+        return None
+    return [
+        Document(page_content=text, metadata={'source': file_path, 'page': i})
+        for i, text in enumerate(page_texts)
+    ]
 
 # --- Hàm load documents được tối ưu ---
-def load_documents(sources):
+def load_documents(sources, max_workers=None):
+    if max_workers is None:
+        max_workers = PDF_EXTRACT_WORKERS
     docs = []
     temp_files = []
     try:
@@ -46,18 +58,29 @@ def load_documents(sources):
                 loader = WebBaseLoader(source)
                 docs.extend(loader.load())
             else:
-                temp_file_path = os.path.join(".", source.name)
-                with open(temp_file_path, "wb") as f:
-                    f.write(source.getbuffer())
-                temp_files.append(temp_file_path)
+                if getattr(source, "path", None):
+                    # File đã nằm trên đĩa (upload dạng stream) -> đọc trực tiếp, không sao chép
+                    temp_file_path = source.path
+                else:
+                    temp_file_path = os.path.join(".", source.name)
+                    with open(temp_file_path, "wb") as f:
+                        f.write(source.getbuffer())
+                    temp_files.append(temp_file_path)
                 
-                # Sử dụng PyPDFLoader với extract_images=False để tăng tốc
-                loader = PyPDFLoader(temp_file_path, extract_images=False)
-                loaded_docs = loader.load()
+                loaded_docs = None
+                if max_workers > 1:
+                    # Trang đã được tiền xử lý ngay trong process con
+                    loaded_docs = _load_pdf_parallel(temp_file_path, max_workers)
                 
-                # Tiền xử lý và thêm metadata cho mỗi document
+                if loaded_docs is None:
+                    # Sử dụng PyPDFLoader với extract_images=False để tăng tốc
+                    loader = PyPDFLoader(temp_file_path, extract_images=False)
+                    loaded_docs = loader.load()
+                    for doc in loaded_docs:
+                        doc.page_content = preprocess_text(doc.page_content)
+                
+                # Thêm metadata cho mỗi document
                 for i, doc in enumerate(loaded_docs):
-                    doc.page_content = preprocess_text(doc.page_content)
                     doc.metadata.update({
                         'source_file': source.name,
                         'page_number': i + 1,
@@ -112,59 +135,134 @@ def split_documents(documents):
 
 
 # --- Hàm tạo vector store tối ưu với hybrid search ---
-def create_vector_store(text_chunks):
-    """Tạo vector store với embedding model tốt hơn"""
+# Cho phép trỏ tới server embedding khác (VD: fake_embeddings.py khi test)
+EMBEDDING_API_BASE = os.getenv("EMBEDDING_API_BASE")
+EMBEDDING_MODEL = "text-embedding-3-small"
+# text-embedding-3 hỗ trợ giảm số chiều (VD: 512) để index nhỏ hơn khi có nhiều session
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "1536"))
+
+def _build_embeddings():
+    extra_kwargs = {}
+    if EMBEDDING_API_BASE:
+        # OpenAIEmbeddings (langchain_community) gửi input dạng token ids; server trỏ tới phải nhận được dạng này
+        extra_kwargs.update(openai_api_base=EMBEDDING_API_BASE)
+    # OpenAI client dùng chung connection pool keep-alive; EmbeddingScheduler tự backoff khi gặp 429
+    client = get_openai_client(EMBEDDING_API_BASE).with_options(max_retries=1)
+    async_client = get_async_openai_client(EMBEDDING_API_BASE).with_options(max_retries=1)
     # Sử dụng OpenAI embedding model mới nhất và tốt nhất
-    embeddings = OpenAIEmbeddings(
-        model="text-embedding-3-small",
-        dimensions=1536,  # Đảm bảo consistency
-        show_progress_bar=True
+    openai_embeddings = OpenAIEmbeddings(
+        model=EMBEDDING_MODEL,
+        dimensions=EMBEDDING_DIMENSIONS,  # Đảm bảo consistency
+        max_retries=1,
+        client=client.embeddings,
+        async_client=async_client.embeddings,
+        **extra_kwargs
+    )
+    # Bọc bằng cache trên đĩa: chunk đã từng embed sẽ không gọi API lại
+    return CachedEmbeddings(
+        openai_embeddings,
+        model=EMBEDDING_MODEL,
+        dimensions=EMBEDDING_DIMENSIONS
     )
+
+def index_config():
+    """Cấu hình quyết định nội dung index đã lưu; đổi bất kỳ giá trị nào thì index phải được dựng lại"""
+    return {
+        "embedding_model": EMBEDDING_MODEL,
+        "embedding_dimensions": EMBEDDING_DIMENSIONS,
+        "vector_index_type": VECTOR_INDEX_TYPE,
+    }
+
+def get_embeddings():
+    """Embedding model dùng chung cho tạo index và nạp lại index đã lưu (tạo một lần cho cả process)"""
+    return get_client("embeddings", _build_embeddings)
+
+def create_vector_store(text_chunks, progress_callback=None, index_type=None, embeddings=None):
+    """
+    Tạo vector store với embedding model tốt hơn.
+    index_type: "flat" (mặc định), "sq8" hoặc "pq" để nén index khi có nhiều session.
+    embeddings: mặc định get_embeddings(); benchmark truyền embedding cục bộ để chạy offline.
+    """
+    embeddings = embeddings or get_embeddings()
+    
+    # Embed theo batch song song (tự giảm tốc khi bị rate limit) rồi ráp FAISS index
+    texts = [chunk.page_content for chunk in text_chunks]
+    vectors = EmbeddingScheduler(embeddings).embed(texts, progress=progress_callback)
     
     # Tạo FAISS vector store
-    vector_store = FAISS.from_documents(
-        documents=text_chunks, 
-        embedding=embeddings
+    vector_store = create_faiss_store(
+        embeddings,
+        texts,
+        vectors,
+        [chunk.metadata for chunk in text_chunks],
+        index_type=index_type or VECTOR_INDEX_TYPE
     )
     
     return vector_store
 
-def create_hybrid_retriever(vector_store, text_chunks):
-    """Tạo hybrid retriever kết hợp vector search và keyword search"""
-    
-    # 1. Vector retriever với MMR
-    vector_retriever = vector_store.as_retriever(
-        search_type="mmr",
-        search_kwargs={
-            'k': 4,
-            'fetch_k': 15,
-            'lambda_mult': 0.8,  # Cân bằng giữa relevance và diversity
-        }
+def extend_vector_store(vector_store, text_chunks, progress_callback=None):
+    """
+    Embed chunk mới (vector cũ không bị embed lại) và trả về vector store MỚI gồm cả chunk cũ lẫn mới.
+    Index được clone (kể cả index memory-map) nên các truy vấn đang chạy trên bản cũ không thấy trạng thái dở dang.
+    """
+    texts = [chunk.page_content for chunk in text_chunks]
+    vectors = EmbeddingScheduler(get_embeddings()).embed(texts, progress=progress_callback)
+    extended = FAISS(
+        vector_store.embedding_function,
+        faiss.clone_index(vector_store.index),
+        InMemoryDocstore(dict(vector_store.docstore._dict)),
+        dict(vector_store.index_to_docstore_id),
+        normalize_L2=vector_store._normalize_L2,
+        distance_strategy=vector_store.distance_strategy,
+    )
+    extended.add_embeddings(
+        text_embeddings=list(zip(texts, vectors)),
+        metadatas=[chunk.metadata for chunk in text_chunks]
+    )
+    return extended
+
+def assign_chunk_ids(text_chunks, start=0):
+    """Gán chunk_id (số nguyên, theo thứ tự trong text_chunks) để vector search và BM25 cùng tham chiếu"""
+    for offset, chunk in enumerate(text_chunks):
+        chunk.metadata['chunk_id'] = start + offset
+    return text_chunks
+
+def create_bm25_retriever(text_chunks):
+    """Tạo BM25 retriever cho keyword search (ma trận thưa, chỉ dựng khi có truy vấn đầu tiên)"""
+    return SparseBM25Retriever.from_documents(
+        text_chunks,
+        k=4
     )
+
+def extend_bm25_retriever(bm25_retriever, new_chunks):
+    """BM25 retriever mới gồm chunk cũ + chunk mới: chỉ chunk mới được tokenize, bản cũ không bị thay đổi"""
+    if bm25_retriever is None:
+        return None
+    return bm25_retriever.extended(new_chunks)
+
+def create_hybrid_retriever(vector_store, text_chunks, bm25_retriever=None, weights=None, cache=None,
+                            fetch_k=None):
+    """
+    Tạo hybrid retriever kết hợp vector search và keyword search.
+    Hai nhánh chạy song song và được hợp nhất bằng reciprocal-rank fusion theo chunk_id.
+    cache: RetrievalCache của session để dùng lại kết quả cho câu hỏi lặp lại.
+    """
+    # BM25 retriever cho keyword search (dùng lại bản đã lưu nếu có)
+    if bm25_retriever is None:
+        bm25_retriever = create_bm25_retriever(text_chunks)
     
-    try:
-        # 2. BM25 retriever cho keyword search
-        bm25_retriever = BM25Retriever.from_documents(
-            text_chunks,
-            k=4
-        )
-        
-        # 3. Ensemble retriever kết hợp cả hai
-        ensemble_retriever = EnsembleRetriever(
-            retrievers=[vector_retriever, bm25_retriever],
-            weights=[0.7, 0.3]  # Ưu tiên vector search hơn
-        )
-        
-        return ensemble_retriever
-        
-    except ImportError:
-        # Fallback về vector retriever nếu không có rank_bm25
-        print("Warning: rank_bm25 not installed. Using vector search only.")
-        return vector_retriever
+    return HybridRetriever(
+        vector_store=vector_store,
+        bm25_retriever=bm25_retriever,
+        k=4,
+        fetch_k=fetch_k or MMR_FETCH_K,
+        lambda_mult=0.8,  # Cân bằng giữa relevance và diversity
+        weights=list(weights or HYBRID_WEIGHTS),  # Mặc định ưu tiên vector search hơn
+        cache=cache,
+    )
 
 
-def get_generation_llm():
-    """Khởi tạo và trả về một LLM của Google cho các tác vụ tạo nội dung."""
+def _build_generation_llm():
     try:
         # Cấu hình tối ưu cho essay generation - sử dụng model ổn định hơn
         llm = ChatGoogleGenerativeAI(
@@ -173,14 +271,76 @@ def get_generation_llm():
             max_tokens=4096,      # Giữ max_tokens vừa phải để tránh quota issues
             top_p=0.7,           # Giảm top_p để tập trung hơn
             max_retries=3,       # Tăng số lần thử lại
-            timeout=90           # Tăng timeout cho response dài
+            timeout=90,          # Tăng timeout cho response dài
+            callbacks=[metrics_callback]  # Đo thời gian từng lần gọi LLM cho /metrics
         )
-        print("[DEBUG] Generation LLM initialized successfully")
+        logger.debug("Generation LLM initialized")
         return llm
     except Exception as e:
-        print(f"[ERROR] Failed to initialize Generation LLM: {e}")
+        logger.error("Failed to initialize Generation LLM", extra={"error": str(e)})
         raise
 
+def get_generation_llm():
+    """Trả về LLM của Google cho các tác vụ tạo nội dung (dùng chung, không tạo lại mỗi request)."""
+    return get_client("generation_llm", _build_generation_llm)
+
+def _build_agent_llm():
+    # Gemini model với cấu hình ổn định hơn
+    try:
+        llm = ChatGoogleGenerativeAI(
+            model="gemini-2.5-flash", 
+            temperature=0.05,  # Giảm temperature rất thấp để tuân thủ quy tắc nghiêm ngặt
+            max_tokens=4096,  # Tăng lên để đủ cho nội dung dài (9 phần hướng dẫn học tập)
+            top_p=0.7,  # Giảm top_p để focused hơn
+            max_retries=3,  # Retry nếu API call fail
+            request_timeout=60,  # Timeout 60s cho API calls
+            callbacks=[metrics_callback]  # Đo thời gian từng lần gọi LLM cho /metrics
+        )
+        logger.debug("Agent LLM initialized")
+        return llm
+    except Exception as e:
+        logger.error("Failed to initialize agent LLM", extra={"error": str(e)})
+        raise
+
+def get_agent_llm():
+    """LLM của agent chat, dùng chung cho mọi session"""
+    return get_client("agent_llm", _build_agent_llm)
+
+# "tavily" (mặc định) hoặc "fake" (kết quả giả lập, không cần mạng - dùng cho test)
+WEB_SEARCH_BACKEND = os.getenv("WEB_SEARCH_BACKEND", "tavily")
+
+WEB_SEARCH_DESCRIPTION = """🚫 CHỈ SỬ DỤNG SAU KHI DOCUMENT_SEARCH THẤT BẠI 🚫
+        
+        ⚠️ KHÔNG ĐƯỢC dùng làm công cụ đầu tiên cho câu hỏi học thuật
+        ⚠️ CHỈ dùng KHI document_search không tìm thấy thông tin liên quan
+        
+        Hữu ích cho:
+        - Tin tức mới, cập nhật gần đây  
+        - Thông tin ngoài phạm vi tài liệu đã tải
+        - Chủ đề không có trong giáo trình/slide"""
+
+def _build_web_search_tool():
+    if WEB_SEARCH_BACKEND == "fake":
+        search_tool = FakeWebSearchTool(name="web_search", description=WEB_SEARCH_DESCRIPTION)
+    else:
+        search_tool = TavilySearchResults(k=3, name="web_search", description=WEB_SEARCH_DESCRIPTION)
+    # Kết quả được cache trên đĩa có TTL: cùng câu truy vấn không gọi lại API ở các lượt sau
+    web_search_tool = CachedWebSearchTool.wrap(search_tool, get_web_search_cache())
+    web_search_tool.callbacks = [metrics_callback]
+    return web_search_tool
+
+def get_web_search_tool():
+    """Tool web search (Tavily) không giữ trạng thái nên dùng chung cho mọi agent"""
+    return get_client("web_search_tool", _build_web_search_tool)
+
+def warm_up_clients():
+    """Tạo sẵn các client dùng chung để session đầu tiên không phải chờ khởi tạo"""
+    get_embeddings()
+    get_agent_llm()
+    get_generation_llm()
+    get_web_search_tool()
+    warm_up_pdf_extract_pool()
+
 # --- HÀM MỚI: Logic tạo câu hỏi tự luận ---
 async def generate_essay_questions_logic(llm, prompt_template_str, num_questions, context=None, topic=None):
     """
@@ -218,7 +378,8 @@ async def generate_essay_questions_logic(llm, prompt_template_str, num_questions
             print(f"[DEBUG] Raw response preview: {raw_response[:300]}...")
             
             # Cải thiện logic trích xuất JSON với nhiều phương pháp
-            json_str = extract_json_from_response(raw_response)
+            with span("json_parse"):
+                json_str = extract_json_from_response(raw_response)
             
             if not json_str:
                 print("[ERROR] No valid JSON found in LLM response.")
@@ -416,13 +577,19 @@ def create_fallback_json():
     print("[DEBUG] Using fallback JSON structure")
     return json.dumps(fallback, ensure_ascii=False)
 # --- TẠO AGENT SỬ DỤNG GEMINI VỚI RETRIEVER TỐI ƯU ---
-def create_agent_executor(vector_store, system_prompt_str, text_chunks=None):
-    """Tạo agent executor với retrieval được tối ưu hóa"""
+# verbose=True in từng bước của agent ra stdout một cách đồng bộ; tắt trên production
+AGENT_VERBOSE = os.getenv("AGENT_VERBOSE", "0") == "1"
+
+def create_agent_executor(vector_store, system_prompt_str, text_chunks=None, bm25_retriever=None,
+                          retrieval_cache=None, retriever=None):
+    """Tạo agent executor với retrieval được tối ưu hóa (retriever: dùng lại retriever đã tạo, VD để chia sẻ với router)"""
     
     # Tạo hybrid retriever thay vì retriever đơn giản
-    if text_chunks:
-        retriever = create_hybrid_retriever(vector_store, text_chunks)
-    else:
+    if retriever is None and text_chunks:
+        retriever = create_hybrid_retriever(
+            vector_store, text_chunks, bm25_retriever=bm25_retriever, cache=retrieval_cache
+        )
+    elif retriever is None:
         # Fallback về retriever thông thường nếu không có text_chunks
         retriever = vector_store.as_retriever(
             search_type="mmr",
@@ -454,41 +621,18 @@ def create_agent_executor(vector_store, system_prompt_str, text_chunks=None):
         
         Công cụ sử dụng hybrid search (vector + keyword) để tìm kiếm chính xác nhất."""
     )
+    # Trong một lượt chạy agent, gọi lại với cùng câu truy vấn không truy xuất lại
+    memoize_tool_per_run(document_search_tool)
+    document_search_tool.callbacks = [metrics_callback]
 
     # 2. CÔNG CỤ 2: Web search cho thông tin bổ sung - CHỈ KHI DOCUMENT_SEARCH THẤT BẠI
-    web_search_tool = TavilySearchResults(
-        k=3, 
-        name="web_search",
-        description="""🚫 CHỈ SỬ DỤNG SAU KHI DOCUMENT_SEARCH THẤT BẠI 🚫
-        
-        ⚠️ KHÔNG ĐƯỢC dùng làm công cụ đầu tiên cho câu hỏi học thuật
-        ⚠️ CHỈ dùng KHI document_search không tìm thấy thông tin liên quan
-        
-        Hữu ích cho:
-        - Tin tức mới, cập nhật gần đây  
-        - Thông tin ngoài phạm vi tài liệu đã tải
-        - Chủ đề không có trong giáo trình/slide"""
-    )
-
-   
+    web_search_tool = get_web_search_tool()
 
     # 4. Tập hợp các công cụ - ĐẶT DOCUMENT_SEARCH TOOL ĐẦU TIÊN ĐỂ ƯU TIÊN
     tools = [document_search_tool, web_search_tool]
 
-    # 5. Gemini model với cấu hình ổn định hơn
-    try:
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash", 
-            temperature=0.05,  # Giảm temperature rất thấp để tuân thủ quy tắc nghiêm ngặt
-            max_tokens=4096,  # Tăng lên để đủ cho nội dung dài (9 phần hướng dẫn học tập)
-            top_p=0.7,  # Giảm top_p để focused hơn
-            max_retries=3,  # Retry nếu API call fail
-            request_timeout=60  # Timeout 60s cho API calls
-        )
-        print("[DEBUG] Gemini LLM initialized successfully")
-    except Exception as e:
-        print(f"[ERROR] Failed to initialize Gemini LLM: {e}")
-        raise
+    # 5. Gemini model dùng chung (không tạo lại cho mỗi session)
+    llm = get_agent_llm()
     
     # 6. Prompt template được cải thiện
     prompt = ChatPromptTemplate.from_messages([
@@ -506,16 +650,20 @@ def create_agent_executor(vector_store, system_prompt_str, text_chunks=None):
         agent_executor = AgentExecutor(
             agent=agent, 
             tools=tools, 
-            verbose=True,
+            verbose=AGENT_VERBOSE,
             handle_parsing_errors=True,
             max_iterations=10,  # Tăng số lần thử để đảm bảo dùng tools
             max_execution_time=90,  # Tăng timeout
             return_intermediate_steps=False,
             early_stopping_method="force"  # Thay đổi để ép sử dụng tools nhiều hơn
         )
-        print(f"[DEBUG] Agent Executor created successfully with {len(tools)} tools")
+        logger.debug("Agent executor created", extra={"tools": len(tools)})
     except Exception as e:
-        print(f"[ERROR] Failed to create Agent Executor: {e}")
+        logger.error("Failed to create agent executor", extra={"error": str(e)})
         raise
     
-    return agent_executor
\ No newline at end of file
+    return agent_executor
+
+def create_query_router(agent_executor, retriever):
+    """Router đặt trước agent: câu hỏi tài liệu thông thường chỉ cần 1 lần truy xuất + 1 lần gọi LLM"""
+    return QueryRouter(agent_executor, RAGAnswerer(retriever, get_agent_llm()))
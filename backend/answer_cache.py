@@ -0,0 +1,168 @@
+# answer_cache.py - Cache câu trả lời theo (bộ tài liệu, ngữ nghĩa câu hỏi) dùng chung giữa các session
+
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from vn_tokenizer import normalize_query_text
+
+# Cosine similarity tối thiểu để coi hai câu hỏi là một
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", str(24 * 3600)))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+# Câu quá ngắn thường là câu hỏi nối tiếp ("giải thích thêm"), phụ thuộc ngữ cảnh nên không cache
+ANSWER_CACHE_MIN_WORDS = int(os.getenv("ANSWER_CACHE_MIN_WORDS", "4"))
+# Cụm từ (đã bỏ dấu, chữ thường) tham chiếu tới lượt hội thoại trước: khi session đã có lịch sử,
+# câu trả lời phụ thuộc ngữ cảnh riêng của session đó nên không tra / lưu cache dùng chung.
+# Chỉ dùng cụm nhiều từ: từ đơn như "nó", "chúng", "it", "that" có trong hầu hết câu hỏi bình thường
+FOLLOW_UP_CUES = [
+    "o tren", "ben tren", "phia tren", "vua roi", "vua noi", "vua giai thich", "truoc do", "luc nay",
+    "cau tren", "cau truoc", "cau tra loi", "giai thich lai", "noi lai", "nhac lai", "lam ro", "them ve",
+    "tiep tuc", "tiep theo", "vi du thu", "vi du do", "y thu", "cau thu", "phan thu", "buoc thu",
+    "cai do", "cai nay", "dieu do", "dieu nay", "van de do", "khai niem do", "y do", "y nay",
+    "no la gi", "vi sao lai nhu vay", "tai sao lai nhu vay", "nhu vay thi",
+    "as above", "the above", "previous answer", "you said", "you mentioned", "explain it", "explain that",
+    "what about it", "what about that", "tell me more", "more about that",
+]
+
+
+class _Entry:
+    __slots__ = ("entry_id", "fingerprint", "question", "vector", "answer", "created_at", "hits")
+
+    def __init__(self, fingerprint, question, vector, answer):
+        self.entry_id = uuid.uuid4().hex
+        self.fingerprint = fingerprint
+        self.question = question
+        self.vector = vector
+        self.answer = answer
+        self.created_at = time.time()
+        self.hits = 0
+
+
+class SemanticAnswerCache:
+    """
+    Lưu câu trả lời theo fingerprint của bộ tài liệu và embedding của câu hỏi.
+    Cả lớp upload cùng tài liệu nên câu hỏi giống nhau (về nghĩa) chỉ cần chạy agent một lần.
+    Giới hạn theo số entry (LRU) và TTL.
+    """
+
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, ttl: float = ANSWER_CACHE_TTL,
+                 max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        # fingerprint -> (danh sách entry, ma trận vector chuẩn hóa); ma trận dựng lại khi thay đổi
+        self._by_fingerprint: Dict[str, List[_Entry]] = {}
+        self._matrices: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expired = 0
+
+    @staticmethod
+    def is_cacheable(question: str, has_history: bool = False) -> bool:
+        """Câu đủ dài, và nếu session đã có lịch sử thì không tham chiếu tới các lượt trước"""
+        if len(question.split()) < ANSWER_CACHE_MIN_WORDS:
+            return False
+        if has_history:
+            folded = normalize_query_text(question)
+            return not any(re.search(rf"\b{re.escape(cue)}\b", folded) for cue in FOLLOW_UP_CUES)
+        return True
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove_locked(self, entry: _Entry):
+        self._entries.pop(entry.entry_id, None)
+        bucket = self._by_fingerprint.get(entry.fingerprint, [])
+        if entry in bucket:
+            bucket.remove(entry)
+        if not bucket:
+            self._by_fingerprint.pop(entry.fingerprint, None)
+        self._matrices.pop(entry.fingerprint, None)
+
+    def _expire_locked(self, fingerprint: str, now: float):
+        """Bỏ mọi entry hết hạn của bộ tài liệu trước khi so khớp (bucket xếp theo thời điểm lưu)"""
+        bucket = self._by_fingerprint.get(fingerprint)
+        if not bucket:
+            return
+        expired = 0
+        while expired < len(bucket) and now - bucket[expired].created_at > self.ttl:
+            self._entries.pop(bucket[expired].entry_id, None)
+            expired += 1
+        if not expired:
+            return
+        del bucket[:expired]
+        if not bucket:
+            self._by_fingerprint.pop(fingerprint, None)
+        self._matrices.pop(fingerprint, None)
+        self.expired += expired
+
+    def lookup(self, fingerprint: str, question_vector) -> Optional[dict]:
+        """Trả về {"answer", "question", "similarity"} nếu có câu hỏi đủ giống, ngược lại None"""
+        query = self._normalize(question_vector)
+        now = time.time()
+        with self._lock:
+            self._expire_locked(fingerprint, now)
+            bucket = self._by_fingerprint.get(fingerprint)
+            if not bucket:
+                self.misses += 1
+                return None
+            matrix = self._matrices.get(fingerprint)
+            if matrix is None:
+                matrix = np.stack([entry.vector for entry in bucket])
+                self._matrices[fingerprint] = matrix
+            similarities = matrix @ query
+            best = int(np.argmax(similarities))
+            entry = bucket[best]
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+            entry.hits += 1
+            self._entries.move_to_end(entry.entry_id)
+            self.hits += 1
+            return {"answer": entry.answer, "question": entry.question, "similarity": float(similarities[best])}
+
+    def store(self, fingerprint: str, question: str, question_vector, answer: str):
+        entry = _Entry(fingerprint, question, self._normalize(question_vector), answer)
+        with self._lock:
+            self._entries[entry.entry_id] = entry
+            self._by_fingerprint.setdefault(fingerprint, []).append(entry)
+            self._matrices.pop(fingerprint, None)
+            self.stores += 1
+            while len(self._entries) > self.max_entries:
+                _, oldest = self._entries.popitem(last=False)
+                self._remove_locked(oldest)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "document_sets": len(self._by_fingerprint),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "expired": self.expired,
+            }
+
+
+answer_cache = SemanticAnswerCache()
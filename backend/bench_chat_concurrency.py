@@ -0,0 +1,66 @@
+# Load test: N request /chat đồng thời với agent giả lập (độ trễ LLM cố định), chạy trong process qua ASGI.
+# Với agent async, N request phải xong trong khoảng thời gian của một request.
+# --blocking mô phỏng cách cũ (gọi invoke đồng bộ trên event loop) để so sánh.
+#
+# Chạy: python bench_chat_concurrency.py --concurrency 1 8 32 --latency 1.0
+import argparse
+import asyncio
+import time
+
+import httpx
+
+import index
+
+
+class FakeAgent:
+    """Agent giả: "gọi LLM" mất latency giây, trả về câu trả lời cố định"""
+
+    def __init__(self, latency: float, blocking: bool = False):
+        self.latency = latency
+        self.blocking = blocking
+
+    def invoke(self, inputs):
+        time.sleep(self.latency)
+        return {"output": f"Trả lời cho: {inputs['input']}"}
+
+    async def ainvoke(self, inputs):
+        if self.blocking:
+            return self.invoke(inputs)
+        await asyncio.sleep(self.latency)
+        return {"output": f"Trả lời cho: {inputs['input']}"}
+
+
+async def run_load(client, concurrency: int):
+    async def one(i):
+        session_id = f"bench-{i}"
+        index.sessions[session_id] = {"agent_executor": index.sessions["bench"]["agent_executor"], "chat_history": []}
+        response = await client.post("/chat", json={"message": f"Câu hỏi số {i}", "session_id": session_id})
+        response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(concurrency)))
+    return time.perf_counter() - start
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--latency", type=float, default=1.0)
+    parser.add_argument("--blocking", action="store_true", help="Mô phỏng invoke đồng bộ chặn event loop")
+    args = parser.parse_args()
+
+    index.sessions["bench"] = {"agent_executor": FakeAgent(args.latency, args.blocking), "chat_history": []}
+    transport = httpx.ASGITransport(app=index.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        print(f"agent latency {args.latency}s, mode={'blocking' if args.blocking else 'async'}, "
+              f"CHAT_MAX_CONCURRENCY={index.CHAT_MAX_CONCURRENCY}\n")
+        print(f"{'concurrent':>10} {'wall s':>8} {'x single':>9} {'chats/s':>8}")
+        single = None
+        for concurrency in args.concurrency:
+            wall = await run_load(client, concurrency)
+            single = single or wall
+            print(f"{concurrency:>10} {wall:>8.2f} {wall / single:>8.2f}x {concurrency / wall:>8.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+# Benchmark: recall@k và bộ nhớ của index nén (sq8, pq) so với flat index
+#
+# Chạy: python bench_index_compression.py --num-vectors 20000 --dimensions 1536
+import argparse
+import time
+
+import numpy as np
+
+from vector_index import build_faiss_index, index_memory_bytes
+
+
+def make_clustered_vectors(num_vectors, dimensions, num_clusters=200, seed=0):
+    """Vector chuẩn hóa phân cụm, gần giống phân bố embedding của các chunk tài liệu"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((num_clusters, dimensions)).astype(np.float32)
+    labels = rng.integers(0, num_clusters, num_vectors)
+    vectors = centers[labels] + 0.6 * rng.standard_normal((num_vectors, dimensions)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def recall_at_k(ground_truth, results, k):
+    hits = sum(len(set(gt[:k]) & set(res[:k])) for gt, res in zip(ground_truth, results))
+    return hits / (len(ground_truth) * k)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-vectors", type=int, default=20000)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--fetch-k", type=int, default=15)
+    args = parser.parse_args()
+
+    data = make_clustered_vectors(args.num_vectors + args.num_queries, args.dimensions)
+    vectors, queries = data[:args.num_vectors], data[args.num_vectors:]
+
+    results = {}
+    for index_type in ("flat", "sq8", "pq"):
+        start = time.perf_counter()
+        index = build_faiss_index(vectors, index_type)
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        _, ids = index.search(queries, args.fetch_k)
+        query_ms = (time.perf_counter() - start) * 1000 / args.num_queries
+        results[index_type] = (index, ids, build_seconds, query_ms)
+
+    ground_truth = results["flat"][1]
+    flat_bytes = index_memory_bytes(results["flat"][0])
+    print(f"{args.num_vectors} vectors x {args.dimensions} dims, {args.num_queries} queries\n")
+    print(f"{'index':<6} {'memory':>10} {'ratio':>7} {'build s':>8} {'query ms':>9} "
+          f"{'recall@' + str(args.k):>9} {'recall@' + str(args.fetch_k):>10}")
+    for index_type, (index, ids, build_seconds, query_ms) in results.items():
+        memory = index_memory_bytes(index)
+        print(f"{index_type:<6} {memory / 1024 / 1024:>8.1f}MB {flat_bytes / memory:>6.1f}x "
+              f"{build_seconds:>8.2f} {query_ms:>9.3f} "
+              f"{recall_at_k(ground_truth, ids, args.k):>9.3f} "
+              f"{recall_at_k(ground_truth, ids, args.fetch_k):>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# Benchmark chi phí logging trên mỗi request /chat: các lệnh print cũ (in toàn bộ danh sách session,
+# preview câu trả lời, ghi đồng bộ ra stdout) so với logger có cấu trúc ghi qua queue.
+# Chỉ đo thời gian trên luồng xử lý request (phần ghi ra stdout của logger chạy ở thread riêng).
+#
+# Chạy: python bench_logging.py --sessions 10 1000 10000 --requests 2000
+#       python bench_logging.py --output /dev/null   (mặc định ghi ra file tạm, giống stdout bị chuyển hướng)
+import argparse
+import contextlib
+import logging
+import os
+import tempfile
+import time
+import uuid
+
+from logging_setup import get_logger, setup_logging, shutdown_logging
+
+MESSAGE = "Giải thích cơ chế lập lịch tiến trình theo vòng trong hệ điều hành là gì?"
+ANSWER = "Lập lịch vòng (round-robin) cấp cho mỗi tiến trình một lượng thời gian cố định... " * 20
+
+
+def legacy_request(sessions: dict, session_id: str):
+    """Các lệnh print của /chat trước khi chuyển sang logger"""
+    print(f"[DEBUG] Received chat request: {MESSAGE[:100]}...")
+    print(f"[DEBUG] Session ID: {session_id}")
+    print(f"[DEBUG] Available sessions: {list(sessions.keys())}")
+    print(f"[DEBUG] Chat history length: 12 (sending 8 messages)")
+    print(f"[DEBUG] History tokens: {{'tokens': 1800, 'budget': 3000, 'saved': 400}}")
+    print(f"[DEBUG] Agent executor type: {type(sessions[session_id])}")
+    print(f"[DEBUG] Calling agent with input: {MESSAGE[:100]}...")
+    print(f"[DEBUG] Agent execution successful")
+    print(f"[DEBUG] Agent response length: {len(ANSWER)}")
+    print(f"[DEBUG] Agent response preview: {ANSWER[:200]}...")
+    print(f"[DEBUG] Normal response - not a quiz")
+    print(f"[DEBUG] Final is_quiz determination: False")
+
+
+def structured_request(logger: logging.Logger, session_id: str):
+    """Các lệnh log hiện tại trên luồng /chat"""
+    logger.debug("Router decision", extra={"route": "rag", "reason": "document_question"})
+    logger.debug("Quiz JSON parse error, falling back to keywords", extra={"error": "Expecting value: line 1 column 1"})
+    logger.info("Chat answered", extra={
+        "session_id": session_id, "route": "rag", "answer_chars": len(ANSWER),
+        "history_messages": 8, "history_tokens_saved": 400,
+    })
+
+
+def measure(fn, requests: int) -> float:
+    start = time.perf_counter()
+    for _ in range(requests):
+        fn()
+    return 1e6 * (time.perf_counter() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--output", default=None, help="File nhận log (mặc định: file tạm)")
+    args = parser.parse_args()
+
+    output_path = args.output or os.path.join(tempfile.mkdtemp(), "bench.log")
+    print(f"{'sessions':>8}  {'print cũ':>12}  {'logger INFO':>12}  {'logger DEBUG':>13}  {'DEBUG 10%':>10}  (µs/request)")
+    for n in args.sessions:
+        sessions = {str(uuid.uuid4()): object() for _ in range(n)}
+        session_id = next(iter(sessions))
+        row = []
+        with open(output_path, "a", encoding="utf-8") as out:
+            with contextlib.redirect_stdout(out):
+                row.append(measure(lambda: legacy_request(sessions, session_id), args.requests))
+            for level, rate in [("INFO", 1.0), ("DEBUG", 1.0), ("DEBUG", 0.1)]:
+                setup_logging(level=level, fmt_type="json", sample_rate=rate, stream=out)
+                logger = get_logger("bench")
+                row.append(measure(lambda: structured_request(logger, session_id), args.requests))
+                shutdown_logging()
+        print(f"{n:>8}  {row[0]:>12.1f}  {row[1]:>12.1f}  {row[2]:>13.1f}  {row[3]:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
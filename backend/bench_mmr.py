@@ -0,0 +1,62 @@
+# Benchmark: MMR vector hóa (mmr.py) so với đường cũ của LangChain (reconstruct từng vector + vòng lặp Python)
+#
+# Chạy: python bench_mmr.py --sizes 100 1000 10000 100000 --fetch-k 15 50 200
+import argparse
+import time
+
+import numpy as np
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+
+from bench_index_compression import make_clustered_vectors
+from mmr import MMRSearcher
+from vector_index import build_faiss_index
+
+
+def langchain_mmr(index, query, k, fetch_k, lambda_mult):
+    """Giống FAISS.max_marginal_relevance_search_with_score_by_vector của LangChain"""
+    _, ids = index.search(query.reshape(1, -1), fetch_k)
+    embeddings = [index.reconstruct(int(i)) for i in ids[0] if i != -1]
+    picked = maximal_marginal_relevance(query.reshape(1, -1), embeddings, k=k, lambda_mult=lambda_mult)
+    return [int(ids[0][i]) for i in picked]
+
+
+def time_per_query(fn, queries):
+    start = time.perf_counter()
+    results = [fn(query) for query in queries]
+    return (time.perf_counter() - start) * 1000 / len(queries), results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    parser.add_argument("--dimensions", type=int, default=768)
+    parser.add_argument("--fetch-k", type=int, nargs="+", default=[15, 50, 200])
+    parser.add_argument("--num-queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--lambda-mult", type=float, default=0.8)
+    args = parser.parse_args()
+
+    # "search ms" là riêng phần FAISS search (chung cho cả hai cách), phần còn lại là chi phí MMR
+    print(f"{'chunks':>7} {'fetch_k':>7} {'search ms':>10} {'langchain ms':>13} {'vectorized ms':>14} "
+          f"{'speedup':>8} {'same picks':>11}")
+    for size in args.sizes:
+        data = make_clustered_vectors(size + args.num_queries, args.dimensions)
+        vectors, queries = data[:size], data[size:]
+        index = build_faiss_index(vectors, "flat")
+        searcher = MMRSearcher(index)
+
+        for fetch_k in args.fetch_k:
+            search_ms, _ = time_per_query(lambda q: index.search(q.reshape(1, -1), fetch_k), queries)
+            baseline_ms, baseline = time_per_query(
+                lambda q: langchain_mmr(index, q, args.k, fetch_k, args.lambda_mult), queries
+            )
+            vectorized_ms, vectorized = time_per_query(
+                lambda q: searcher.search(q, k=args.k, fetch_k=fetch_k, lambda_mult=args.lambda_mult)[0], queries
+            )
+            same = sum(a == b for a, b in zip(baseline, vectorized)) / len(queries)
+            print(f"{size:>7} {fetch_k:>7} {search_ms:>10.3f} {baseline_ms:>13.3f} {vectorized_ms:>14.3f} "
+                  f"{baseline_ms / vectorized_ms:>7.1f}x {same:>11.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+# Benchmark chất lượng và tốc độ truy xuất: recall@k, MRR, latency p50/p95, thời gian dựng index và bộ nhớ
+# cho từng cấu hình retriever. Dùng embedding cục bộ tất định nên chạy được không cần mạng.
+#
+# Chạy: python bench_retrieval.py --pages 60 --questions 300
+#       python bench_retrieval.py --save-corpus corpus.json   (lưu corpus sinh ra để dùng lại)
+#       python bench_retrieval.py --corpus corpus.json        (dùng corpus cố định có sẵn)
+#
+# Định dạng corpus JSON:
+#   {"pages": [{"text": "...", "source": "...", "page": 1}],
+#    "questions": [{"question": "...", "answer": "<đoạn văn bản nằm trong chunk đúng>"}]}
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+from langchain_core.documents import Document
+
+from agent_core import (
+    split_documents, assign_chunk_ids, create_vector_store, create_bm25_retriever, create_hybrid_retriever
+)
+from chunk_dedup import deduplicate_chunks
+from fake_embeddings import DeterministicEmbeddings
+from mmr import max_marginal_relevance_search
+from vector_index import index_memory_bytes
+from vn_tokenizer import fold_diacritics
+
+TOPICS = {
+    "Cấu trúc dữ liệu": ["cây", "đồ thị", "hàng đợi", "ngăn xếp", "bảng băm", "danh sách liên kết"],
+    "Hệ điều hành": ["tiến trình", "luồng", "bộ lập lịch", "bộ nhớ ảo", "khóa đồng bộ", "tín hiệu"],
+    "Mạng máy tính": ["giao thức", "bộ định tuyến", "gói tin", "cổng dịch vụ", "tường lửa", "kết nối"],
+    "Cơ sở dữ liệu": ["giao dịch", "chỉ mục", "khóa ngoại", "bảng quan hệ", "truy vấn", "nhật ký ghi"],
+    "Học máy": ["mô hình", "hàm mất mát", "bộ phân loại", "đặc trưng", "tập huấn luyện", "bước gradient"],
+}
+MODIFIERS = ["nhị phân", "cân bằng", "phân tán", "ưu tiên", "tuyến tính", "đa cấp",
+             "ngẫu nhiên", "tối ưu", "song song", "tuần tự", "động", "tĩnh"]
+PROPERTIES = [
+    "lưu trữ phần tử theo thứ tự xác định", "cho phép truy cập trong thời gian hằng số",
+    "giảm độ trễ khi xử lý yêu cầu", "đảm bảo tính nhất quán của dữ liệu", "hỗ trợ chèn và xóa hiệu quả",
+    "chia nhỏ bài toán thành các phần độc lập", "tận dụng bộ nhớ đệm của bộ xử lý",
+    "phát hiện lỗi trong quá trình truyền", "tự cân bằng sau mỗi lần cập nhật", "ước lượng tham số từ dữ liệu",
+    "phân phối tải giữa nhiều máy", "ghi lại lịch sử thay đổi", "giới hạn quyền truy cập tài nguyên",
+    "sắp xếp công việc theo độ ưu tiên", "mã hóa thông tin trước khi gửi", "tối thiểu hóa sai số dự đoán",
+]
+EXAMPLES = [
+    "xây dựng trình biên dịch", "thiết kế hệ thống ngân hàng", "định tuyến trong mạng nội bộ",
+    "lập lịch cho máy chủ web", "tìm đường đi ngắn nhất", "phân loại thư rác", "nén dữ liệu đa phương tiện",
+    "đồng bộ hóa tệp giữa các thiết bị", "quản lý kho hàng", "dự báo nhu cầu điện năng",
+]
+
+
+def generate_corpus(num_pages: int, num_questions: int, seed: int = 42):
+    """Sinh corpus học thuật tiếng Việt tất định kèm cặp câu hỏi -> đoạn văn bản chứa câu trả lời"""
+    rng = random.Random(seed)
+    concepts = [(topic, f"{noun} {modifier}") for topic, nouns in TOPICS.items()
+                for noun in nouns for modifier in MODIFIERS]
+    rng.shuffle(concepts)
+
+    paragraphs, questions = [], []
+    for topic, concept in concepts:
+        p1, p2, p3, advantage, weakness = rng.sample(PROPERTIES, 5)
+        definition = f"Định nghĩa: {concept} là cấu trúc {p1}, {p2} và {p3}."
+        paragraphs.append(
+            f"{concept.capitalize()} là một khái niệm quan trọng trong môn {topic}. {definition} "
+            f"Ví dụ điển hình của {concept} xuất hiện khi {rng.choice(EXAMPLES)}. "
+            f"Ưu điểm chính của {concept} là {advantage}, còn nhược điểm là không {weakness}."
+        )
+        templates = [
+            f"{concept} là gì?",
+            f"Định nghĩa {concept}",
+            fold_diacritics(f"{concept} là gì"),
+            f"Ưu điểm của {concept} trong {topic.lower()}?",
+        ]
+        for template in templates:
+            questions.append({"question": template, "answer": definition})
+        # Đoạn gây nhiễu: nhắc tới khái niệm nhưng không chứa định nghĩa
+        other = rng.choice(concepts)[1]
+        paragraphs.append(
+            f"Bài tập: so sánh {concept} với {other} khi {rng.choice(EXAMPLES)}. "
+            f"Sinh viên cần trình bày khi nào nên dùng {concept} và khi nào nên dùng {other}, "
+            f"kèm theo phân tích độ phức tạp và các trường hợp đặc biệt."
+        )
+
+    per_page = max(1, len(paragraphs) // num_pages)
+    pages = [
+        {"text": "\n\n".join(paragraphs[i:i + per_page]), "source": "giao_trinh.pdf", "page": i // per_page + 1}
+        for i in range(0, len(paragraphs), per_page)
+    ]
+    rng.shuffle(questions)
+    return {"pages": pages, "questions": questions[:num_questions]}
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000) if samples else 0.0
+
+
+def evaluate(name, retrieve, questions, gold_ids, k):
+    """Chạy toàn bộ câu hỏi qua retrieve(query) -> danh sách chunk_id, tính recall@k, MRR và latency"""
+    recalls, reciprocal_ranks, latencies = [], [], []
+    for item, gold in zip(questions, gold_ids):
+        start = time.perf_counter()
+        ranked = retrieve(item["question"])
+        latencies.append(time.perf_counter() - start)
+        recalls.append(len(gold & set(ranked[:k])) / len(gold))
+        rank = next((i for i, chunk_id in enumerate(ranked, start=1) if chunk_id in gold), None)
+        reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+    return {
+        "config": name,
+        f"recall@{k}": float(np.mean(recalls)),
+        "mrr": float(np.mean(reciprocal_ranks)),
+        "p50_ms": percentile_ms(latencies, 50),
+        "p95_ms": percentile_ms(latencies, 95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=60)
+    parser.add_argument("--questions", type=int, default=300)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--corpus", help="Dùng corpus JSON có sẵn thay vì sinh mới")
+    parser.add_argument("--save-corpus", help="Lưu corpus sinh ra ra file JSON")
+    args = parser.parse_args()
+
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as f:
+            corpus = json.load(f)
+    else:
+        corpus = generate_corpus(args.pages, args.questions, args.seed)
+    if args.save_corpus:
+        with open(args.save_corpus, "w", encoding="utf-8") as f:
+            json.dump(corpus, f, ensure_ascii=False, indent=1)
+
+    documents = [
+        Document(page_content=page["text"], metadata={"source": page.get("source", ""), "page": page.get("page", 0)})
+        for page in corpus["pages"]
+    ]
+    start = time.perf_counter()
+    chunks, _ = deduplicate_chunks(split_documents(documents))
+    assign_chunk_ids(chunks)
+    split_seconds = time.perf_counter() - start
+
+    # Chunk đúng của một câu hỏi: mọi chunk chứa đoạn trả lời (overlap có thể tạo ra nhiều hơn một)
+    questions, gold_ids = [], []
+    for item in corpus["questions"]:
+        gold = {chunk.metadata["chunk_id"] for chunk in chunks if item["answer"] in chunk.page_content}
+        if gold:
+            questions.append(item)
+            gold_ids.append(gold)
+    print(f"{len(documents)} pages -> {len(chunks)} chunks in {split_seconds:.2f}s, "
+          f"{len(questions)} labeled questions\n")
+
+    embeddings = DeterministicEmbeddings(args.dimensions)
+
+    start = time.perf_counter()
+    bm25_retriever = create_bm25_retriever(chunks)
+    bm25_retriever.engine.get_scores("")  # Dựng ma trận trọng số ngay để tính vào thời gian build
+    bm25_seconds = time.perf_counter() - start
+    bm25_bytes = bm25_retriever.engine.memory_bytes()
+
+    stores = {}
+    for index_type in ("flat", "sq8", "pq"):
+        start = time.perf_counter()
+        store = create_vector_store(chunks, index_type=index_type, embeddings=embeddings)
+        stores[index_type] = (store, time.perf_counter() - start, index_memory_bytes(store.index))
+
+    def ids_of(documents):
+        return [doc.metadata.get("chunk_id") for doc in documents]
+
+    def hybrid(index_type, fetch_k=None):
+        retriever = create_hybrid_retriever(stores[index_type][0], chunks, bm25_retriever=bm25_retriever,
+                                            fetch_k=fetch_k)
+        return lambda query: ids_of(retriever.retrieve_with_timings(query)[0])
+
+    configs = [
+        ("bm25", lambda q: [int(i) for i in bm25_retriever.engine.top_k(q, args.k)[0]], 0.0, bm25_seconds, bm25_bytes),
+        ("vector mmr (flat)",
+         lambda q: ids_of(max_marginal_relevance_search(stores["flat"][0], q, k=args.k, fetch_k=15, lambda_mult=0.8)),
+         stores["flat"][1], 0.0, stores["flat"][2]),
+    ]
+    for index_type in ("flat", "sq8", "pq"):
+        store, build_seconds, memory = stores[index_type]
+        configs.append((f"hybrid ({index_type})", hybrid(index_type), build_seconds, bm25_seconds, memory + bm25_bytes))
+    store, build_seconds, memory = stores["flat"]
+    configs.append(("hybrid (flat, fetch_k=50)", hybrid("flat", 50), build_seconds, bm25_seconds, memory + bm25_bytes))
+
+    recall_key = f"recall@{args.k}"
+    print(f"{'config':<26} {recall_key:>9} {'mrr':>6} {'p50 ms':>8} {'p95 ms':>8} {'build s':>8} {'memory':>9}")
+    for name, retrieve, vector_seconds, keyword_seconds, memory in configs:
+        row = evaluate(name, retrieve, questions, gold_ids, args.k)
+        print(f"{name:<26} {row[recall_key]:>9.3f} {row['mrr']:>6.3f} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} "
+              f"{vector_seconds + keyword_seconds:>8.2f} {memory / 1024 / 1024:>7.2f}MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# Benchmark chi phí chép file upload ra file tạm riêng (save_upload_to_disk) so với chỉ đọc
+# SpooledTemporaryFile của Starlette để tính fingerprint: phần chênh lệch là bản ghi thứ hai.
+#
+# Chạy: python bench_upload.py --sizes 5 50 200
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from starlette.datastructures import UploadFile
+
+from index import UPLOAD_CHUNK_SIZE, save_upload_to_disk
+from index_store import new_fingerprint_hasher
+
+
+def spooled_upload(data: bytes) -> UploadFile:
+    # Giống Starlette: giữ trong RAM tới 1MB rồi chuyển xuống đĩa
+    spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    spool.write(data)
+    spool.seek(0)
+    return UploadFile(file=spool, filename="bench.pdf")
+
+
+async def hash_only(file: UploadFile) -> str:
+    hasher = new_fingerprint_hasher()
+    while True:
+        block = await file.read(UPLOAD_CHUNK_SIZE)
+        if not block:
+            break
+        hasher.update(block)
+    return hasher.hexdigest()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[5, 50, 200], help="Kích thước file (MB)")
+    parser.add_argument("--repeat", type=int, default=5, help="Lấy thời gian nhỏ nhất qua N lần")
+    args = parser.parse_args()
+
+    print(f"{'MB':>5}  {'hash':>10}  {'hash+chép':>10}  {'chênh lệch':>10}  (ms)")
+    for size in args.sizes:
+        data = os.urandom(size * 1024 * 1024)
+
+        hash_ms = copy_ms = float("inf")
+        for _ in range(args.repeat):
+            upload = spooled_upload(data)
+            start = time.perf_counter()
+            await hash_only(upload)
+            hash_ms = min(hash_ms, 1000 * (time.perf_counter() - start))
+
+            upload = spooled_upload(data)
+            start = time.perf_counter()
+            path, _ = await save_upload_to_disk(upload)
+            copy_ms = min(copy_ms, 1000 * (time.perf_counter() - start))
+            os.unlink(path)
+
+        print(f"{size:>5}  {hash_ms:>10.1f}  {copy_ms:>10.1f}  {copy_ms - hash_ms:>10.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,167 @@
+# chat_memory.py - Quản lý lịch sử chat theo ngân sách token: giữ N lượt gần nhất + tóm tắt cuốn chiếu phần cũ
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from langchain_core.messages import BaseMessage, HumanMessage
+
+from logging_setup import get_logger
+
+logger = get_logger("chat_memory")
+
+# Số lượt hỏi-đáp gần nhất được giữ nguyên văn
+HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "4"))
+# Tổng số token tối đa của phần lịch sử (tóm tắt + các lượt gần nhất) gửi cho agent
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "3000"))
+# Độ dài tối đa của bản tóm tắt
+HISTORY_SUMMARY_MAX_TOKENS = int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", "600"))
+
+# Tóm tắt chạy nền, không làm chậm câu trả lời
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-summary")
+
+SUMMARY_PROMPT = """Bạn đang tóm tắt một cuộc trò chuyện giữa sinh viên và trợ lý học tập UniAI.
+Hãy cập nhật bản tóm tắt hiện có với các lượt trò chuyện mới bên dưới.
+Giữ lại: câu hỏi chính của sinh viên, khái niệm/kết quả quan trọng đã được giải thích, yêu cầu hoặc sở thích của sinh viên.
+Viết ngắn gọn bằng tiếng Việt, tối đa {max_words} từ, không thêm thông tin mới.
+
+Bản tóm tắt hiện có:
+{summary}
+
+Các lượt trò chuyện mới:
+{conversation}
+
+Bản tóm tắt cập nhật:"""
+
+
+def estimate_tokens(text: str) -> int:
+    """Ước lượng số token (~3.5 ký tự/token với văn bản tiếng Việt có dấu), đủ để áp ngân sách"""
+    return int(len(text) / 3.5) + 1 if text else 0
+
+
+def message_tokens(message: BaseMessage) -> int:
+    content = message.content if isinstance(message.content, str) else str(message.content)
+    return estimate_tokens(content) + 4  # Chi phí định dạng vai trò của mỗi message
+
+
+def summarize_messages(llm, previous_summary: str, messages: List[BaseMessage]) -> str:
+    """Gọi LLM để gộp các message cũ vào bản tóm tắt hiện có"""
+    conversation = "\n".join(
+        f"{'Sinh viên' if isinstance(message, HumanMessage) else 'UniAI'}: {message.content}"
+        for message in messages
+    )
+    prompt = SUMMARY_PROMPT.format(
+        summary=previous_summary or "(chưa có)",
+        conversation=conversation,
+        max_words=int(HISTORY_SUMMARY_MAX_TOKENS * 0.7),
+    )
+    return llm.invoke(prompt).content.strip()
+
+
+class ChatMemory:
+    """
+    Lịch sử chat của một session.
+    - messages: toàn bộ lịch sử (dùng cho endpoint history).
+    - Mỗi lượt chỉ gửi cho agent: bản tóm tắt + các lượt gần nhất, trong giới hạn HISTORY_TOKEN_BUDGET.
+    - Sau mỗi câu trả lời, các lượt cũ hơn cửa sổ được gộp vào bản tóm tắt ở thread nền.
+    """
+
+    def __init__(self, messages: Optional[List[BaseMessage]] = None,
+                 summarizer: Optional[Callable[[str, List[BaseMessage]], str]] = None,
+                 keep_turns: int = HISTORY_KEEP_TURNS, token_budget: int = HISTORY_TOKEN_BUDGET):
+        self.messages = messages if messages is not None else []
+        self.summarizer = summarizer
+        self.keep_turns = keep_turns
+        self.token_budget = token_budget
+        self.summary = ""
+        self.summarized_upto = 0  # Số message đầu tiên đã được gộp vào summary
+        self._summarizing = False
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.tokens_sent = 0
+        self.tokens_saved = 0
+
+    def _keep_from(self) -> int:
+        return max(0, len(self.messages) - 2 * self.keep_turns)
+
+    def build_context(self):
+        """Trả về (danh sách message gửi cho agent, thống kê token của request này)"""
+        with self._lock:
+            summary = self.summary
+            # Phần chưa kịp tóm tắt (tóm tắt nền chưa xong) vẫn được gửi nguyên văn
+            recent = list(self.messages[self.summarized_upto:])
+            full_tokens = sum(message_tokens(message) for message in self.messages)
+
+        summary_message = []
+        if summary:
+            summary_message = [HumanMessage(content=f"[Tóm tắt cuộc trò chuyện trước đó]\n{summary}")]
+        budget = self.token_budget - sum(message_tokens(message) for message in summary_message)
+
+        # Bỏ bớt message cũ nhất cho tới khi vừa ngân sách (luôn giữ lượt cuối cùng)
+        recent_tokens = [message_tokens(message) for message in recent]
+        start = 0
+        while start < len(recent) - 2 and sum(recent_tokens[start:]) > budget:
+            start += 1
+        context = summary_message + recent[start:]
+
+        sent_tokens = sum(message_tokens(message) for message in context)
+        usage = {
+            "full_tokens": full_tokens,
+            "sent_tokens": sent_tokens,
+            "tokens_saved": max(0, full_tokens - sent_tokens),
+        }
+        with self._lock:
+            self.requests += 1
+            self.tokens_sent += sent_tokens
+            self.tokens_saved += usage["tokens_saved"]
+        return context, usage
+
+    def add_turn(self, user_message: BaseMessage, ai_message: BaseMessage):
+        """Thêm một lượt hỏi-đáp rồi lên lịch tóm tắt phần đã ra khỏi cửa sổ"""
+        with self._lock:
+            self.messages.extend([user_message, ai_message])
+        self._schedule_summary()
+
+    def _schedule_summary(self):
+        if self.summarizer is None:
+            return
+        with self._lock:
+            end = self._keep_from()
+            if self._summarizing or end <= self.summarized_upto:
+                return
+            self._summarizing = True
+            start, previous = self.summarized_upto, self.summary
+            pending = list(self.messages[start:end])
+        _summary_executor.submit(self._summarize, start, end, previous, pending)
+
+    def _summarize(self, start, end, previous, pending):
+        try:
+            summary = self.summarizer(previous, pending)
+        except Exception as e:
+            # Lượt sau sẽ thử lại; trong lúc đó các message cũ vẫn được gửi nguyên văn (trong ngân sách)
+            logger.warning("History summarization failed", extra={"error": str(e)})
+            with self._lock:
+                self._summarizing = False
+            return
+        with self._lock:
+            if self.summarized_upto == start:
+                self.summary = summary
+                self.summarized_upto = end
+            self._summarizing = False
+        logger.debug("History summarized", extra={"messages_folded": end, "summary_tokens": estimate_tokens(summary)})
+        # Có thể đã có thêm lượt mới trong lúc tóm tắt
+        self._schedule_summary()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "messages": len(self.messages),
+                "summarized_messages": self.summarized_upto,
+                "summary_tokens": estimate_tokens(self.summary),
+                "keep_turns": self.keep_turns,
+                "token_budget": self.token_budget,
+                "requests": self.requests,
+                "tokens_sent": self.tokens_sent,
+                "tokens_saved": self.tokens_saved,
+            }
@@ -0,0 +1,170 @@
+# chunk_dedup.py - Loại bỏ chunk trùng lặp / gần trùng (SimHash) trước khi embed
+
+import hashlib
+import os
+import re
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from logging_setup import get_logger
+
+logger = get_logger("chunk_dedup")
+
+# Hai chunk có SimHash khác nhau <= số bit này được coi là gần trùng
+DEDUP_MAX_HAMMING = int(os.getenv("DEDUP_MAX_HAMMING", "6"))
+DEDUP_SHINGLE_SIZE = 3
+SIMHASH_BITS = 64
+_BIT_SHIFTS = np.arange(SIMHASH_BITS, dtype=np.uint64)
+
+
+# Số trang / số slide kiểu header-footer ("Trang 12", "Slide 3/40", "Page 5 of 9", "- 12 -", dòng chỉ có số).
+# Chỉ các mẫu này bị bỏ số; số trong nội dung (công thức, năm, bảng, số bài tập) được giữ nguyên.
+_PAGE_NUMBER_PATTERNS = [
+    re.compile(r"\b(?:trang|page|slide|tr\.|p\.)\s*\d+(?:\s*(?:/|of|trên)\s*\d+)?"),
+    re.compile(r"^[\s\-–—]*\d+(?:\s*/\s*\d+)?[\s\-–—]*$", re.MULTILINE),
+]
+
+
+def normalize_for_dedup(text: str) -> str:
+    """Chuẩn hóa để so sánh: chữ thường, bỏ số trang/số slide và khoảng trắng thừa"""
+    text = unicodedata.normalize("NFC", text).lower()
+    for pattern in _PAGE_NUMBER_PATTERNS:
+        text = pattern.sub(lambda m: re.sub(r"\d+", "0", m.group(0)), text)  # "Slide 12" và "Slide 13" như nhau
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def simhash(text: str, shingle_size: int = DEDUP_SHINGLE_SIZE) -> int:
+    """SimHash 64-bit trên các shingle gồm shingle_size từ liên tiếp"""
+    words = text.split()
+    if len(words) < shingle_size:
+        shingles = [" ".join(words)]
+    else:
+        shingles = [" ".join(words[i:i + shingle_size]) for i in range(len(words) - shingle_size + 1)]
+
+    hashes = np.array([_hash64(shingle) for shingle in shingles], dtype=np.uint64)
+    # Đếm số shingle bật từng bit (vector hóa thay vì lặp 64 bit cho mỗi shingle)
+    ones = ((hashes[:, None] >> _BIT_SHIFTS) & np.uint64(1)).sum(axis=0)
+    bits = (2 * ones > len(shingles)).astype(np.uint64)
+    return int((bits << _BIT_SHIFTS).sum())
+
+
+def _bands(fingerprint: int, num_bands: int) -> List[Tuple[int, int]]:
+    """
+    Chia fingerprint thành num_bands dải. Với num_bands = max_hamming + 1, hai hash
+    cách nhau <= max_hamming bit chắc chắn trùng khớp ở ít nhất một dải (nguyên lý Dirichlet).
+    """
+    width = SIMHASH_BITS // num_bands
+    mask = (1 << width) - 1
+    return [(band, (fingerprint >> (band * width)) & mask) for band in range(num_bands)]
+
+
+class DedupIndex:
+    """
+    Hash (exact + SimHash theo dải) của các chunk đã giữ lại. Session giữ lại object này
+    để tài liệu thêm sau được so với cả các chunk đã có, không chỉ trong cùng lần upload.
+    """
+
+    def __init__(self, max_hamming: int = DEDUP_MAX_HAMMING):
+        self.max_hamming = max_hamming
+        self.num_bands = max_hamming + 1
+        self.chunks = []
+        self.hashes: List[int] = []
+        self.exact_seen: Dict[str, int] = {}
+        self.band_index: Dict[Tuple[int, int], List[int]] = {}
+
+    @classmethod
+    def from_chunks(cls, chunks, max_hamming: int = DEDUP_MAX_HAMMING) -> "DedupIndex":
+        """Dựng lại từ các chunk đã qua dedup (VD: session nạp từ index đã lưu)"""
+        index = cls(max_hamming)
+        for chunk in chunks:
+            normalized = normalize_for_dedup(chunk.page_content)
+            index.add(chunk, _exact_key(normalized), simhash(normalized))
+        return index
+
+    def find_duplicate(self, exact_key: str, fingerprint: Optional[int]) -> Tuple[Optional[int], str]:
+        """Trả về (vị trí chunk trùng, "exact" | "near") hoặc (None, "")"""
+        position = self.exact_seen.get(exact_key)
+        if position is not None:
+            return position, "exact"
+        candidates = set()
+        for band in _bands(fingerprint, self.num_bands):
+            candidates.update(self.band_index.get(band, ()))
+        for candidate in sorted(candidates):
+            if bin(fingerprint ^ self.hashes[candidate]).count("1") <= self.max_hamming:
+                return candidate, "near"
+        return None, ""
+
+    def add(self, chunk, exact_key: str, fingerprint: int):
+        position = len(self.chunks)
+        self.chunks.append(chunk)
+        self.hashes.append(fingerprint)
+        self.exact_seen[exact_key] = position
+        for band in _bands(fingerprint, self.num_bands):
+            self.band_index.setdefault(band, []).append(position)
+
+
+def _exact_key(normalized: str) -> str:
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+def deduplicate_chunks(chunks, max_hamming: int = DEDUP_MAX_HAMMING,
+                       index: Optional[DedupIndex] = None) -> Tuple[list, Dict]:
+    """
+    Bỏ các chunk trùng hoàn toàn hoặc gần trùng (header/footer, slide lặp lại...).
+    Chunk giữ lại ghi nhận số bản trùng và các trang trùng trong metadata.
+    index: DedupIndex của session để so cả với các chunk đã có (được cập nhật thêm các chunk giữ lại).
+    Trả về (danh sách chunk mới giữ lại, báo cáo).
+    """
+    if index is None:
+        index = DedupIndex(max_hamming)
+    kept = []
+    exact_removed = 0
+    near_removed = 0
+
+    for chunk in chunks:
+        normalized = normalize_for_dedup(chunk.page_content)
+        exact_key = _exact_key(normalized)
+        fingerprint = None if exact_key in index.exact_seen else simhash(normalized)
+        duplicate_of, kind = index.find_duplicate(exact_key, fingerprint)
+
+        if duplicate_of is not None:
+            if kind == "exact":
+                exact_removed += 1
+            else:
+                near_removed += 1
+            # Gộp: giữ chunk đầu tiên, ghi lại nơi bản trùng xuất hiện
+            original = index.chunks[duplicate_of]
+            original.metadata['duplicate_count'] = original.metadata.get('duplicate_count', 0) + 1
+            page = chunk.metadata.get('page_number')
+            if page is not None:
+                original.metadata.setdefault('duplicate_pages', []).append(page)
+            continue
+
+        kept.append(chunk)
+        index.add(chunk, exact_key, fingerprint)
+
+    report = {
+        "input_chunks": len(chunks),
+        "kept_chunks": len(kept),
+        "removed_exact": exact_removed,
+        "removed_near_duplicate": near_removed,
+        "removed_total": exact_removed + near_removed,
+    }
+    if report["removed_total"]:
+        logger.debug("Dedup removed chunks", extra=report)
+    return kept, report
+
+
+def merge_dedup_reports(*reports) -> Dict:
+    """Cộng dồn báo cáo dedup (VD: lần upload đầu + các lần thêm tài liệu)"""
+    merged: Dict[str, int] = {}
+    for report in reports:
+        for key, value in (report or {}).items():
+            merged[key] = merged.get(key, 0) + value
+    return merged
@@ -0,0 +1,94 @@
+# clients.py - Registry client dùng chung cho cả process (LLM, embedding, TTS, web search)
+#
+# Mỗi client chỉ được tạo một lần và dùng lại cho mọi session/request, nên các kết nối
+# HTTP (keep-alive) và kênh gRPC được giữ lại thay vì bắt tay TLS lại ở mỗi lần dùng.
+
+import os
+import threading
+import time
+from typing import Any, Callable, Dict
+
+import httpx
+
+from logging_setup import get_logger
+
+logger = get_logger("clients")
+
+# Connection pool của HTTP client dùng chung
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "90"))
+# Mở sẵn kết nối TLS tới các API khi khởi động server (bật trên production; mặc định tắt để test/dev không gọi ra ngoài)
+CLIENT_PRECONNECT = os.getenv("CLIENT_PRECONNECT", "0") == "1"
+PRECONNECT_URLS = ["https://api.openai.com/v1/models", "https://api.tavily.com/"]
+
+_clients: Dict[str, Any] = {}
+_build_seconds: Dict[str, float] = {}
+# RLock vì factory của client này có thể lấy client khác (VD: embeddings cần HTTP client)
+_lock = threading.RLock()
+
+
+def get_client(name: str, factory: Callable[[], Any]) -> Any:
+    """Trả về client đã tạo theo tên, hoặc tạo bằng factory ở lần gọi đầu tiên"""
+    client = _clients.get(name)
+    if client is not None:
+        return client
+    with _lock:
+        client = _clients.get(name)
+        if client is None:
+            start = time.perf_counter()
+            client = factory()
+            _build_seconds[name] = time.perf_counter() - start
+            _clients[name] = client
+            logger.debug("Client created", extra={"client": name, "seconds": round(_build_seconds[name], 2)})
+        return client
+
+
+def _http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def get_http_client() -> httpx.Client:
+    """HTTP client đồng bộ có connection pool, dùng chung cho các SDK gọi API qua HTTP"""
+    return get_client("http", lambda: httpx.Client(limits=_http_limits(), timeout=HTTP_TIMEOUT))
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    return get_client("http_async", lambda: httpx.AsyncClient(limits=_http_limits(), timeout=HTTP_TIMEOUT))
+
+
+def get_openai_client(base_url=None):
+    """OpenAI client (TTS, embeddings) chạy trên connection pool dùng chung"""
+    from openai import OpenAI
+    return get_client(f"openai:{base_url or 'default'}", lambda: OpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"), base_url=base_url, http_client=get_http_client()
+    ))
+
+
+def get_async_openai_client(base_url=None):
+    from openai import AsyncOpenAI
+    return get_client(f"openai_async:{base_url or 'default'}", lambda: AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"), base_url=base_url, http_client=get_async_http_client()
+    ))
+
+
+def preconnect():
+    """Mở sẵn kết nối keep-alive tới các API (chạy nền khi khởi động, lỗi thì bỏ qua)"""
+    http_client = get_http_client()
+    for url in PRECONNECT_URLS:
+        try:
+            http_client.head(url, timeout=5)
+        except httpx.HTTPError as e:
+            logger.warning("Preconnect failed", extra={"url": url, "error": str(e)})
+
+
+def client_stats() -> dict:
+    """Các client đã tạo và thời gian khởi tạo của chúng"""
+    with _lock:
+        return {name: {"type": type(client).__name__, "build_seconds": round(_build_seconds.get(name, 0.0), 3)}
+                for name, client in _clients.items()}
@@ -0,0 +1,321 @@
+# embedding_cache.py - Cache embedding theo nội dung (content-addressed) lưu trên đĩa
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from logging_setup import get_logger
+
+logger = get_logger("embedding_cache")
+
+# Cấu hình mặc định (có thể ghi đè bằng biến môi trường)
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", os.path.join(".cache", "embeddings"))
+EMBEDDING_CACHE_MAX_MB = float(os.getenv("EMBEDDING_CACHE_MAX_MB", "512"))
+# Cache vector của câu hỏi dùng chung mọi session: số vector giữ trong RAM và có lưu xuống đĩa hay không
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "4096"))
+QUERY_EMBEDDING_CACHE_DISK = os.getenv("QUERY_EMBEDDING_CACHE_DISK", "1") == "1"
+
+
+def embedding_cache_key(text: str, model: str, dimensions: Optional[int]) -> str:
+    """Tạo key sha256 từ (nội dung chunk, model, số chiều)"""
+    digest = hashlib.sha256()
+    digest.update(f"{model}\x1f{dimensions or ''}\x1f".encode("utf-8"))
+    digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class EmbeddingDiskCache:
+    """
+    Kho vector trên đĩa (SQLite) có giới hạn dung lượng.
+    Khi vượt quá max_bytes sẽ xóa các bản ghi ít được dùng gần đây nhất (LRU).
+    """
+
+    def __init__(self, cache_dir: str = EMBEDDING_CACHE_DIR, max_mb: float = EMBEDDING_CACHE_MAX_MB):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "embeddings.sqlite3")
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """Lấy nhiều vector một lần, cập nhật thời điểm truy cập"""
+        found = {}
+        if not keys:
+            return found
+        now = time.time()
+        with self._lock:
+            # SQLite giới hạn số tham số trong một câu lệnh, nên chia nhỏ
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+            if found:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        """Lưu nhiều vector (float32) và dọn bớt nếu vượt dung lượng"""
+        if not items:
+            return
+        now = time.time()
+        rows = []
+        for key, vector in items.items():
+            blob = array("f", vector).tobytes()
+            rows.append((key, blob, len(blob), now))
+        with self._lock:
+            keys = list(items)
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                replaced = self._conn.execute(
+                    f"SELECT COALESCE(SUM(size), 0) FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchone()[0]
+                self._total_bytes -= replaced
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, size, last_access) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._total_bytes += sum(row[2] for row in rows)
+            self._evict_locked()
+            self._conn.commit()
+
+    def _evict_locked(self):
+        """Xóa các vector cũ nhất cho tới khi dung lượng về dưới 90% giới hạn"""
+        if self._total_bytes <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        evicted = 0
+        while self._total_bytes > target:
+            rows = self._conn.execute(
+                "SELECT key, size FROM embeddings ORDER BY last_access ASC LIMIT 256"
+            ).fetchall()
+            if not rows:
+                break
+            freed_keys = []
+            for key, size in rows:
+                freed_keys.append((key,))
+                self._total_bytes -= size
+                evicted += 1
+                if self._total_bytes <= target:
+                    break
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", freed_keys)
+        logger.debug("Embedding cache evicted", extra={"vectors": evicted, "bytes_remaining": self._total_bytes})
+
+    def size_bytes(self) -> int:
+        return self._total_bytes
+
+
+def normalize_query_for_embedding(text: str) -> str:
+    """Chuẩn hóa câu hỏi trước khi tra cache: NFC, chữ thường, gộp khoảng trắng (giữ nguyên dấu)"""
+    return " ".join(unicodedata.normalize("NFC", text).lower().split())
+
+
+class QueryEmbeddingCache:
+    """
+    Cache vector câu hỏi theo (model, câu hỏi đã chuẩn hóa), dùng chung cho cả process.
+    Vector câu hỏi không phụ thuộc session nên sinh viên hỏi cùng một câu chỉ tốn một lần gọi API.
+    Tầng RAM là LRU giới hạn số vector (lưu float32); tầng đĩa dùng chung EmbeddingDiskCache.
+    """
+
+    def __init__(self, max_entries: int = QUERY_EMBEDDING_CACHE_SIZE,
+                 store: Optional[EmbeddingDiskCache] = None):
+        self.max_entries = max_entries
+        self.store = store
+        self._entries: "OrderedDict[str, array]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(text: str, model: str, dimensions: Optional[int]) -> str:
+        # Tiền tố "query" để không lẫn với key của chunk tài liệu trong cùng kho đĩa
+        return "query:" + embedding_cache_key(normalize_query_for_embedding(text), model, dimensions)
+
+    def get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector.tolist()
+        if self.store is not None:
+            found = self.store.get_many([key])
+            if key in found:
+                self._remember(key, found[key])
+                with self._lock:
+                    self.disk_hits += 1
+                return found[key]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, vector: List[float]):
+        self._remember(key, vector)
+        if self.store is not None:
+            self.store.put_many({key: vector})
+
+    def _remember(self, key: str, vector: List[float]):
+        with self._lock:
+            self._entries[key] = array("f", vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "memory_hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "memory_bytes": sum(v.itemsize * len(v) for v in self._entries.values()),
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Bọc một embedding model: chỉ gọi API cho những chunk chưa có trong cache.
+    Upload lại cùng một tài liệu sẽ bỏ qua hoàn toàn bước gọi mạng.
+    """
+
+    def __init__(self, underlying: Embeddings, model: str, dimensions: Optional[int] = None,
+                 store: Optional[EmbeddingDiskCache] = None):
+        self.underlying = underlying
+        self.model = model
+        self.dimensions = dimensions
+        self.store = store or get_embedding_store()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [embedding_cache_key(text, self.model, self.dimensions) for text in texts]
+        cached = self.store.get_many(list(set(keys)))
+
+        # Gom các text chưa có (loại trùng lặp trong cùng batch)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        hits = sum(1 for key in keys if key in cached)
+        _stats.record(hits=hits, misses=len(keys) - hits)
+
+        if missing:
+            start = time.perf_counter()
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            _stats.record_api_call(len(missing), time.perf_counter() - start)
+            fresh = dict(zip(missing.keys(), vectors))
+            self.store.put_many(fresh)
+            cached.update(fresh)
+
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        query_cache = get_query_embedding_cache()
+        key = query_cache.make_key(text, self.model, self.dimensions)
+        vector = query_cache.get(key)
+        if vector is None:
+            vector = self.underlying.embed_query(text)
+            query_cache.put(key, vector)
+        return vector
+
+
+class EmbeddingCacheStats:
+    """Bộ đếm hit/miss để đo lượng latency và chi phí tiết kiệm được"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.api_calls = 0
+        self.api_seconds = 0.0
+
+    def record(self, hits: int, misses: int):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def record_api_call(self, num_texts: int, seconds: float):
+        with self._lock:
+            self.api_calls += 1
+            self.api_seconds += seconds
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            # Ước lượng thời gian tiết kiệm từ latency trung bình trên mỗi chunk bị miss
+            per_text = self.api_seconds / self.misses if self.misses else 0.0
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "api_calls": self.api_calls,
+                "api_seconds": round(self.api_seconds, 3),
+                "estimated_seconds_saved": round(per_text * self.hits, 3),
+            }
+
+
+_stats = EmbeddingCacheStats()
+_store = None
+_store_lock = threading.Lock()
+_query_cache = None
+
+
+def get_embedding_store() -> EmbeddingDiskCache:
+    """Trả về kho cache dùng chung cho cả process"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = EmbeddingDiskCache()
+        return _store
+
+
+def get_query_embedding_cache() -> QueryEmbeddingCache:
+    """Trả về cache vector câu hỏi dùng chung cho mọi session"""
+    global _query_cache
+    if _query_cache is None:
+        store = get_embedding_store() if QUERY_EMBEDDING_CACHE_DISK else None
+        with _store_lock:
+            if _query_cache is None:
+                _query_cache = QueryEmbeddingCache(store=store)
+    return _query_cache
+
+
+def get_embedding_cache_stats() -> Dict:
+    stats = _stats.snapshot()
+    stats["disk_bytes"] = get_embedding_store().size_bytes()
+    stats["query_cache"] = get_query_embedding_cache().stats()
+    return stats
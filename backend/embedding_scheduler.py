@@ -0,0 +1,146 @@
+# embedding_scheduler.py - Gửi embedding theo batch, chạy song song và tự giảm tốc khi bị rate limit (429)
+
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from logging_setup import get_logger
+
+logger = get_logger("embedding_scheduler")
+
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_MAX_CONCURRENCY = int(os.getenv("EMBED_MAX_CONCURRENCY", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "6"))
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Nhận diện lỗi 429 từ OpenAI SDK, httpx/requests hoặc server giả lập"""
+    if getattr(error, "status_code", None) == 429:
+        return True
+    response = getattr(error, "response", None)
+    if getattr(response, "status_code", None) == 429:
+        return True
+    return type(error).__name__ == "RateLimitError"
+
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    """Đọc header Retry-After nếu server có gửi"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveLimiter:
+    """
+    Giới hạn số batch đang chạy theo kiểu AIMD:
+    giảm một nửa khi gặp 429, tăng dần lại sau mỗi chuỗi request thành công.
+    """
+
+    def __init__(self, max_limit: int):
+        self.max_limit = max(1, max_limit)
+        self.limit = self.max_limit
+        self.in_flight = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, rate_limited: bool = False):
+        with self._cond:
+            self.in_flight -= 1
+            if rate_limited:
+                self.limit = max(1, self.limit // 2)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self.limit < self.max_limit and self._successes >= self.limit:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+
+class EmbeddingScheduler:
+    """Chia texts thành các batch và embed song song, giữ nguyên thứ tự kết quả"""
+
+    def __init__(self, embeddings, batch_size: int = EMBED_BATCH_SIZE,
+                 max_concurrency: int = EMBED_MAX_CONCURRENCY, max_retries: int = EMBED_MAX_RETRIES,
+                 base_delay: float = 1.0, max_delay: float = 30.0):
+        self.embeddings = embeddings
+        self.batch_size = max(1, batch_size)
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rate_limited_count = 0
+        self._count_lock = threading.Lock()  # Các batch retry trên nhiều thread cùng lúc
+
+    def _embed_batch(self, limiter: AdaptiveLimiter, batch: List[str]) -> List[List[float]]:
+        attempt = 0
+        while True:
+            limiter.acquire()
+            try:
+                vectors = self.embeddings.embed_documents(batch)
+            except Exception as e:
+                rate_limited = is_rate_limit_error(e)
+                limiter.release(rate_limited=rate_limited)
+                if not rate_limited or attempt >= self.max_retries:
+                    raise
+                with self._count_lock:
+                    self.rate_limited_count += 1
+                # Exponential backoff + jitter, ưu tiên Retry-After từ server
+                delay = _retry_after_seconds(e)
+                if delay is None:
+                    delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+                    delay *= random.uniform(0.5, 1.0)
+                attempt += 1
+                logger.warning("Embedding rate limited", extra={
+                    "attempt": attempt, "max_retries": self.max_retries,
+                    "delay_seconds": round(delay, 1), "concurrency": limiter.limit,
+                })
+                time.sleep(delay)
+                continue
+            limiter.release()
+            return vectors
+
+    def embed(self, texts: List[str], progress: Optional[Callable[[float], None]] = None) -> List[List[float]]:
+        """Embed toàn bộ texts; progress(fraction) được gọi sau mỗi batch hoàn thành"""
+        if not texts:
+            return []
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        limiter = AdaptiveLimiter(self.max_concurrency)
+        results: List[Optional[List[List[float]]]] = [None] * len(batches)
+        done = 0
+        done_lock = threading.Lock()
+        start = time.perf_counter()
+
+        def run(index: int):
+            nonlocal done
+            results[index] = self._embed_batch(limiter, batches[index])
+            with done_lock:
+                done += 1
+                if progress:
+                    progress(done / len(batches))
+
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches)),
+                                thread_name_prefix="embed") as executor:
+            # list() để lỗi trong batch bất kỳ được raise ra ngoài
+            list(executor.map(run, range(len(batches))))
+
+        logger.debug("Embedded texts", extra={
+            "texts": len(texts), "batches": len(batches),
+            "seconds": round(time.perf_counter() - start, 2), "rate_limited_retries": self.rate_limited_count,
+        })
+        return [vector for batch in results for vector in batch]
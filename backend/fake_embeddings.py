@@ -0,0 +1,159 @@
+# fake_embeddings.py - Embedding giả lập (tất định, không cần mạng) và server tương thích OpenAI /v1/embeddings
+#
+# Chạy server: python fake_embeddings.py --port 8765 --rate-limit-every 5
+# Rồi trỏ backend tới: EMBEDDING_API_BASE=http://127.0.0.1:8765/v1 OPENAI_API_KEY=fake
+
+import argparse
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+DEFAULT_DIMENSIONS = 1536
+
+
+def deterministic_embedding(text, dimensions: int = DEFAULT_DIMENSIONS) -> List[float]:
+    """
+    Vector tất định theo hashing trick: mỗi từ (và cặp từ liền kề) cộng ±1 vào một chiều.
+    Các đoạn văn có nhiều từ chung sẽ có cosine similarity cao, đủ để test retrieval.
+    """
+    if isinstance(text, list):
+        # OpenAIEmbeddings có thể gửi token ids thay vì chuỗi
+        tokens = [str(t) for t in text]
+    else:
+        tokens = re.findall(r"\w+", text.lower())
+    features = tokens + [f"{a}_{b}" for a, b in zip(tokens, tokens[1:])]
+
+    vector = [0.0] * dimensions
+    for feature in features:
+        digest = hashlib.md5(feature.encode("utf-8")).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dimensions
+        vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector))
+    if norm == 0:
+        # Text rỗng: trả về vector đơn vị cố định để tránh chia cho 0
+        vector[0] = 1.0
+        return vector
+    return [v / norm for v in vector]
+
+
+try:
+    from langchain_core.embeddings import Embeddings
+except ImportError:  # Cho phép chạy server độc lập mà không cần langchain
+    Embeddings = object
+
+
+class DeterministicEmbeddings(Embeddings):
+    """Embedding model chạy cục bộ, dùng cho benchmark/test offline"""
+
+    def __init__(self, dimensions: int = DEFAULT_DIMENSIONS):
+        self.dimensions = dimensions
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [deterministic_embedding(text, self.dimensions) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return deterministic_embedding(text, self.dimensions)
+
+
+class FakeEmbeddingHandler(BaseHTTPRequestHandler):
+    """Xử lý POST /v1/embeddings theo định dạng của OpenAI"""
+
+    server_version = "FakeEmbeddings/1.0"
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/embeddings"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+
+        state = self.server.state
+        with state["lock"]:
+            state["requests"] += 1
+            request_number = state["requests"]
+            state["in_flight"] += 1
+            state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+        try:
+            every = state["rate_limit_every"]
+            if every and request_number % every == 0:
+                with state["lock"]:
+                    state["rate_limited"] += 1
+                self._send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                                headers={"Retry-After": str(state["retry_after"])})
+                return
+
+            if state["latency"]:
+                time.sleep(state["latency"])
+
+            inputs = payload.get("input", [])
+            if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+                inputs = [inputs]
+            dimensions = payload.get("dimensions") or state["dimensions"]
+            data = [
+                {"object": "embedding", "index": i, "embedding": deterministic_embedding(text, dimensions)}
+                for i, text in enumerate(inputs)
+            ]
+            self._send_json(200, {
+                "object": "list",
+                "data": data,
+                "model": payload.get("model", "fake-embedding"),
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            })
+        finally:
+            with state["lock"]:
+                state["in_flight"] -= 1
+
+    def _send_json(self, status, body, headers=None):
+        raw = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, format, *args):
+        pass  # Tắt log mỗi request
+
+
+def start_fake_embedding_server(port: int = 0, latency: float = 0.0, rate_limit_every: int = 0,
+                                retry_after: float = 0.1, dimensions: int = DEFAULT_DIMENSIONS):
+    """Chạy server trên thread nền; trả về (server, base_url). Gọi server.shutdown() để dừng."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeEmbeddingHandler)
+    server.daemon_threads = True
+    server.state = {
+        "lock": threading.Lock(),
+        "requests": 0,
+        "rate_limited": 0,
+        "in_flight": 0,
+        "max_in_flight": 0,
+        "latency": latency,
+        "rate_limit_every": rate_limit_every,
+        "retry_after": retry_after,
+        "dimensions": dimensions,
+    }
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible embedding server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="Độ trễ giả lập mỗi request (giây)")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="Trả 429 cho mỗi request thứ N")
+    args = parser.parse_args()
+
+    server, base_url = start_fake_embedding_server(args.port, args.latency, args.rate_limit_every)
+    print(f"Fake embedding server running at {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
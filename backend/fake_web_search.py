@@ -0,0 +1,53 @@
+# fake_web_search.py - Backend web search giả lập (tất định, không cần mạng / API key)
+#
+# Bật bằng WEB_SEARCH_BACKEND=fake. Có thể cung cấp kết quả cố định qua file JSON
+# WEB_SEARCH_FAKE_RESULTS = {"<câu truy vấn>": [{"url": "...", "content": "..."}]}
+
+import hashlib
+import json
+import os
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from langchain_core.tools import BaseTool
+
+WEB_SEARCH_FAKE_RESULTS = os.getenv("WEB_SEARCH_FAKE_RESULTS")
+
+
+@lru_cache(maxsize=None)
+def load_fake_results(path: Optional[str]) -> Dict[str, List[dict]]:
+    if not path:
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class FakeWebSearchTool(BaseTool):
+    """Trả về kết quả cùng định dạng TavilySearchResults (list {"url", "content"}) và đếm số lần được gọi"""
+
+    name: str = "web_search"
+    description: str = "Fake web search for tests."
+    max_results: int = 3
+    results: Dict[str, List[dict]] = {}  # Ghi đè kết quả theo câu truy vấn (mặc định đọc từ WEB_SEARCH_FAKE_RESULTS)
+    calls: Dict[str, int] = {}
+
+    def search(self, query: str) -> List[dict]:
+        self.calls[query] = self.calls.get(query, 0) + 1
+        fixed = self.results.get(query) or load_fake_results(WEB_SEARCH_FAKE_RESULTS).get(query)
+        if fixed:
+            return fixed[:self.max_results]
+        slug = hashlib.sha1(query.encode("utf-8")).hexdigest()[:10]
+        return [
+            {"url": f"https://search.example.test/{slug}/{i}", "content": f"Kết quả giả lập {i + 1} cho: {query}"}
+            for i in range(self.max_results)
+        ]
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def _run(self, query: str, run_manager=None) -> List[dict]:
+        return self.search(query)
+
+    async def _arun(self, query: str, run_manager=None) -> List[dict]:
+        return self.search(query)
@@ -0,0 +1,157 @@
+# hybrid_retriever.py - Hybrid retriever: vector (MMR) và BM25 chạy song song, hợp nhất bằng reciprocal-rank fusion
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from metrics import observe_stage
+from logging_setup import get_logger
+from mmr import max_marginal_relevance_search
+
+logger = get_logger("hybrid_retriever")
+
+# Thread pool dùng chung để chạy nhánh vector search song song với BM25
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "8"))
+_retrieval_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+
+# Hằng số c trong RRF: score = weight / (c + rank)
+RRF_C = 60
+# Trọng số (vector, keyword) khi hợp nhất, ví dụ HYBRID_WEIGHTS="0.7,0.3"
+HYBRID_WEIGHTS = [float(w) for w in os.getenv("HYBRID_WEIGHTS", "0.7,0.3").split(",")]
+# Số ứng viên đưa vào MMR; MMR vector hóa nên tăng fetch_k gần như không tốn thêm
+MMR_FETCH_K = int(os.getenv("MMR_FETCH_K", "15"))
+
+
+def reciprocal_rank_fusion(ranked_lists: List[List[int]], weights: List[float], c: int = RRF_C) -> List[int]:
+    """Hợp nhất các danh sách chunk id đã xếp hạng bằng weighted RRF"""
+    scores: Dict[int, float] = {}
+    for ranked, weight in zip(ranked_lists, weights):
+        for rank, chunk_id in enumerate(ranked, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + weight / (c + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Thay cho EnsembleRetriever: hai nhánh chạy đồng thời nên latency của
+    document_search bằng max(vector, bm25) thay vì tổng của chúng.
+    Các chunk được định danh bằng metadata['chunk_id'] (vị trí trong text_chunks).
+    """
+
+    vector_store: Any
+    bm25_retriever: Any
+    k: int = 4
+    fetch_k: int = MMR_FETCH_K
+    lambda_mult: float = 0.8
+    weights: List[float] = [0.7, 0.3]
+    c: int = RRF_C
+    # Cache kết quả theo câu hỏi đã chuẩn hóa (RetrievalCache của session), None để tắt
+    cache: Optional[Any] = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _vector_search(self, query: str) -> Tuple[List[Document], float]:
+        start = time.perf_counter()
+        docs = max_marginal_relevance_search(
+            self.vector_store, query, k=self.k, fetch_k=self.fetch_k, lambda_mult=self.lambda_mult
+        )
+        return docs, time.perf_counter() - start
+
+    def _keyword_search(self, query: str) -> Tuple[List[int], float]:
+        start = time.perf_counter()
+        indices, _ = self.bm25_retriever.engine.top_k(query, self.bm25_retriever.k)
+        return [int(i) for i in indices], time.perf_counter() - start
+
+    def _cache_lookup(self, query: str):
+        """Trả về (generation, documents nếu cache hit)"""
+        # Số chunk của index làm "thế hệ" cache: thêm tài liệu thì cache tự bị xóa
+        generation = len(self.bm25_retriever.docs)
+        if self.cache is None:
+            return generation, None
+        return generation, self.cache.get(query, generation)
+
+    def _fuse(self, query: str, generation, vector_result, keyword_result, start: float):
+        vector_docs, vector_seconds = vector_result
+        keyword_ids, keyword_seconds = keyword_result
+
+        fuse_start = time.perf_counter()
+        chunks = self.bm25_retriever.docs
+        by_id: Dict[int, Document] = {}
+        vector_ids = []
+        for doc in vector_docs:
+            chunk_id = doc.metadata.get('chunk_id')
+            if chunk_id is None:
+                # Index cũ không có chunk_id: dùng id âm để không trùng với chunk thật
+                chunk_id = -(len(by_id) + 1)
+            by_id.setdefault(chunk_id, doc)
+            vector_ids.append(chunk_id)
+        for chunk_id in keyword_ids:
+            by_id.setdefault(chunk_id, chunks[chunk_id])
+
+        fused = reciprocal_rank_fusion([vector_ids, keyword_ids], self.weights, self.c)
+        documents = [by_id[chunk_id] for chunk_id in fused]
+        end = time.perf_counter()
+
+        if self.cache is not None:
+            self.cache.put(query, tuple(documents), generation)
+
+        timings = {
+            "cache_hit": False,
+            "vector_ms": round(vector_seconds * 1000, 2),
+            "keyword_ms": round(keyword_seconds * 1000, 2),
+            "fusion_ms": round((end - fuse_start) * 1000, 2),
+            "total_ms": round((end - start) * 1000, 2),
+        }
+        return documents, timings
+
+    def retrieve_with_timings(self, query: str) -> Tuple[List[Document], Dict[str, Any]]:
+        """Chạy hai nhánh đồng thời, trả về (documents, thời gian từng giai đoạn tính bằng ms)"""
+        start = time.perf_counter()
+        generation, cached = self._cache_lookup(query)
+        if cached is not None:
+            return list(cached), {"cache_hit": True, "total_ms": round((time.perf_counter() - start) * 1000, 2)}
+
+        vector_future = _retrieval_executor.submit(self._vector_search, query)
+        keyword_result = self._keyword_search(query)
+        return self._fuse(query, generation, vector_future.result(), keyword_result, start)
+
+    async def aretrieve_with_timings(self, query: str) -> Tuple[List[Document], Dict[str, Any]]:
+        """Bản async: cả hai nhánh chạy trên thread pool, event loop không bị chặn"""
+        start = time.perf_counter()
+        generation, cached = self._cache_lookup(query)
+        if cached is not None:
+            return list(cached), {"cache_hit": True, "total_ms": round((time.perf_counter() - start) * 1000, 2)}
+
+        loop = asyncio.get_running_loop()
+        vector_result, keyword_result = await asyncio.gather(
+            loop.run_in_executor(_retrieval_executor, self._vector_search, query),
+            loop.run_in_executor(_retrieval_executor, self._keyword_search, query),
+        )
+        return self._fuse(query, generation, vector_result, keyword_result, start)
+
+    def _record(self, timings: Dict[str, Any]):
+        # Không lưu lên retriever: retriever dùng chung cho mọi request của session.
+        # Cần thời gian của đúng một truy vấn thì gọi retrieve_with_timings / aretrieve_with_timings.
+        observe_stage("retrieval", timings["total_ms"] / 1000)
+        if not timings["cache_hit"]:
+            observe_stage("retrieval_vector", timings["vector_ms"] / 1000)
+            observe_stage("retrieval_keyword", timings["keyword_ms"] / 1000)
+        logger.debug("Hybrid retrieval", extra=timings)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        documents, timings = self.retrieve_with_timings(query)
+        self._record(timings)
+        return documents
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        documents, timings = await self.aretrieve_with_timings(query)
+        self._record(timings)
+        return documents
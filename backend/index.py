@@ -1,9 +1,10 @@
 # backend/api.py - FastAPI Backend cho UniAI
 
 from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
 from typing import List, Optional
 import os
@@ -19,14 +20,33 @@ import base64
 import io
 import html
 import json
+import time
+import threading
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 # Import từ agent_core hiện tại
-from agent_core import load_documents, split_documents, create_vector_store, create_agent_executor,get_generation_llm,generate_essay_questions_logic 
+from agent_core import create_agent_executor,create_hybrid_retriever,create_query_router,get_generation_llm,get_embeddings,generate_essay_questions_logic,warm_up_clients,index_config
 from prompt_template import AGENT_SYSTEM_PROMPT,ESSAY_GENERATION_PROMPT_RAG, ESSAY_GENERATION_PROMPT_TOPIC
 from podcast_generator import PodcastGenerator
+from clients import get_client, client_stats, preconnect, CLIENT_PRECONNECT
+from embedding_cache import get_embedding_cache_stats
+from index_store import new_fingerprint_hasher, combine_fingerprints, save_index
+from ingestion import IngestionJob, run_ingestion, run_append
+from chunk_dedup import DedupIndex, merge_dedup_reports
+from retrieval_cache import RetrievalCache
+from chat_memory import ChatMemory, summarize_messages
+from answer_cache import answer_cache
+from query_router import NoAnswerInDocuments, router_stats
+from tool_cache import tool_run_scope, tool_cache_stats, get_web_search_cache
+from metrics import MetricsMiddleware, Gauge, registry, span
+from logging_setup import setup_logging, get_logger
+from vector_index import describe_index
 from langchain_core.messages import HumanMessage, AIMessage
 
 # 1. Load file .env trước
 load_dotenv()
+setup_logging()
+logger = get_logger("index")
 
 # 2. Xử lý Logic chọn API Key (Primary vs Backup)
 def configure_google_api_key():
@@ -63,6 +83,23 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Đếm request / latency theo endpoint và số request đang xử lý cho /metrics
+app.add_middleware(MetricsMiddleware, routes=app.router.routes)
+
+def warm_up():
+    """Tạo sẵn client dùng chung và mở kết nối tới API (chạy nền, không chặn khởi động)"""
+    try:
+        warm_up_clients()
+        get_client("podcast_generator", PodcastGenerator)
+        if CLIENT_PRECONNECT:
+            preconnect()
+    except Exception as e:
+        logger.warning("Client warm-up failed", extra={"error": str(e)})
+
+@app.on_event("startup")
+async def start_client_warm_up():
+    threading.Thread(target=warm_up, name="client-warm-up", daemon=True).start()
+
 # Cấu hình upload folder cho quiz
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'pdf', 'docx'}
@@ -70,6 +107,173 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 # Lưu trữ sessions
 sessions = {}
+registry.register(Gauge("sessions_active", "Chat sessions held in memory.", function=lambda: len(sessions)))
+
+# Job ingestion chạy nền (key = job_id = session_id)
+ingestion_jobs = {}
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "2"))
+INGESTION_JOB_TTL = 3600  # Giữ trạng thái job đã xong trong 1 giờ
+ingestion_executor = ThreadPoolExecutor(max_workers=INGESTION_WORKERS, thread_name_prefix="ingestion")
+
+# Kích thước mỗi khối khi ghi file upload xuống đĩa
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Số lượt chat được chạy agent cùng lúc; các request còn lại chờ thay vì dồn hết vào LLM
+CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", "32"))
+chat_semaphore = asyncio.Semaphore(CHAT_MAX_CONCURRENCY)
+
+class UploadedPDF:
+    """File PDF đã được ghi xuống đĩa, load_documents đọc trực tiếp từ path"""
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+
+async def save_upload_to_disk(file: UploadFile, suffix='.pdf'):
+    """
+    Ghi file upload xuống đĩa theo từng khối và tính fingerprint trong cùng một lượt đọc.
+    Starlette đã spool upload vào SpooledTemporaryFile, nhưng file đó không có path (process con
+    trích xuất PDF cần path) và bị đóng khi request kết thúc, trước khi job ingestion chạy nền xong,
+    nên vẫn phải chép ra một file tạm riêng.
+    """
+    hasher = new_fingerprint_hasher()
+    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+    try:
+        while True:
+            block = await file.read(UPLOAD_CHUNK_SIZE)
+            if not block:
+                break
+            hasher.update(block)
+            temp_file.write(block)
+    except Exception:
+        temp_file.close()
+        os.unlink(temp_file.name)
+        raise
+    temp_file.close()
+    return temp_file.name, hasher.hexdigest()
+
+async def save_uploaded_pdfs(files: List[UploadFile], temp_files: list):
+    """Kiểm tra và lưu các file PDF upload; trả về (danh sách UploadedPDF, fingerprint của từng file)"""
+    uploaded_files = []
+    file_fingerprints = []
+    for file in files:
+        if not file.filename.endswith('.pdf'):
+            raise HTTPException(status_code=400, detail=f"File {file.filename} không phải PDF")
+        
+        # Stream file xuống đĩa theo khối, không giữ toàn bộ nội dung trong RAM
+        temp_path, file_fingerprint = await save_upload_to_disk(file)
+        temp_files.append(temp_path)
+        file_fingerprints.append(file_fingerprint)
+        
+        uploaded_files.append(UploadedPDF(file.filename, temp_path))
+    return uploaded_files, file_fingerprints
+
+def cleanup_temp_files(temp_files):
+    for temp_file in temp_files:
+        if os.path.exists(temp_file):
+            os.unlink(temp_file)
+
+def build_session(session_id, uploaded_files, file_fingerprints, temp_files, progress=None):
+    """Chạy ingestion và tạo agent cho session (blocking - chạy trong thread pool)"""
+    try:
+        fingerprint = combine_fingerprints(file_fingerprints, index_config())
+        result = run_ingestion(uploaded_files, fingerprint, progress=progress)
+        chunks = result['text_chunks']
+        retrieval_cache = RetrievalCache()
+        
+        # Retriever dùng chung cho agent (tool document_search) và luồng trả lời nhanh của router
+        retriever = create_hybrid_retriever(
+            result['vector_store'], chunks, bm25_retriever=result['bm25_retriever'], cache=retrieval_cache
+        )
+        agent_executor = create_agent_executor(result['vector_store'], AGENT_SYSTEM_PROMPT, retriever=retriever)
+        
+        # Lưu session
+        sessions[session_id] = {
+            'agent_executor': agent_executor,
+            'retriever': retriever,
+            'router': create_query_router(agent_executor, retriever),
+            'text_chunks': chunks,  # Thêm text_chunks để dùng cho podcast
+            'chat_history': [],
+            'processed_files': [f.name for f in uploaded_files],
+            'fingerprint': fingerprint,
+            'file_fingerprints': list(file_fingerprints),
+            'vector_store': result['vector_store'],
+            'bm25_retriever': result['bm25_retriever'],
+            'dedup_report': result.get('dedup_report'),
+            'dedup_index': result.get('dedup_index'),  # None khi nạp từ index đã lưu -> dựng khi thêm tài liệu
+            'retrieval_cache': retrieval_cache,
+            'lock': threading.Lock()  # Tránh hai lần thêm tài liệu chạy cùng lúc
+        }
+        get_session_memory(sessions[session_id])
+        return sessions[session_id]
+    finally:
+        cleanup_temp_files(temp_files)
+
+def append_to_session(session, uploaded_files, file_fingerprints, temp_files):
+    """
+    Thêm tài liệu mới vào session: chỉ embed chunk mới, dựng index mở rộng trên bản sao
+    rồi đổi retriever/agent của session sang bản mới trong một bước (request /chat đang chạy vẫn dùng bản cũ)
+    """
+    try:
+        with session['lock']:
+            dedup_index = session.get('dedup_index') or DedupIndex.from_chunks(session['text_chunks'])
+            # Lần thêm thất bại có thể đã ghi hash của chunk chưa được index -> bỏ để dựng lại lần sau
+            session['dedup_index'] = None
+            result = run_append(session['vector_store'], session['bm25_retriever'], uploaded_files, dedup_index)
+            session['dedup_index'] = dedup_index
+            new_chunks, dedup_report = result['new_chunks'], result['dedup_report']
+            chunks = session['text_chunks'] + new_chunks
+            
+            # Dựng retriever và agent trên index đã mở rộng (vector cũ không bị embed lại).
+            # Retriever mới có cache riêng: retriever cũ vẫn phục vụ các request /chat đang chạy,
+            # dùng chung một cache thì hai generation sẽ liên tục xóa entry của nhau
+            retrieval_cache = RetrievalCache()
+            retriever = create_hybrid_retriever(
+                result['vector_store'], chunks, bm25_retriever=result['bm25_retriever'],
+                cache=retrieval_cache
+            )
+            agent_executor = create_agent_executor(result['vector_store'], AGENT_SYSTEM_PROMPT, retriever=retriever)
+            
+            all_fingerprints = session['file_fingerprints'] + list(file_fingerprints)
+            fingerprint = combine_fingerprints(all_fingerprints, index_config())
+            session.update({
+                'agent_executor': agent_executor,
+                'retriever': retriever,
+                'retrieval_cache': retrieval_cache,
+                'router': create_query_router(agent_executor, retriever),
+                'vector_store': result['vector_store'],
+                'bm25_retriever': result['bm25_retriever'],
+                'text_chunks': chunks,
+                'processed_files': session['processed_files'] + [f.name for f in uploaded_files],
+                'fingerprint': fingerprint,
+                'file_fingerprints': all_fingerprints,
+                'dedup_report': merge_dedup_reports(session.get('dedup_report'), dedup_report)
+            })
+            try:
+                save_index(
+                    fingerprint, result['vector_store'], chunks, result['bm25_retriever'],
+                    dedup_report=session['dedup_report'], index_config=index_config()
+                )
+            except Exception as save_error:
+                logger.warning("Could not persist index", extra={"error": str(save_error)})
+            return new_chunks, dedup_report
+    finally:
+        cleanup_temp_files(temp_files)
+
+def run_ingestion_job(job: IngestionJob, uploaded_files, file_fingerprints, temp_files):
+    """Hàm chạy trên ingestion_executor cho upload bất đồng bộ"""
+    try:
+        build_session(job.job_id, uploaded_files, file_fingerprints, temp_files, progress=job.update)
+        job.complete(f"Đã xử lý thành công {len(uploaded_files)} tài liệu")
+    except Exception as e:
+        logger.error("Ingestion job failed", extra={"job_id": job.job_id, "error": str(e)})
+        job.fail(e)
+
+def prune_ingestion_jobs():
+    """Xóa trạng thái các job đã kết thúc quá lâu"""
+    now = time.time()
+    for job_id, job in list(ingestion_jobs.items()):
+        if job.finished_at and now - job.finished_at > INGESTION_JOB_TTL:
+            ingestion_jobs.pop(job_id, None)
 
 # --- HÀM HELPER CHO QUIZ ---
 def allowed_file(filename):
@@ -520,15 +724,26 @@ class ChatMessage(BaseModel):
 class ChatRequest(BaseModel):
     message: str
     session_id: str
+    bypass_cache: bool = False  # Bỏ qua cache câu trả lời, luôn chạy agent
 
 class ChatResponse(BaseModel):
     response: str
     is_quiz: bool = False
+    history_tokens_saved: int = 0  # Số token lịch sử không phải gửi nhờ tóm tắt/cắt theo ngân sách
+    cached: bool = False  # Câu trả lời lấy từ cache (câu hỏi tương tự trên cùng bộ tài liệu)
+    route: str = "agent"  # Luồng xử lý: rag (trả lời nhanh), agent, rag_fallback, cache
 
 class DocumentUploadResponse(BaseModel):
     message: str
     session_id: str
     success: bool
+    dedup_report: Optional[dict] = None
+
+class IngestionJobResponse(BaseModel):
+    job_id: str
+    session_id: str
+    status: str
+    message: str
 
 
 
@@ -586,168 +801,357 @@ async def root():
 @app.post("/upload-documents", response_model=DocumentUploadResponse)
 async def upload_documents(files: List[UploadFile] = File(...)):
     """Upload và xử lý tài liệu PDF"""
+    temp_files = []
     try:
         session_id = str(uuid.uuid4())
         
         # Lưu files tạm thời
-        temp_files = []
-        uploaded_files = []
-        
-        for file in files:
-            if not file.filename.endswith('.pdf'):
-                raise HTTPException(status_code=400, detail=f"File {file.filename} không phải PDF")
-            
-            # Tạo file tạm
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-            content = await file.read()
-            temp_file.write(content)
-            temp_file.close()
-            
-            temp_files.append(temp_file.name)
-            
-            # Tạo object giống như streamlit file uploader
-            class MockFile:
-                def __init__(self, name, path):
-                    self.name = name
-                    self.path = path
-                
-                def getbuffer(self):
-                    with open(self.path, 'rb') as f:
-                        return f.read()
-            
-            uploaded_files.append(MockFile(file.filename, temp_file.name))
-        
-        # Xử lý documents
-        docs = load_documents(uploaded_files)
-        chunks = split_documents(docs)
-        vector_store = create_vector_store(chunks)
-        
-        # Tạo agent executor
-        agent_executor = create_agent_executor(
-            vector_store, 
-            AGENT_SYSTEM_PROMPT, 
-            text_chunks=chunks
-        )
+        uploaded_files, file_fingerprints = await save_uploaded_pdfs(files, temp_files)
         
-        # Lưu session
-        sessions[session_id] = {
-            'agent_executor': agent_executor,
-            'text_chunks': chunks,  # Thêm text_chunks để dùng cho podcast
-            'chat_history': [],
-            'processed_files': [f.filename for f in files]
-        }
-        
-        # Cleanup temp files
-        for temp_file in temp_files:
-            os.unlink(temp_file)
+        # Xử lý documents ngoài event loop để không chặn các request khác
+        session = await run_in_threadpool(build_session, session_id, uploaded_files, file_fingerprints, temp_files)
         
         return DocumentUploadResponse(
             message=f"Đã xử lý thành công {len(files)} tài liệu",
             session_id=session_id,
-            success=True
+            success=True,
+            dedup_report=session.get('dedup_report')
         )
         
     except Exception as e:
         # Cleanup temp files nếu có lỗi
-        for temp_file in temp_files:
-            if os.path.exists(temp_file):
-                os.unlink(temp_file)
+        cleanup_temp_files(temp_files)
         
         raise HTTPException(status_code=500, detail=f"Lỗi xử lý tài liệu: {str(e)}")
 
+@app.post("/upload-documents/async", response_model=IngestionJobResponse)
+async def upload_documents_async(files: List[UploadFile] = File(...)):
+    """Upload tài liệu và trả về job_id ngay; xử lý chạy nền, theo dõi qua /upload-documents/jobs/{job_id}"""
+    temp_files = []
+    try:
+        uploaded_files, file_fingerprints = await save_uploaded_pdfs(files, temp_files)
+    except HTTPException:
+        cleanup_temp_files(temp_files)
+        raise
+    except Exception as e:
+        cleanup_temp_files(temp_files)
+        raise HTTPException(status_code=500, detail=f"Lỗi lưu tài liệu: {str(e)}")
+    
+    prune_ingestion_jobs()
+    job_id = str(uuid.uuid4())
+    job = IngestionJob(job_id, [f.name for f in uploaded_files])
+    ingestion_jobs[job_id] = job
+    ingestion_executor.submit(run_ingestion_job, job, uploaded_files, file_fingerprints, temp_files)
+    
+    return IngestionJobResponse(
+        job_id=job_id,
+        session_id=job_id,
+        status=job.status,
+        message=f"Đã nhận {len(files)} tài liệu, đang xử lý"
+    )
+
+@app.get("/upload-documents/jobs/{job_id}")
+async def get_ingestion_job(job_id: str):
+    """Trạng thái job ingestion: stage (extracting, chunking, embedding, indexing) và percent"""
+    job = ingestion_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job không tồn tại")
+    return job.to_dict()
+
+@app.post("/session/{session_id}/documents", response_model=DocumentUploadResponse)
+async def append_documents(session_id: str, files: List[UploadFile] = File(...)):
+    """Thêm tài liệu PDF vào session đang chạy mà không xử lý lại các tài liệu cũ"""
+    if session_id not in sessions:
+        raise HTTPException(status_code=404, detail="Session không tồn tại")
+    session = sessions[session_id]
+    
+    temp_files = []
+    try:
+        uploaded_files, file_fingerprints = await save_uploaded_pdfs(files, temp_files)
+        
+        # Bỏ qua file đã có trong session (cùng nội dung)
+        new_files, new_fingerprints = [], []
+        for uploaded, fp in zip(uploaded_files, file_fingerprints):
+            if fp not in session['file_fingerprints'] and fp not in new_fingerprints:
+                new_files.append(uploaded)
+                new_fingerprints.append(fp)
+        if not new_files:
+            cleanup_temp_files(temp_files)
+            return DocumentUploadResponse(
+                message="Các tài liệu này đã có trong session",
+                session_id=session_id,
+                success=True
+            )
+        
+        new_chunks, dedup_report = await run_in_threadpool(
+            append_to_session, session, new_files, new_fingerprints, temp_files
+        )
+        
+        return DocumentUploadResponse(
+            message=f"Đã thêm {len(new_files)} tài liệu ({len(new_chunks)} đoạn mới, "
+                    f"bỏ {dedup_report['removed_total']} đoạn trùng)",
+            session_id=session_id,
+            success=True,
+            dedup_report=dedup_report
+        )
+    except HTTPException:
+        cleanup_temp_files(temp_files)
+        raise
+    except Exception as e:
+        cleanup_temp_files(temp_files)
+        raise HTTPException(status_code=500, detail=f"Lỗi thêm tài liệu: {str(e)}")
+
+def get_chat_session(session_id: str):
+    """Lấy session cho chat; báo 409 nếu tài liệu còn đang xử lý, 404 nếu không tồn tại"""
+    job = ingestion_jobs.get(session_id)
+    if session_id not in sessions and job and job.status in ("pending", "running"):
+        raise HTTPException(status_code=409, detail="Tài liệu đang được xử lý, vui lòng thử lại sau.")
+    
+    if session_id not in sessions:
+        logger.warning("Session not found", extra={"session_id": session_id, "active_sessions": len(sessions)})
+        raise HTTPException(status_code=404, detail="Session không tồn tại. Vui lòng upload lại tài liệu.")
+    return sessions[session_id]
+
+def summarize_history(previous_summary, messages):
+    return summarize_messages(get_generation_llm(), previous_summary, messages)
+
+def get_session_memory(session):
+    """ChatMemory của session (bọc quanh session['chat_history'] để endpoint history vẫn đọc được)"""
+    if 'memory' not in session:
+        session['memory'] = ChatMemory(session.setdefault('chat_history', []), summarizer=summarize_history)
+    return session['memory']
+
+def detect_quiz(message: str, answer: str) -> bool:
+    """Kiểm tra câu trả lời có phải quiz không (JSON quiz hợp lệ hoặc theo từ khóa)"""
+    is_quiz = False
+    try:
+        # Chỉ parse JSON nếu response có dấu hiệu là JSON
+        answer_stripped = answer.strip()
+        if answer_stripped.startswith('{') and answer_stripped.endswith('}'):
+            parsed = json.loads(answer)
+            if isinstance(parsed, dict) and 'questions' in parsed and 'quiz_title' in parsed:
+                is_quiz = True
+                logger.debug("Detected valid quiz JSON", extra={"questions": len(parsed.get('questions', []))})
+        else:
+            # Không phải JSON, kiểm tra bằng từ khóa trong request
+            is_quiz = any(keyword in message.lower() 
+                         for keyword in ["quiz", "trắc nghiệm", "câu hỏi", "test", "kiểm tra"])
+            
+            # Hoặc kiểm tra trong response có chứa format quiz
+            if not is_quiz:
+                quiz_indicators = ['"questions":', '"quiz_title":', '"correct_answer":']
+                is_quiz = any(indicator in answer for indicator in quiz_indicators)
+                
+    except Exception as json_error:
+        # Fallback: chỉ dựa vào từ khóa
+        logger.debug("Quiz JSON parse error, falling back to keywords", extra={"error": str(json_error)})
+        is_quiz = any(keyword in message.lower() 
+                     for keyword in ["quiz", "trắc nghiệm", "câu hỏi", "test", "kiểm tra"])
+    
+    return is_quiz
+
+async def lookup_cached_answer(session, request: ChatRequest, chat_history):
+    """
+    Tra cache câu trả lời theo (fingerprint bộ tài liệu, embedding câu hỏi).
+    Câu hỏi nối tiếp hội thoại (có lịch sử và tham chiếu lượt trước) không dùng cache chung giữa các session.
+    Trả về (kết quả cache hoặc None, vector câu hỏi để lưu lại sau khi agent trả lời).
+    """
+    fingerprint = session.get('fingerprint')
+    if (request.bypass_cache or not fingerprint
+            or not answer_cache.is_cacheable(request.message, has_history=bool(chat_history))):
+        return None, None
+    try:
+        with span("answer_cache_lookup"):
+            question_vector = await run_in_threadpool(get_embeddings().embed_query, request.message)
+    except Exception as e:
+        logger.warning("Answer cache lookup skipped", extra={"error": str(e)})
+        return None, None
+    cached = answer_cache.lookup(fingerprint, question_vector)
+    if cached:
+        logger.debug("Answer cache hit", extra={"similarity": round(cached['similarity'], 3)})
+    return cached, question_vector
+
+def store_cached_answer(session, request: ChatRequest, question_vector, answer: str, is_quiz: bool):
+    # Quiz được sinh ngẫu nhiên mỗi lần nên không cache
+    if question_vector is not None and answer and not is_quiz:
+        answer_cache.store(session['fingerprint'], request.message, question_vector, answer)
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     """Xử lý chat với UniAI"""
     try:
-        print(f"[DEBUG] Received chat request: {request.message[:100]}...")
-        print(f"[DEBUG] Session ID: {request.session_id}")
-        print(f"[DEBUG] Available sessions: {list(sessions.keys())}")
-        
-        if request.session_id not in sessions:
-            print(f"[ERROR] Session not found: {request.session_id}")
-            print(f"[ERROR] Available sessions: {list(sessions.keys())}")
-            raise HTTPException(status_code=404, detail="Session không tồn tại. Vui lòng upload lại tài liệu.")
+        session = get_chat_session(request.session_id)
+        # Router chọn luồng trả lời nhanh hoặc agent; session cũ không có router thì gọi thẳng agent
+        agent_executor = session.get('router') or session['agent_executor']
+        memory = get_session_memory(session)
         
-        session = sessions[request.session_id]
-        agent_executor = session['agent_executor']
-        chat_history = session['chat_history']
+        # Lịch sử gửi cho agent: tóm tắt + các lượt gần nhất, trong ngân sách token
+        chat_history, history_usage = memory.build_context()
         
-        print(f"[DEBUG] Chat history length: {len(chat_history)}")
-        print(f"[DEBUG] Agent executor type: {type(agent_executor)}")
-        
-        # Thêm message của user vào history
         user_message = HumanMessage(content=request.message)
-        chat_history.append(user_message)
         
-        print(f"[DEBUG] Calling agent with input: {request.message[:100]}...")
+        cached, question_vector = await lookup_cached_answer(session, request, chat_history)
+        if cached:
+            memory.add_turn(user_message, AIMessage(content=cached['answer']))
+            return ChatResponse(
+                response=cached['answer'],
+                is_quiz=False,
+                history_tokens_saved=history_usage['tokens_saved'],
+                cached=True,
+                route="cache"
+            )
         
-        # Gọi agent với better error handling
+        # Gọi agent (async, không chặn event loop) với better error handling
         try:
-            response = agent_executor.invoke({
-                "input": request.message,
-                "chat_history": chat_history
-            })
-            print(f"[DEBUG] Agent execution successful")
+            # tool_run_scope: document_search gọi lại cùng câu truy vấn trong lượt này được lấy từ cache
+            async with chat_semaphore:
+                with tool_run_scope():
+                    response = await agent_executor.ainvoke({
+                        "input": request.message,
+                        "chat_history": chat_history
+                    })
         except Exception as agent_error:
-            print(f"[ERROR] Agent execution failed: {agent_error}")
+            logger.error("Agent execution failed", extra={"session_id": request.session_id, "error": str(agent_error)})
             # Fallback response
             answer = f"Xin lỗi, có lỗi xảy ra khi xử lý câu hỏi của bạn. Lỗi: {str(agent_error)}. Vui lòng thử lại hoặc upload lại tài liệu."
             return ChatResponse(response=answer, is_quiz=False)
         
         answer = response['output']
-        print(f"[DEBUG] Agent response length: {len(answer)}")
-        print(f"[DEBUG] Agent response preview: {answer[:200]}...")
+        logger.info("Chat answered", extra={
+            "session_id": request.session_id,
+            "route": response.get('route', 'agent'),
+            "answer_chars": len(answer),
+            "history_messages": len(chat_history),
+            "history_tokens_saved": history_usage['tokens_saved'],
+        })
         
-        # Thêm response của AI vào history
-        ai_message = AIMessage(content=answer)
-        chat_history.append(ai_message)
-        
-        # Cập nhật session
-        sessions[request.session_id]['chat_history'] = chat_history
+        # Thêm lượt hỏi-đáp vào history (phần cũ được tóm tắt ở nền)
+        memory.add_turn(user_message, AIMessage(content=answer))
         
         # Kiểm tra nếu là quiz bằng cách phân tích nội dung
-        is_quiz = False
-        try:
-            # Chỉ parse JSON nếu response có dấu hiệu là JSON
-            import json
-            answer_stripped = answer.strip()
-            if answer_stripped.startswith('{') and answer_stripped.endswith('}'):
-                parsed = json.loads(answer)
-                if isinstance(parsed, dict) and 'questions' in parsed and 'quiz_title' in parsed:
-                    is_quiz = True
-                    print(f"[DEBUG] Detected valid quiz JSON with {len(parsed.get('questions', []))} questions")
-            else:
-                # Không phải JSON, kiểm tra bằng từ khóa trong request
-                is_quiz = any(keyword in request.message.lower() 
-                             for keyword in ["quiz", "trắc nghiệm", "câu hỏi", "test", "kiểm tra"])
-                
-                # Hoặc kiểm tra trong response có chứa format quiz
-                if not is_quiz:
-                    quiz_indicators = ['"questions":', '"quiz_title":', '"correct_answer":']
-                    is_quiz = any(indicator in answer for indicator in quiz_indicators)
-                    
-                if is_quiz:
-                    print(f"[DEBUG] Detected quiz by keywords/indicators")
-                else:
-                    print(f"[DEBUG] Normal response - not a quiz")
-                    
-        except Exception as json_error:
-            # Fallback: chỉ dựa vào từ khóa
-            print(f"[DEBUG] JSON parse error (expected for normal responses): {json_error}")
-            is_quiz = any(keyword in request.message.lower() 
-                         for keyword in ["quiz", "trắc nghiệm", "câu hỏi", "test", "kiểm tra"])
-            print(f"[DEBUG] Fallback quiz detection by keywords: {is_quiz}")
-        
-        print(f"[DEBUG] Final is_quiz determination: {is_quiz}")
+        is_quiz = detect_quiz(request.message, answer)
+        store_cached_answer(session, request, question_vector, answer, is_quiz)
         
         return ChatResponse(
             response=answer,
-            is_quiz=is_quiz
+            is_quiz=is_quiz,
+            history_tokens_saved=history_usage['tokens_saved'],
+            route=response.get('route', 'agent')
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi xử lý chat: {str(e)}")
 
+def sse_event(event: str, data) -> str:
+    """Định dạng một sự kiện Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+def chunk_text(chunk) -> str:
+    """Lấy phần text từ AIMessageChunk (Gemini có thể trả content dạng list các phần)"""
+    content = getattr(chunk, 'content', '')
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(part.get('text', '') if isinstance(part, dict) else str(part) for part in content)
+    return ""
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Chat dạng streaming (SSE): gửi sự kiện tool_start/tool_end và token câu trả lời trong lúc agent chạy.
+    Câu hỏi tài liệu thông thường được router đưa qua luồng nhanh (chỉ có sự kiện token).
+    Sự kiện cuối "done" chứa toàn bộ câu trả lời, is_quiz và route; history chỉ được cập nhật khi stream hoàn tất.
+    """
+    session = get_chat_session(request.session_id)
+    agent_executor = session['agent_executor']
+    memory = get_session_memory(session)
+    chat_history, history_usage = memory.build_context()
+    user_message = HumanMessage(content=request.message)
+    
+    async def event_stream():
+        cached, question_vector = await lookup_cached_answer(session, request, chat_history)
+        if cached:
+            memory.add_turn(user_message, AIMessage(content=cached['answer']))
+            yield sse_event("token", {"text": cached['answer']})
+            yield sse_event("done", {
+                "response": cached['answer'],
+                "is_quiz": False,
+                "history_tokens_saved": history_usage['tokens_saved'],
+                "cached": True,
+                "route": "cache"
+            })
+            return
+        
+        tokens = []
+        answer = None
+        inputs = {"input": request.message, "chat_history": chat_history}
+        router = session.get('router')
+        route = router.route(request.message) if router else "agent"
+        started = time.perf_counter()
+        try:
+            async with chat_semaphore:
+                with tool_run_scope():
+                    if route == "rag":
+                        try:
+                            async for text in router.rag.astream(inputs, chunk_text):
+                                tokens.append(text)
+                                yield sse_event("token", {"text": text})
+                            answer = "".join(tokens)
+                        except NoAnswerInDocuments as e:
+                            # Chưa có token nào được gửi đi nên có thể chuyển sang agent
+                            logger.debug("Router fallback to agent", extra={"reason": str(e)})
+                            route = "rag_fallback"
+                    if answer is None:
+                        async for event in agent_executor.astream_events(inputs, version="v1"):
+                            kind = event["event"]
+                            if kind == "on_tool_start":
+                                # Token trước khi gọi tool là của bước trung gian, không thuộc câu trả lời cuối
+                                tokens = []
+                                yield sse_event("tool_start", {"tool": event["name"], "input": event["data"].get("input")})
+                            elif kind == "on_tool_end":
+                                output = event["data"].get("output")
+                                yield sse_event("tool_end", {"tool": event["name"], "output_length": len(str(output or ""))})
+                            elif kind == "on_chat_model_stream":
+                                text = chunk_text(event["data"].get("chunk"))
+                                if text:
+                                    tokens.append(text)
+                                    yield sse_event("token", {"text": text})
+                            elif kind == "on_chain_end" and event["name"] == "AgentExecutor":
+                                output = event["data"].get("output")
+                                if isinstance(output, dict):
+                                    answer = output.get("output")
+        except Exception as agent_error:
+            logger.error("Agent streaming failed", extra={"session_id": request.session_id, "error": str(agent_error)})
+            yield sse_event("error", {
+                "message": f"Xin lỗi, có lỗi xảy ra khi xử lý câu hỏi của bạn. Lỗi: {str(agent_error)}. Vui lòng thử lại hoặc upload lại tài liệu."
+            })
+            return
+        
+        if router:
+            router.stats.record_latency(route, time.perf_counter() - started)
+        if answer is None:
+            answer = "".join(tokens)
+        is_quiz = detect_quiz(request.message, answer)
+        store_cached_answer(session, request, question_vector, answer, is_quiz)
+        
+        # Cập nhật history sau khi stream hoàn tất
+        memory.add_turn(user_message, AIMessage(content=answer))
+        yield sse_event("done", {
+            "response": answer,
+            "is_quiz": is_quiz,
+            "history_tokens_saved": history_usage['tokens_saved'],
+            "cached": False,
+            "route": route
+        })
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/session/{session_id}/info")
 async def get_session_info(session_id: str):
     """Lấy thông tin session"""
@@ -760,6 +1164,11 @@ async def get_session_info(session_id: str):
         "processed_files": session.get('processed_files', []),
         "chat_count": len(session.get('chat_history', [])),
         "agent_status": "active" if session.get('agent_executor') else "inactive",
+        "chunk_count": len(session.get('text_chunks', [])),
+        "dedup_report": session.get('dedup_report'),
+        "vector_index": describe_index(session['vector_store'].index) if session.get('vector_store') else None,
+        "retrieval_cache": session['retrieval_cache'].stats() if session.get('retrieval_cache') else None,
+        "history": session['memory'].stats() if session.get('memory') else None,
         "session_age": "unknown"  # Could add timestamp tracking
     }
 
@@ -771,6 +1180,52 @@ async def list_sessions():
         "session_count": len(sessions)
     }
 
+@app.get("/sessions/memory")
+async def sessions_memory():
+    """Footprint bộ nhớ của vector index theo từng session"""
+    per_session = {
+        session_id: describe_index(session['vector_store'].index)
+        for session_id, session in list(sessions.items())
+        if session.get('vector_store') is not None
+    }
+    return {
+        "sessions": per_session,
+        "total_index_memory_bytes": sum(info['index_memory_bytes'] for info in per_session.values())
+    }
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Metrics định dạng Prometheus: request theo endpoint, thời gian từng giai đoạn, từng lần gọi LLM/tool"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/clients")
+async def shared_clients():
+    """Các client dùng chung đã được khởi tạo"""
+    return client_stats()
+
+@app.get("/cache/embeddings")
+async def embedding_cache_stats():
+    """Thống kê hit/miss của cache embedding"""
+    return get_embedding_cache_stats()
+
+@app.get("/router/stats")
+async def query_router_stats():
+    """Quyết định của router (luồng nhanh/agent) và latency theo từng luồng"""
+    return router_stats.snapshot()
+
+@app.get("/cache/tools")
+async def tool_cache_info():
+    """Thống kê memo hóa tool của agent (document_search theo lượt chạy, web_search trên đĩa)"""
+    return {
+        "counters": tool_cache_stats.snapshot(),
+        "web_search_disk": get_web_search_cache().stats()
+    }
+
+@app.get("/cache/answers")
+async def answer_cache_stats():
+    """Thống kê cache câu trả lời (dùng chung giữa các session có cùng bộ tài liệu)"""
+    return answer_cache.stats()
+
 @app.get("/session/{session_id}/history")
 async def get_chat_history(session_id: str):
     """Lấy lịch sử chat"""
@@ -821,8 +1276,8 @@ async def generate_podcast(request: PodcastRequest):
             print(f"[DEBUG] Content truncated to {max_chars} characters")
         
         # Tạo podcast
-        print("[DEBUG] Creating PodcastGenerator...")
-        podcast_gen = PodcastGenerator()
+        print("[DEBUG] Getting shared PodcastGenerator...")
+        podcast_gen = get_client("podcast_generator", PodcastGenerator)
         print("[DEBUG] Generating podcast...")
         result = podcast_gen.generate_podcast(pdf_content)
         
@@ -992,10 +1447,12 @@ async def extract_quiz_api(file: UploadFile = File(...)):
             
             if file_ext == 'docx':
                 print("[DEBUG] Đang gọi extract_docx_data...")
-                quiz_data = extract_docx_data(file_path)
+                with span("quiz_extraction"):
+                    quiz_data = extract_docx_data(file_path)
             elif file_ext == 'pdf':
                 print("[DEBUG] Đang gọi extract_pdf_data...")
-                quiz_data = extract_pdf_data(file_path)
+                with span("quiz_extraction"):
+                    quiz_data = extract_pdf_data(file_path)
             
             print(f"[DEBUG] Trích xuất xong, tìm thấy {len(quiz_data)} câu hỏi.")
             
@@ -1051,7 +1508,8 @@ async def download_quiz_api(request: QuizDownloadRequest):
         format_type = request.format
         
         if format_type == 'pdf':
-            file_stream, download_filename = download_quiz_pdf(quiz_data, filename)
+            with span("export"):
+                file_stream, download_filename = download_quiz_pdf(quiz_data, filename)
             file_stream.seek(0)
             return StreamingResponse(
                 io.BytesIO(file_stream.read()),
@@ -1059,7 +1517,8 @@ async def download_quiz_api(request: QuizDownloadRequest):
                 headers={"Content-Disposition": f"attachment; filename={download_filename}"}
             )
         elif format_type == 'docx':
-            file_stream, download_filename = download_quiz_docx(quiz_data, filename)
+            with span("export"):
+                file_stream, download_filename = download_quiz_docx(quiz_data, filename)
             file_stream.seek(0)
             return StreamingResponse(
                 io.BytesIO(file_stream.read()),
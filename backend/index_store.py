@@ -0,0 +1,144 @@
+# index_store.py - Lưu/nạp kết quả ingestion (FAISS + chunks + BM25) theo fingerprint tài liệu
+
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import time
+import uuid
+from typing import Iterable, Optional
+
+import faiss
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+from sparse_bm25 import SparseBM25, SparseBM25Retriever
+from logging_setup import get_logger
+
+logger = get_logger("index_store")
+
+INDEX_STORE_DIR = os.getenv("INDEX_STORE_DIR", os.path.join(".cache", "indexes"))
+# Bật để memory-map file index thay vì đọc toàn bộ vào RAM
+INDEX_STORE_MMAP = os.getenv("INDEX_STORE_MMAP", "0") == "1"
+# Tăng khi định dạng lưu trữ thay đổi để bỏ qua các index cũ
+INDEX_FORMAT_VERSION = 4
+
+
+def fingerprint_bytes(data: bytes) -> str:
+    """Fingerprint sha256 của nội dung một file"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def new_fingerprint_hasher():
+    """Hasher tăng dần, cho cùng kết quả với fingerprint_bytes khi đọc file theo từng khối"""
+    return hashlib.sha256()
+
+
+def combine_fingerprints(fingerprints: Iterable[str], index_config: Optional[dict] = None) -> str:
+    """
+    Fingerprint của cả một bộ tài liệu (không phụ thuộc thứ tự upload).
+    index_config (model/số chiều embedding, loại index) được băm cùng để đổi cấu hình thì không dùng lại index cũ.
+    """
+    digest = hashlib.sha256()
+    for fp in sorted(fingerprints):
+        digest.update(fp.encode("ascii"))
+    if index_config:
+        digest.update(json.dumps(index_config, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _index_dir(fingerprint: str) -> str:
+    return os.path.join(INDEX_STORE_DIR, fingerprint)
+
+
+def save_index(fingerprint: str, vector_store, text_chunks, bm25_retriever=None, dedup_report=None,
+               index_config: Optional[dict] = None):
+    """Lưu FAISS index, danh sách chunk và trạng thái BM25 xuống đĩa (kèm cấu hình đã dùng để tạo index)"""
+    target_dir = _index_dir(fingerprint)
+    # Ghi vào thư mục tạm rồi đổi tên để tránh đọc phải index ghi dở
+    tmp_dir = f"{target_dir}.tmp-{uuid.uuid4().hex}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    try:
+        faiss.write_index(vector_store.index, os.path.join(tmp_dir, "index.faiss"))
+        with open(os.path.join(tmp_dir, "state.pkl"), "wb") as f:
+            pickle.dump({
+                "docstore": vector_store.docstore._dict,
+                "index_to_docstore_id": vector_store.index_to_docstore_id,
+                "text_chunks": text_chunks,
+                "bm25_state": bm25_retriever.engine.to_state() if bm25_retriever else None,
+                "bm25_k": bm25_retriever.k if bm25_retriever else None,
+                "dedup_report": dedup_report,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "version": INDEX_FORMAT_VERSION,
+                "fingerprint": fingerprint,
+                "num_chunks": len(text_chunks),
+                "num_vectors": vector_store.index.ntotal,
+                "index_config": index_config,
+                "created_at": time.time(),
+            }, f)
+
+        if os.path.exists(target_dir):
+            shutil.rmtree(target_dir, ignore_errors=True)
+        os.replace(tmp_dir, target_dir)
+        logger.debug("Saved index", extra={"fingerprint": fingerprint[:12], "chunks": len(text_chunks)})
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+def load_index(fingerprint: str, embeddings, index_config: Optional[dict] = None) -> Optional[dict]:
+    """
+    Nạp lại kết quả ingestion đã lưu. Trả về None nếu chưa có, định dạng không còn
+    tương thích hoặc index được tạo với cấu hình khác index_config.
+    """
+    index_dir = _index_dir(fingerprint)
+    meta_path = os.path.join(index_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != INDEX_FORMAT_VERSION:
+            logger.info("Stored index has old format, ignoring", extra={"fingerprint": fingerprint[:12]})
+            return None
+        if index_config is not None and meta.get("index_config") != index_config:
+            logger.warning("Stored index built with a different config, rebuilding", extra={
+                "fingerprint": fingerprint[:12], "stored_config": meta.get("index_config"),
+                "current_config": index_config,
+            })
+            return None
+
+        start = time.perf_counter()
+        io_flags = faiss.IO_FLAG_MMAP if INDEX_STORE_MMAP else 0
+        index = faiss.read_index(os.path.join(index_dir, "index.faiss"), io_flags)
+        with open(os.path.join(index_dir, "state.pkl"), "rb") as f:
+            state = pickle.load(f)
+
+        vector_store = FAISS(
+            embeddings,
+            index,
+            InMemoryDocstore(state["docstore"]),
+            state["index_to_docstore_id"],
+        )
+        logger.debug("Loaded index", extra={
+            "fingerprint": fingerprint[:12], "ms": round((time.perf_counter() - start) * 1000, 1)
+        })
+        bm25_retriever = None
+        if state.get("bm25_state"):
+            bm25_retriever = SparseBM25Retriever.from_documents(
+                state["text_chunks"],
+                k=state["bm25_k"],
+                engine=SparseBM25.from_state(state["bm25_state"])
+            )
+        return {
+            "vector_store": vector_store,
+            "text_chunks": state["text_chunks"],
+            "bm25_retriever": bm25_retriever,
+            "dedup_report": state.get("dedup_report"),
+        }
+    except Exception as e:
+        logger.error("Failed to load index", extra={"fingerprint": fingerprint[:12], "error": str(e)})
+        return None
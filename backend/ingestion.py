@@ -0,0 +1,183 @@
+# ingestion.py - Pipeline xử lý tài liệu (extract -> chunk -> embed -> index) và theo dõi tiến độ job
+
+import threading
+import time
+from typing import Callable, Optional
+
+from agent_core import (
+    load_documents, split_documents, create_vector_store, get_embeddings, create_bm25_retriever,
+    extend_vector_store, extend_bm25_retriever, assign_chunk_ids, index_config
+)
+from index_store import load_index, save_index
+from chunk_dedup import DedupIndex, deduplicate_chunks
+from metrics import span
+from logging_setup import get_logger
+
+logger = get_logger("ingestion")
+
+# Khoảng phần trăm của từng giai đoạn trong tổng tiến độ
+STAGE_RANGES = {
+    "queued": (0, 0),
+    "extracting": (0, 35),
+    "chunking": (35, 45),
+    "embedding": (45, 90),
+    "indexing": (90, 100),
+    "done": (100, 100),
+}
+
+
+class IngestionJob:
+    """Trạng thái của một job ingestion chạy nền (đọc từ endpoint status)"""
+
+    def __init__(self, job_id: str, filenames):
+        self.job_id = job_id
+        self.filenames = list(filenames)
+        self.status = "pending"   # pending | running | completed | failed
+        self.stage = "queued"
+        self.percent = 0.0
+        self.message = "Đang chờ xử lý"
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def update(self, stage: str, fraction: float = 0.0, message: Optional[str] = None):
+        """Cập nhật giai đoạn; fraction là tiến độ (0..1) bên trong giai đoạn đó"""
+        low, high = STAGE_RANGES.get(stage, (self.percent, self.percent))
+        with self._lock:
+            self.status = "running"
+            self.stage = stage
+            self.percent = round(low + (high - low) * max(0.0, min(fraction, 1.0)), 1)
+            if message:
+                self.message = message
+
+    def complete(self, message: str):
+        with self._lock:
+            self.status = "completed"
+            self.stage = "done"
+            self.percent = 100.0
+            self.message = message
+            self.finished_at = time.time()
+
+    def fail(self, error: Exception):
+        with self._lock:
+            self.status = "failed"
+            self.error = str(error)
+            self.message = f"Lỗi xử lý tài liệu: {error}"
+            self.finished_at = time.time()
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "job_id": self.job_id,
+                "session_id": self.job_id,
+                "status": self.status,
+                "stage": self.stage,
+                "percent": self.percent,
+                "message": self.message,
+                "error": self.error,
+                "files": self.filenames,
+                "elapsed_seconds": round((self.finished_at or time.time()) - self.created_at, 2),
+            }
+
+
+def run_ingestion(uploaded_files, fingerprint: str, progress: Optional[Callable] = None):
+    """
+    Chạy toàn bộ pipeline ingestion (hàm blocking, nên gọi ngoài event loop).
+    progress(stage, fraction, message) được gọi khi chuyển giai đoạn.
+    """
+    def report(stage, fraction=0.0, message=None):
+        if progress:
+            progress(stage, fraction, message)
+
+    # Dùng lại index đã lưu nếu bộ tài liệu này từng được xử lý
+    with span("index_load"):
+        stored = load_index(fingerprint, get_embeddings(), index_config())
+    if stored:
+        logger.info("Reusing stored index", extra={"fingerprint": fingerprint[:12]})
+        report("indexing", 1.0, "Đã dùng lại index có sẵn")
+        return stored
+
+    report("extracting", 0.0, "Đang trích xuất nội dung PDF")
+    with span("extraction"):
+        docs = load_documents(uploaded_files)
+
+    report("chunking", 0.0, f"Đang chia nhỏ {len(docs)} trang")
+    with span("chunking"):
+        chunks = split_documents(docs)
+        # Bỏ chunk trùng / gần trùng để không phải embed và lưu lại nhiều lần
+        dedup_index = DedupIndex()
+        chunks, dedup_report = deduplicate_chunks(chunks, index=dedup_index)
+        assign_chunk_ids(chunks)
+
+    report("embedding", 0.0, f"Đang tạo embedding cho {len(chunks)} đoạn")
+    with span("embedding"):
+        vector_store = create_vector_store(
+            chunks,
+            progress_callback=lambda fraction: report("embedding", fraction)
+        )
+
+    report("indexing", 0.0, "Đang xây dựng index tìm kiếm")
+    with span("indexing"):
+        bm25_retriever = create_bm25_retriever(chunks)
+        try:
+            save_index(
+                fingerprint, vector_store, chunks, bm25_retriever,
+                dedup_report=dedup_report, index_config=index_config()
+            )
+        except Exception as save_error:
+            logger.warning("Could not persist index", extra={"error": str(save_error)})
+    report("indexing", 1.0)
+
+    return {
+        "vector_store": vector_store,
+        "text_chunks": chunks,
+        "bm25_retriever": bm25_retriever,
+        "dedup_report": dedup_report,
+        "dedup_index": dedup_index,
+    }
+
+
+def run_append(vector_store, bm25_retriever, uploaded_files, dedup_index: DedupIndex,
+               progress: Optional[Callable] = None):
+    """
+    Xử lý các file mới cho một session có sẵn. Chunk trùng với chunk đã có trong session
+    (dedup_index) hoặc trong lần upload này bị bỏ; chỉ embed các chunk mới.
+    vector_store / bm25_retriever của session không bị sửa: kết quả là bản mở rộng để session đổi sang trong một bước.
+    Trả về dict {vector_store, bm25_retriever, new_chunks, dedup_report}.
+    """
+    def report(stage, fraction=0.0, message=None):
+        if progress:
+            progress(stage, fraction, message)
+
+    report("extracting", 0.0, "Đang trích xuất nội dung PDF mới")
+    with span("extraction"):
+        docs = load_documents(uploaded_files)
+
+    report("chunking", 0.0, f"Đang chia nhỏ {len(docs)} trang")
+    with span("chunking"):
+        new_chunks, dedup_report = deduplicate_chunks(split_documents(docs), index=dedup_index)
+    result = {
+        "vector_store": vector_store,
+        "bm25_retriever": bm25_retriever,
+        "new_chunks": new_chunks,
+        "dedup_report": dedup_report,
+    }
+    if not new_chunks:
+        return result
+    # chunk_id nối tiếp các chunk đã có trong session
+    assign_chunk_ids(new_chunks, start=len(bm25_retriever.docs))
+
+    report("embedding", 0.0, f"Đang tạo embedding cho {len(new_chunks)} đoạn mới")
+    with span("embedding"):
+        result["vector_store"] = extend_vector_store(
+            vector_store,
+            new_chunks,
+            progress_callback=lambda fraction: report("embedding", fraction)
+        )
+
+    report("indexing", 0.0, "Đang cập nhật keyword index")
+    with span("indexing"):
+        result["bm25_retriever"] = extend_bm25_retriever(bm25_retriever, new_chunks)
+    report("indexing", 1.0)
+    return result
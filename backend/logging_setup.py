@@ -0,0 +1,118 @@
+# logging_setup.py - Logging có cấp độ, định dạng có cấu trúc, ghi qua hàng đợi (không chặn request)
+#
+# Request chỉ đẩy LogRecord vào queue; thread QueueListener mới định dạng và ghi ra stdout.
+# Log DEBUG được lấy mẫu (LOG_DEBUG_SAMPLE_RATE) để bật DEBUG trên production không làm ngập stdout.
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" (mỗi dòng một object, dễ đưa vào hệ thống log) hoặc "text" (dễ đọc khi dev)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+# Tỉ lệ giữ lại log DEBUG (1.0 = giữ hết)
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1.0"))
+
+ROOT_LOGGER = "uniai"
+
+# Thuộc tính có sẵn của LogRecord; phần còn lại (truyền qua extra=) là field có cấu trúc
+_RESERVED = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime", "taskName"}
+
+_listener = None
+_setup_lock = threading.Lock()
+
+
+def _extra_fields(record: logging.LogRecord) -> dict:
+    return {key: value for key, value in record.__dict__.items() if key not in _RESERVED}
+
+
+class StructuredFormatter(logging.Formatter):
+    """Định dạng log thành JSON hoặc text "key=value", kèm các field truyền qua extra="""
+
+    def __init__(self, fmt_type: str = LOG_FORMAT):
+        super().__init__()
+        self.fmt_type = fmt_type
+
+    def format(self, record: logging.LogRecord) -> str:
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}"
+        message = record.getMessage()
+        fields = _extra_fields(record)
+        if record.exc_info:
+            fields["exc_info"] = self.formatException(record.exc_info)
+        if self.fmt_type == "json":
+            payload = {"ts": timestamp, "level": record.levelname, "logger": record.name, "msg": message}
+            payload.update(fields)
+            return json.dumps(payload, ensure_ascii=False, default=str)
+        extras = " ".join(f"{key}={value}" for key, value in fields.items())
+        return f"{timestamp} {record.levelname:<7} {record.name}: {message}" + (f" {extras}" if extras else "")
+
+
+class DebugSampler(logging.Filter):
+    """Chỉ giữ lại một phần log DEBUG; các cấp độ khác luôn đi qua"""
+
+    def __init__(self, rate: float = LOG_DEBUG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or self.rate >= 1.0 or random.random() < self.rate
+
+
+class _InProcessQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler mặc định copy và định dạng sẵn record trên luồng gọi (để có thể pickle sang process khác).
+    Queue ở đây nằm trong cùng process nên chỉ cần chốt nội dung message; việc định dạng để thread ghi log làm.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def setup_logging(level: str = None, fmt_type: str = None, sample_rate: float = None, stream=None):
+    """Cấu hình logger "uniai" (gọi một lần khi khởi động; gọi lại sẽ cấu hình lại)"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(StructuredFormatter(fmt_type or LOG_FORMAT))
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = _InProcessQueueHandler(log_queue)
+        queue_handler.addFilter(DebugSampler(LOG_DEBUG_SAMPLE_RATE if sample_rate is None else sample_rate))
+
+        root = logging.getLogger(ROOT_LOGGER)
+        root.handlers[:] = [queue_handler]
+        root.setLevel(level or LOG_LEVEL)
+        root.propagate = False
+
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+    return root
+
+
+def shutdown_logging():
+    """Ghi nốt các log còn trong queue rồi dừng thread ghi log"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+atexit.register(shutdown_logging)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger con của "uniai" (VD: get_logger("index") -> "uniai.index")"""
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
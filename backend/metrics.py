@@ -0,0 +1,339 @@
+# metrics.py - Đo thời gian theo giai đoạn (span) và xuất metrics định dạng Prometheus cho /metrics
+#
+# Không phụ thuộc prometheus_client: chỉ cần counter, gauge và histogram với label,
+# render theo text exposition format 0.0.4.
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from logging_setup import get_logger
+
+logger = get_logger("metrics")
+
+METRICS_PREFIX = os.getenv("METRICS_PREFIX", "uniai")
+# Request chậm hơn ngưỡng này sẽ in danh sách span để biết thời gian nằm ở đâu
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "10"))
+
+# Bucket (giây) phủ từ truy xuất vài ms tới ingestion vài phút
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = f"{METRICS_PREFIX}_{name}"
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        # Gauge không label có thể lấy giá trị lúc scrape (VD: số session)
+        self.function = function
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _samples(self):
+        if self.function is not None:
+            return [f"{self.name} {_format_value(self.function())}"]
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [đếm theo từng bucket (không cộng dồn), tổng, số mẫu]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, seconds: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += seconds
+            state[2] += 1
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUESTS = registry.register(Counter(
+    "http_requests_total", "HTTP requests by endpoint and status code.", ["method", "endpoint", "status"]))
+HTTP_REQUEST_SECONDS = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by endpoint.", ["method", "endpoint"]))
+HTTP_IN_PROGRESS = registry.register(Gauge(
+    "http_requests_in_progress", "HTTP requests currently being handled.", ["method", "endpoint"]))
+STAGE_SECONDS = registry.register(Histogram(
+    "stage_duration_seconds",
+    "Duration of pipeline stages (extraction, chunking, embedding, retrieval, tts, export, ...).",
+    ["stage"]))
+STAGE_ERRORS = registry.register(Counter("stage_errors_total", "Stages that raised an exception.", ["stage"]))
+LLM_CALL_SECONDS = registry.register(Histogram(
+    "llm_call_duration_seconds", "Duration of each LLM call.", ["model", "status"]))
+TOOL_CALL_SECONDS = registry.register(Histogram(
+    "tool_call_duration_seconds", "Duration of each agent tool call.", ["tool", "status"]))
+
+# Danh sách span của request hiện tại (middleware tạo, span() ghi vào)
+_request_spans: ContextVar[Optional[list]] = ContextVar("request_spans", default=None)
+
+
+def observe_stage(stage: str, seconds: float):
+    """Ghi thời gian của một giai đoạn đã đo sẵn (VD: timings của HybridRetriever)"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+
+@contextmanager
+def span(stage: str):
+    """Đo thời gian một giai đoạn: with span("embedding"): ..."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+@contextmanager
+def llm_call(model: str):
+    """Đo một lần gọi LLM không đi qua LangChain (VD: google.generativeai trực tiếp)"""
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        LLM_CALL_SECONDS.observe(seconds, model=model, status=status)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((f"llm:{model}", seconds))
+
+
+@contextmanager
+def request_spans():
+    """Thu thập span của một request; trả về list (stage, seconds) được điền dần"""
+    spans: list = []
+    token = _request_spans.set(spans)
+    try:
+        yield spans
+    finally:
+        _request_spans.reset(token)
+
+
+def format_spans(spans) -> str:
+    return ", ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in spans)
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """Đo từng lần gọi LLM và tool của LangChain (gắn vào LLM/tool qua tham số callbacks)"""
+
+    # Chạy ngay trong luồng gọi, không đẩy sang executor (chỉ ghi vài số)
+    run_inline = True
+
+    def __init__(self):
+        self._starts: Dict = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id, label: str):
+        with self._lock:
+            self._starts[run_id] = (time.perf_counter(), label)
+
+    def _finish(self, run_id, histogram: Histogram, label_name: str, status: str):
+        with self._lock:
+            started = self._starts.pop(run_id, None)
+        if started is None:
+            return
+        start, label = started
+        seconds = time.perf_counter() - start
+        histogram.observe(seconds, **{label_name: label, "status": status})
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((f"{'llm' if histogram is LLM_CALL_SECONDS else 'tool'}:{label}", seconds))
+
+    @staticmethod
+    def _model_name(serialized, kwargs) -> str:
+        params = kwargs.get("invocation_params") or {}
+        return str(params.get("model") or params.get("model_name")
+                   or (serialized or {}).get("kwargs", {}).get("model") or "unknown")
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, self._model_name(serialized, kwargs))
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, self._model_name(serialized, kwargs))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._finish(run_id, LLM_CALL_SECONDS, "model", "ok")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, LLM_CALL_SECONDS, "model", "error")
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._start(run_id, (serialized or {}).get("name") or "unknown")
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._finish(run_id, TOOL_CALL_SECONDS, "tool", "ok")
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, TOOL_CALL_SECONDS, "tool", "error")
+
+
+metrics_callback = MetricsCallbackHandler()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: đếm request theo endpoint (template đường dẫn, VD /audio/{filename}), số request đang xử lý
+    và latency tính tới khi gửi xong body (đúng cả với response streaming).
+    """
+
+    def __init__(self, app, routes):
+        self.app = app
+        self.routes = routes  # app.router.routes (cùng list, route đăng ký sau vẫn thấy)
+
+    def _endpoint(self, scope) -> str:
+        from starlette.routing import Match
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, "path", "unknown")
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        endpoint = self._endpoint(scope)
+        status = {"code": 500}
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        HTTP_IN_PROGRESS.inc(method=method, endpoint=endpoint)
+        with request_spans() as spans:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                elapsed = time.perf_counter() - start
+                HTTP_IN_PROGRESS.dec(method=method, endpoint=endpoint)
+                HTTP_REQUESTS.inc(method=method, endpoint=endpoint, status=str(status["code"]))
+                HTTP_REQUEST_SECONDS.observe(elapsed, method=method, endpoint=endpoint)
+                if elapsed > SLOW_REQUEST_SECONDS:
+                    logger.warning("Slow request", extra={"method": method, "endpoint": endpoint,
+                                                          "seconds": round(elapsed, 3), "spans": format_spans(spans)})
@@ -0,0 +1,76 @@
+# mmr.py - Maximal marginal relevance vector hóa trên các ứng viên lấy từ FAISS
+
+from typing import List, Tuple
+
+import numpy as np
+
+
+def mmr_select(query_vector: np.ndarray, candidates: np.ndarray, k: int, lambda_mult: float) -> List[int]:
+    """
+    Chọn k vị trí trong candidates (các hàng đã chuẩn hóa) theo MMR.
+    Cho kết quả như maximal_marginal_relevance của LangChain nhưng chỉ tính
+    một ma trận tương đồng fetch_k x fetch_k, mỗi bước chọn là O(fetch_k).
+    """
+    num_candidates = candidates.shape[0]
+    k = min(k, num_candidates)
+    if k <= 0:
+        return []
+    similarity_to_query = candidates @ query_vector
+    pairwise = candidates @ candidates.T
+
+    selected = [int(np.argmax(similarity_to_query))]
+    # Độ tương đồng lớn nhất của mỗi candidate với các phần tử đã chọn
+    max_redundancy = pairwise[:, selected[0]].copy()
+    available = np.ones(num_candidates, dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < k:
+        scores = lambda_mult * similarity_to_query - (1 - lambda_mult) * max_redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_redundancy, pairwise[:, best], out=max_redundancy)
+    return selected
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class MMRSearcher:
+    """
+    Lấy fetch_k ứng viên bằng FAISS rồi chọn bằng mmr_select.
+    Mỗi truy vấn chỉ giải mã (reconstruct) đúng fetch_k ứng viên, không giữ bản sao
+    toàn bộ vector đã chuẩn hóa: bộ nhớ của session chỉ là index (flat hoặc nén sq8/pq).
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+    def search(self, query_vector, k: int = 4, fetch_k: int = 20,
+               lambda_mult: float = 0.5) -> Tuple[List[int], List[float]]:
+        """Trả về (id trong FAISS index, khoảng cách L2) của các vector được MMR chọn"""
+        query = np.asarray(query_vector, dtype=np.float32).reshape(1, -1)
+        distances, ids = self.index.search(query, fetch_k)
+        valid = ids[0] != -1
+        candidate_ids, candidate_distances = ids[0][valid], distances[0][valid]
+        if candidate_ids.size == 0:
+            return [], []
+
+        candidates = _normalize_rows(self.index.reconstruct_batch(candidate_ids))
+        picked = mmr_select(_normalize_rows(query)[0], candidates, k, lambda_mult)
+        return [int(candidate_ids[i]) for i in picked], [float(candidate_distances[i]) for i in picked]
+
+
+def max_marginal_relevance_search(vector_store, query: str, k: int = 4, fetch_k: int = 20,
+                                  lambda_mult: float = 0.5):
+    """Thay cho vector_store.max_marginal_relevance_search (LangChain FAISS)"""
+    embedding_function = vector_store.embedding_function
+    if hasattr(embedding_function, "embed_query"):
+        query_vector = embedding_function.embed_query(query)
+    else:
+        query_vector = embedding_function(query)
+    ids, _ = MMRSearcher(vector_store.index).search(query_vector, k=k, fetch_k=fetch_k, lambda_mult=lambda_mult)
+    return [vector_store.docstore.search(vector_store.index_to_docstore_id[i]) for i in ids]
@@ -0,0 +1,123 @@
+# pdf_extract.py - Trích xuất trang PDF song song trên process pool dùng chung
+#
+# Module này chỉ import pypdf và logging_setup (thư viện chuẩn): process con (spawn) import nó
+# để chạy _extract_page_range, nên không kéo theo LangChain/FAISS như khi import agent_core.
+
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional
+
+from logging_setup import get_logger
+
+logger = get_logger("pdf_extract")
+
+# Số process trích xuất trang PDF (0 hoặc 1 = chạy tuần tự như cũ)
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+# File ít trang hơn ngưỡng này thì chạy tuần tự (tránh chi phí gửi việc sang process khác)
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "24"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+# Trong process con: PdfReader của file gần nhất, để các đoạn trang cùng file không parse lại từ đầu
+_reader_cache = {}
+
+
+def preprocess_text(text):
+    """Làm sạch và chuẩn hóa văn bản từ PDF"""
+    # Loại bỏ ký tự đặc biệt và khoảng trắng thừa
+    text = re.sub(r'\s+', ' ', text)  # Nhiều khoảng trắng thành 1
+    text = re.sub(r'\n+', '\n', text)  # Nhiều xuống dòng thành 1
+
+    # Loại bỏ header/footer thường gặp
+    text = re.sub(r'Trang \d+', '', text)
+    text = re.sub(r'Page \d+', '', text)
+
+    # Chuẩn hóa dấu câu
+    text = re.sub(r'\s+([.,;:])', r'\1', text)
+
+    return text.strip()
+
+
+def _get_reader(file_path):
+    from pypdf import PdfReader
+    key = (file_path, os.path.getmtime(file_path))
+    reader = _reader_cache.get(key)
+    if reader is None:
+        _reader_cache.clear()
+        reader = _reader_cache[key] = PdfReader(file_path)
+    return reader
+
+
+def _extract_page_range(file_path, start, end):
+    """Chạy trong process con: trích xuất và tiền xử lý các trang [start, end)"""
+    reader = _get_reader(file_path)
+    return [preprocess_text(reader.pages[i].extract_text() or "") for i in range(start, end)]
+
+
+def get_pdf_extract_pool(max_workers: int) -> ProcessPoolExecutor:
+    """
+    Process pool dùng chung cho cả server, tạo ở lần dùng đầu tiên.
+    Dùng "spawn" thay vì fork: pool được tạo từ thread của server đang giữ connection pool,
+    SQLite, thread OpenMP của FAISS... fork lúc đó có thể làm process con bị deadlock.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _noop():
+    return None
+
+
+def warm_up_pdf_extract_pool(max_workers: int = PDF_EXTRACT_WORKERS):
+    """Khởi động sẵn các process con (spawn phải import lại module) để lần upload đầu không phải chờ"""
+    if max_workers > 1:
+        pool = get_pdf_extract_pool(max_workers)
+        for _ in range(max_workers):
+            pool.submit(_noop)
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def extract_pages_parallel(file_path, max_workers: int) -> Optional[List[str]]:
+    """
+    Text đã tiền xử lý của từng trang (giữ nguyên thứ tự trang).
+    Trả về None nếu file quá ít trang hoặc pool hỏng, để gọi nơi dùng cách tuần tự.
+    """
+    from pypdf import PdfReader
+    total_pages = len(PdfReader(file_path).pages)
+    if total_pages < PDF_PARALLEL_MIN_PAGES:
+        return None
+
+    # Chia nhỏ hơn số worker để cân bằng tải giữa trang nhiều chữ và trang ít chữ
+    num_ranges = min(total_pages, max_workers * 4)
+    step = -(-total_pages // num_ranges)
+    ranges = [(start, min(start + step, total_pages)) for start in range(0, total_pages, step)]
+
+    try:
+        results = get_pdf_extract_pool(max_workers).map(
+            _extract_page_range,
+            [file_path] * len(ranges),
+            [r[0] for r in ranges],
+            [r[1] for r in ranges],
+        )
+        page_texts = [text for chunk in results for text in chunk]
+    except BrokenProcessPool as e:
+        logger.warning("PDF extraction pool broken, falling back to sequential extraction", extra={"error": str(e)})
+        _reset_pool()
+        return None
+
+    logger.debug("Extracted PDF pages", extra={"pages": total_pages, "workers": max_workers})
+    return page_texts
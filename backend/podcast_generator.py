@@ -5,7 +5,8 @@ import os
 os.environ["PATH"] += os.pathsep + "C:\\ffmpeg-7.1.1-essentials_build\\bin"
 
 import google.generativeai as genai
-from openai import OpenAI
+from clients import get_openai_client
+from metrics import span, llm_call
 import tempfile
 import uuid
 from typing import Dict, List
@@ -16,9 +17,6 @@ load_dotenv()
 # Configure Gemini API
 genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 
-# Configure OpenAI API
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
 class PodcastGenerator:
     def __init__(self):
         self.gemini_model = genai.GenerativeModel('gemini-2.5-flash')
@@ -50,7 +48,8 @@ class PodcastGenerator:
         """
         
         try:
-            response = self.gemini_model.generate_content(prompt)
+            with llm_call("gemini-2.5-flash"):
+                response = self.gemini_model.generate_content(prompt)
             return response.text
         except Exception as e:
             raise Exception(f"Lỗi khi tạo dialogue với Gemini: {str(e)}")
@@ -79,8 +78,9 @@ class PodcastGenerator:
                     continue
                 
                 # Tạo audio segment
-                with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as temp_file:
-                    response = openai_client.audio.speech.create(
+                with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as temp_file, span("tts"):
+                    # OpenAI client (TTS) lấy từ registry dùng chung để giữ kết nối keep-alive giữa các request
+                    response = get_openai_client().audio.speech.create(
                         model="tts-1",
                         voice=voice,
                         input=text,
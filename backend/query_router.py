@@ -0,0 +1,217 @@
+# query_router.py - Router đặt trước agent: câu hỏi tài liệu thông thường đi luồng nhanh
+# (truy xuất 1 lần + 1 lần gọi LLM), chỉ câu cần web search/nhiều bước mới qua agent tool-calling.
+
+import os
+import re
+import threading
+import time
+from collections import deque
+from typing import AsyncIterator, Dict, List, Tuple
+
+from langchain_core.prompts import ChatPromptTemplate
+
+from prompt_template import RAG_ANSWER_PROMPT, RAG_NO_ANSWER_MARKER
+from logging_setup import get_logger
+from vn_tokenizer import normalize_query_text
+
+logger = get_logger("query_router")
+
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "1") == "1"
+# Câu quá ngắn (chào hỏi, "giải thích thêm") thường cần ngữ cảnh hội thoại -> để agent xử lý
+ROUTER_MIN_WORDS = int(os.getenv("ROUTER_MIN_WORDS", "3"))
+# Câu quá dài thường là yêu cầu nhiều bước
+ROUTER_MAX_WORDS = int(os.getenv("ROUTER_MAX_WORDS", "60"))
+# Số mẫu latency giữ lại cho mỗi luồng để tính percentile
+ROUTER_LATENCY_SAMPLES = int(os.getenv("ROUTER_LATENCY_SAMPLES", "1000"))
+
+# Các cụm từ (đã bỏ dấu, chữ thường) cho thấy câu hỏi cần thông tin ngoài tài liệu
+WEB_CUES = [
+    "tin tuc", "moi nhat", "gan day", "hien nay", "hom nay", "cap nhat", "thoi su", "ty gia", "gia ca",
+    "thoi tiet", "tren mang", "internet", "google", "tim tren web", "search", "news", "latest",
+]
+# Các cụm từ cho thấy yêu cầu nhiều bước hoặc dùng tính năng riêng của agent
+MULTI_STEP_CUES = [
+    "so sanh", "phan biet", "tong hop", "lap ke hoach", "tung buoc", "phan tich", "danh gia",
+    "email", "thu gui", "quiz", "trac nghiem", "kiem tra", "de thi",
+]
+_YEAR_PATTERN = re.compile(r"\b20[2-9]\d\b")
+
+# Các luồng: rag = luồng nhanh, agent = agent tool-calling, rag_fallback = luồng nhanh không tìm thấy rồi qua agent
+ROUTES = ("rag", "agent", "rag_fallback")
+
+
+def _contains_cue(text: str, cues: List[str]) -> bool:
+    return any(re.search(rf"\b{re.escape(cue)}\b", text) for cue in cues)
+
+
+def classify_question(question: str) -> Tuple[str, str]:
+    """Trả về (luồng, lý do): "rag" cho câu hỏi tài liệu thông thường, "agent" cho các trường hợp còn lại"""
+    folded = normalize_query_text(question)
+    words = folded.split()
+    if len(words) < ROUTER_MIN_WORDS:
+        return "agent", "too_short"
+    if len(words) > ROUTER_MAX_WORDS:
+        return "agent", "too_long"
+    if _contains_cue(folded, WEB_CUES) or _YEAR_PATTERN.search(folded):
+        return "agent", "web"
+    if _contains_cue(folded, MULTI_STEP_CUES):
+        return "agent", "multi_step"
+    if question.count("?") > 1:
+        return "agent", "multiple_questions"
+    return "rag", "document_question"
+
+
+def format_context(documents) -> str:
+    """Ghép các chunk truy xuất được, kèm tên file và số trang để LLM trích dẫn"""
+    parts = []
+    for doc in documents:
+        # source_file / page_number do load_documents gán (tên file gốc, trang tính từ 1);
+        # "source" của file upload chỉ là đường dẫn file tạm nên chỉ dùng khi thiếu
+        source = doc.metadata.get("source_file") or os.path.basename(str(doc.metadata.get("source", ""))) or "tài liệu"
+        page = doc.metadata.get("page_number")
+        if page is None and isinstance(doc.metadata.get("page"), int):
+            page = doc.metadata["page"] + 1
+        header = f"[{source}, trang {page}]" if page is not None else f"[{source}]"
+        parts.append(f"{header}\n{doc.page_content}")
+    return "\n\n---\n\n".join(parts)
+
+
+class NoAnswerInDocuments(Exception):
+    """Luồng nhanh không tìm được câu trả lời trong tài liệu -> cần chuyển sang agent"""
+
+
+class RAGAnswerer:
+    """Truy xuất một lần bằng retriever của session rồi gọi LLM đúng một lần"""
+
+    def __init__(self, retriever, llm):
+        self.retriever = retriever
+        self.llm = llm
+        self.prompt = ChatPromptTemplate.from_messages([
+            ("system", RAG_ANSWER_PROMPT.format(no_answer_marker=RAG_NO_ANSWER_MARKER)),
+            ("placeholder", "{chat_history}"),
+            ("human", "Các đoạn trích từ tài liệu:\n\n{context}\n\nCâu hỏi: {input}"),
+        ])
+
+    async def _messages(self, inputs: dict):
+        documents = await self.retriever.ainvoke(inputs["input"])
+        if not documents:
+            raise NoAnswerInDocuments("no documents retrieved")
+        return self.prompt.format_messages(
+            input=inputs["input"],
+            chat_history=inputs.get("chat_history", []),
+            context=format_context(documents),
+        )
+
+    async def ainvoke(self, inputs: dict) -> str:
+        response = await self.llm.ainvoke(await self._messages(inputs))
+        answer = response.content if isinstance(response.content, str) else str(response.content)
+        if RAG_NO_ANSWER_MARKER in answer:
+            raise NoAnswerInDocuments("answer not found in documents")
+        return answer
+
+    async def astream(self, inputs: dict, text_of) -> AsyncIterator[str]:
+        """
+        Stream câu trả lời. Phần đầu được giữ lại cho tới khi chắc chắn không phải marker
+        "không có trong tài liệu", nên NoAnswerInDocuments luôn xảy ra trước khi có token nào được gửi đi.
+        """
+        messages = await self._messages(inputs)
+        buffered = ""
+        released = False
+        async for chunk in self.llm.astream(messages):
+            text = text_of(chunk)
+            if not text:
+                continue
+            if released:
+                yield text
+                continue
+            buffered += text
+            stripped = buffered.lstrip()
+            if RAG_NO_ANSWER_MARKER in stripped:
+                raise NoAnswerInDocuments("answer not found in documents")
+            if len(stripped) >= len(RAG_NO_ANSWER_MARKER) or not RAG_NO_ANSWER_MARKER.startswith(stripped):
+                released = True
+                yield buffered
+        if not released:
+            if RAG_NO_ANSWER_MARKER in buffered or not buffered.strip():
+                raise NoAnswerInDocuments("answer not found in documents")
+            yield buffered
+
+
+class RouterStats:
+    """Đếm quyết định của router (theo luồng và lý do) và latency của từng luồng"""
+
+    def __init__(self, samples: int = ROUTER_LATENCY_SAMPLES):
+        self._lock = threading.Lock()
+        self.decisions: Dict[str, int] = {}
+        self.reasons: Dict[str, int] = {}
+        self.latencies = {route: deque(maxlen=samples) for route in ROUTES}
+        self.counts = {route: 0 for route in ROUTES}
+
+    def record_decision(self, route: str, reason: str):
+        with self._lock:
+            self.decisions[route] = self.decisions.get(route, 0) + 1
+            self.reasons[reason] = self.reasons.get(reason, 0) + 1
+
+    def record_latency(self, route: str, seconds: float):
+        with self._lock:
+            self.counts[route] += 1
+            self.latencies[route].append(seconds)
+
+    @staticmethod
+    def _percentile(values, q):
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            paths = {}
+            for route in ROUTES:
+                values = list(self.latencies[route])
+                paths[route] = {
+                    "count": self.counts[route],
+                    "mean_ms": round(1000 * sum(values) / len(values), 1) if values else 0.0,
+                    "p50_ms": round(1000 * self._percentile(values, 0.5), 1),
+                    "p95_ms": round(1000 * self._percentile(values, 0.95), 1),
+                }
+            return {
+                "enabled": ROUTER_ENABLED,
+                "decisions": dict(self.decisions),
+                "reasons": dict(self.reasons),
+                "paths": paths,
+            }
+
+
+router_stats = RouterStats()
+
+
+class QueryRouter:
+    """Chọn luồng cho mỗi câu hỏi; luồng nhanh không tìm thấy câu trả lời thì chuyển sang agent"""
+
+    def __init__(self, agent_executor, rag_answerer: RAGAnswerer, stats: RouterStats = router_stats):
+        self.agent_executor = agent_executor
+        self.rag = rag_answerer
+        self.stats = stats
+
+    def route(self, question: str) -> str:
+        route, reason = classify_question(question) if ROUTER_ENABLED else ("agent", "disabled")
+        self.stats.record_decision(route, reason)
+        logger.debug("Router decision", extra={"route": route, "reason": reason})
+        return route
+
+    async def ainvoke(self, inputs: dict) -> dict:
+        """Giống AgentExecutor.ainvoke, thêm khóa "route" cho biết luồng đã dùng"""
+        start = time.perf_counter()
+        route = self.route(inputs["input"])
+        if route == "rag":
+            try:
+                answer = await self.rag.ainvoke(inputs)
+                self.stats.record_latency("rag", time.perf_counter() - start)
+                return {"output": answer, "route": "rag"}
+            except NoAnswerInDocuments as e:
+                logger.debug("Router fallback to agent", extra={"reason": str(e)})
+                route = "rag_fallback"
+        response = await self.agent_executor.ainvoke(inputs)
+        self.stats.record_latency(route, time.perf_counter() - start)
+        return {**response, "route": route}
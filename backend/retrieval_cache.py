@@ -0,0 +1,88 @@
+# retrieval_cache.py - Cache LRU + TTL cho kết quả document_search trong một session
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from vn_tokenizer import normalize_query_text
+
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "256"))
+RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", "600"))
+
+
+class RetrievalCache:
+    """
+    Cache kết quả truy xuất theo câu hỏi đã chuẩn hóa (chữ thường, bỏ dấu, gộp khoảng trắng).
+    Mỗi cache gắn với index của một session: khi số chunk của index thay đổi
+    (thêm tài liệu) toàn bộ cache bị xóa để không trả về kết quả cũ.
+    """
+
+    def __init__(self, max_entries: int = RETRIEVAL_CACHE_SIZE, ttl: float = RETRIEVAL_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._generation = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(query: str) -> str:
+        return normalize_query_text(query)
+
+    def _check_generation(self, generation):
+        if generation != self._generation:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._generation = generation
+
+    def get(self, query: str, generation=None) -> Optional[Any]:
+        key = self.make_key(query)
+        now = time.monotonic()
+        with self._lock:
+            self._check_generation(generation)
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                if now - stored_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self.expired += 1
+            self.misses += 1
+            return None
+
+    def put(self, query: str, value: Any, generation=None):
+        key = self.make_key(query)
+        with self._lock:
+            self._check_generation(generation)
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,217 @@
+# sparse_bm25.py - BM25 vector hóa trên ma trận thưa (SciPy), thay cho BM25Retriever thuần Python
+
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from scipy import sparse
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from vn_tokenizer import tokenize_vi, tokenize_query_vi
+
+# Cùng tham số mặc định với rank_bm25.BM25Okapi để kết quả tương đương
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_EPSILON = 0.25
+
+
+def default_tokenize(text: str) -> List[str]:
+    return text.lower().split()
+
+
+# Tokenizer được lưu theo tên trong state để nạp lại đúng pipeline
+TOKENIZERS = {
+    "whitespace": (default_tokenize, default_tokenize),
+    "vi": (tokenize_vi, tokenize_query_vi),
+}
+DEFAULT_TOKENIZER = "vi"
+
+
+class SparseBM25:
+    """
+    BM25 Okapi trên ma trận thưa documents x vocabulary.
+    - Tokenize một lần khi thêm documents (lúc ingestion), lưu term id dạng mảng (CSR).
+    - Ma trận trọng số chỉ dựng khi có truy vấn đầu tiên (session không chat thì không tốn gì).
+    - Mỗi truy vấn chấm điểm toàn bộ documents bằng một phép nhân ma trận thưa.
+    """
+
+    def __init__(self, tokenizer: str = DEFAULT_TOKENIZER,
+                 k1: float = BM25_K1, b: float = BM25_B, epsilon: float = BM25_EPSILON):
+        self.tokenizer_name = tokenizer
+        self.tokenize_document, self.tokenize_query = TOKENIZERS[tokenizer]
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.vocab: Dict[str, int] = {}
+        # Term id + số lần xuất hiện của mỗi chunk (CSR, docs x vocab) và độ dài mỗi chunk
+        self._tf = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self._doc_len = np.zeros(0, dtype=np.float32)
+        self._weights = None  # Ma trận trọng số BM25 (CSC), dựng lại khi dữ liệu thay đổi
+        self._lock = threading.Lock()
+
+    @property
+    def num_docs(self) -> int:
+        return self._tf.shape[0]
+
+    def add_texts(self, texts: List[str]):
+        """Tokenize documents mới thành term id; chỉ phần mới được xử lý"""
+        rows, cols, counts = [], [], []
+        doc_len = []
+        with self._lock:
+            base = self._tf.shape[0]
+            for offset, text in enumerate(texts):
+                term_counts: Dict[int, int] = {}
+                tokens = self.tokenize_document(text)
+                for token in tokens:
+                    term_id = self.vocab.setdefault(token, len(self.vocab))
+                    term_counts[term_id] = term_counts.get(term_id, 0) + 1
+                rows.extend([offset] * len(term_counts))
+                cols.extend(term_counts.keys())
+                counts.extend(term_counts.values())
+                doc_len.append(len(tokens))
+
+            # Ma trận mới trỏ chung dữ liệu nhưng không resize tại chỗ (bản copy() có thể đang dùng _tf cũ)
+            old_tf = sparse.csr_matrix(
+                (self._tf.data, self._tf.indices, self._tf.indptr), shape=(base, len(self.vocab))
+            )
+            new_tf = sparse.csr_matrix(
+                (np.array(counts, dtype=np.float32), (np.array(rows, dtype=np.int32), np.array(cols, dtype=np.int32))),
+                shape=(len(texts), len(self.vocab)),
+            )
+            self._tf = sparse.vstack([old_tf, new_tf], format="csr")
+            self._doc_len = np.concatenate([self._doc_len, np.array(doc_len, dtype=np.float32)])
+            self._weights = None
+
+    def copy(self) -> "SparseBM25":
+        """
+        Bản sao để thêm documents mà không ảnh hưởng bản đang phục vụ truy vấn.
+        add_texts không sửa mảng tại chỗ nên hai bản dùng chung ma trận cũ, chỉ vocab được copy.
+        """
+        with self._lock:
+            engine = SparseBM25(tokenizer=self.tokenizer_name, k1=self.k1, b=self.b, epsilon=self.epsilon)
+            engine.vocab = dict(self.vocab)
+            engine._tf = self._tf
+            engine._doc_len = self._doc_len
+            engine._weights = self._weights
+            return engine
+
+    def _build_weights(self):
+        """Tính trước trọng số BM25 cho mọi cặp (document, term)"""
+        tf = self._tf.tocoo()
+        num_docs = tf.shape[0]
+        avgdl = float(self._doc_len.mean()) if num_docs else 0.0
+
+        # idf giống BM25Okapi: idf âm được thay bằng epsilon * idf trung bình
+        doc_freq = np.bincount(tf.col, minlength=tf.shape[1]).astype(np.float64)
+        idf = np.log(num_docs - doc_freq + 0.5) - np.log(doc_freq + 0.5)
+        if idf.size:
+            idf[idf < 0] = self.epsilon * idf.mean()
+
+        length_norm = self.k1 * (1 - self.b + self.b * self._doc_len / avgdl) if avgdl else np.zeros(num_docs)
+        data = idf[tf.col] * tf.data * (self.k1 + 1) / (tf.data + length_norm[tf.row])
+        self._weights = sparse.csc_matrix((data.astype(np.float32), (tf.row, tf.col)), shape=tf.shape)
+
+    def _ensure_built(self):
+        with self._lock:
+            if self._weights is None:
+                self._build_weights()
+            return self._weights
+
+    def get_scores(self, query: str) -> np.ndarray:
+        """Điểm BM25 của query với tất cả documents"""
+        weights = self._ensure_built()
+        query_counts: Dict[int, int] = {}
+        for token in self.tokenize_query(query):
+            term_id = self.vocab.get(token)
+            if term_id is not None:
+                query_counts[term_id] = query_counts.get(term_id, 0) + 1
+        if not query_counts:
+            return np.zeros(weights.shape[0], dtype=np.float32)
+        term_ids = np.fromiter(query_counts.keys(), dtype=np.int64)
+        multiplicity = np.fromiter(query_counts.values(), dtype=np.float32)
+        return np.asarray(weights[:, term_ids] @ multiplicity).ravel()
+
+    def top_k(self, query: str, k: int):
+        """Trả về (indices, scores) của k documents điểm cao nhất, sắp giảm dần"""
+        scores = self.get_scores(query)
+        if scores.size == 0:
+            return np.zeros(0, dtype=np.int64), scores
+        k = min(k, scores.size)
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        order = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return order, scores[order]
+
+    def memory_bytes(self) -> int:
+        """Dung lượng ma trận term (và ma trận trọng số nếu đã dựng)"""
+        total = self._tf.data.nbytes + self._tf.indices.nbytes + self._tf.indptr.nbytes + self._doc_len.nbytes
+        weights = self._weights
+        if weights is not None:
+            total += weights.data.nbytes + weights.indices.nbytes + weights.indptr.nbytes
+        return int(total)
+
+    def to_state(self) -> dict:
+        """Dạng serializable (chỉ gồm dict/list/numpy) để lưu kèm session"""
+        with self._lock:
+            return {
+                "tokenizer": self.tokenizer_name,
+                "params": {"k1": self.k1, "b": self.b, "epsilon": self.epsilon},
+                "vocab": list(self.vocab),
+                "tf_data": self._tf.data,
+                "tf_indices": self._tf.indices,
+                "tf_indptr": self._tf.indptr,
+                "tf_shape": self._tf.shape,
+                "doc_len": self._doc_len,
+            }
+
+    @classmethod
+    def from_state(cls, state: dict):
+        engine = cls(tokenizer=state["tokenizer"], **state["params"])
+        engine.vocab = {term: i for i, term in enumerate(state["vocab"])}
+        engine._tf = sparse.csr_matrix(
+            (state["tf_data"], state["tf_indices"], state["tf_indptr"]), shape=state["tf_shape"]
+        )
+        engine._doc_len = state["doc_len"]
+        return engine
+
+    def __getstate__(self):
+        return self.to_state()
+
+    def __setstate__(self, state):
+        restored = SparseBM25.from_state(state)
+        self.__dict__.update(restored.__dict__)
+
+
+class SparseBM25Retriever(BaseRetriever):
+    """Retriever LangChain dùng SparseBM25 (thay cho BM25Retriever)"""
+
+    engine: Any
+    docs: List[Document]
+    k: int = 4
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @classmethod
+    def from_documents(cls, documents: List[Document], k: int = 4, engine: Optional[SparseBM25] = None):
+        docs = list(documents)
+        if engine is None:
+            engine = SparseBM25()
+            engine.add_texts([doc.page_content for doc in docs])
+        return cls(engine=engine, docs=docs, k=k)
+
+    def add_documents(self, documents: List[Document]):
+        """Thêm documents mới (chỉ phần mới được tokenize)"""
+        self.engine.add_texts([doc.page_content for doc in documents])
+        self.docs.extend(documents)
+
+    def extended(self, documents: List[Document]) -> "SparseBM25Retriever":
+        """Retriever mới gồm documents cũ + documents mới; retriever hiện tại không bị thay đổi"""
+        retriever = SparseBM25Retriever(engine=self.engine.copy(), docs=list(self.docs), k=self.k)
+        retriever.add_documents(documents)
+        return retriever
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        indices, _ = self.engine.top_k(query, self.k)
+        return [self.docs[i] for i in indices]
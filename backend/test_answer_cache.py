@@ -0,0 +1,41 @@
+# Test cache câu trả lời: câu hỏi bình thường ở lượt sau vẫn được cache, câu hỏi nối tiếp thì không;
+# entry hết hạn không che mất entry còn hạn
+import time
+
+from answer_cache import SemanticAnswerCache
+
+is_cacheable = SemanticAnswerCache.is_cacheable
+
+
+def test_regular_second_turn_questions_are_cacheable():
+    for question in [
+        "Tại sao chúng ta cần chuẩn hóa cơ sở dữ liệu?",
+        "Thuật toán Dijkstra hoạt động như thế nào?",
+        "Cây nhị phân tìm kiếm là gì và nó có ưu điểm gì?",
+        "What is a binary search tree and how does it work?",
+        "Explain the difference between processes and threads",
+    ]:
+        assert is_cacheable(question, has_history=True), question
+
+
+def test_follow_up_questions_are_not_cacheable():
+    for question in [
+        "Vậy nó là gì trong bài này?",
+        "Giải thích lại điều này bằng ví dụ đơn giản",
+        "Cho ví dụ cụ thể về ý đó được không?",
+        "Can you explain it with an example?",
+    ]:
+        assert not is_cacheable(question, has_history=True), question
+        assert is_cacheable(question, has_history=False), question
+
+
+def test_expired_entries_do_not_hide_fresh_ones():
+    cache = SemanticAnswerCache(threshold=0.9, ttl=60)
+    cache.store("docs", "cũ", [1.0, 0.0], "câu trả lời cũ")
+    cache.store("docs", "mới", [0.95, 0.31], "câu trả lời mới")
+    cache._by_fingerprint["docs"][0].created_at = time.time() - 120
+
+    hit = cache.lookup("docs", [1.0, 0.0])
+    assert hit["answer"] == "câu trả lời mới"
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["expired"] == 1
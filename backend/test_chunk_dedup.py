@@ -0,0 +1,30 @@
+# Test loại bỏ chunk trùng: chỉ bỏ số trang/slide, giữ chunk khác nhau về số liệu, so với chunk đã có trong session
+from langchain_core.documents import Document
+
+from chunk_dedup import DedupIndex, deduplicate_chunks
+
+BASE = "Định nghĩa cây nhị phân tìm kiếm: mỗi nút có tối đa hai con, khóa nút trái nhỏ hơn khóa nút cha. "
+
+
+def chunk(text, page=None):
+    return Document(page_content=text, metadata={"page_number": page})
+
+
+def test_numbers_in_content_are_not_duplicates():
+    kept, report = deduplicate_chunks([
+        chunk("Bài 3: cho x = 12, tính giá trị của biểu thức y = 2x + 1"),
+        chunk("Bài 4: cho x = 15, tính giá trị của biểu thức y = 2x + 1"),
+        chunk(BASE + "Trang 3", 3),
+        chunk(BASE + "Trang 4", 4),
+    ])
+    assert report["removed_total"] == 1
+    assert [c.metadata["page_number"] for c in kept] == [None, None, 3]
+    assert kept[2].metadata["duplicate_pages"] == [4]
+
+
+def test_append_dedups_against_existing_chunks():
+    index = DedupIndex.from_chunks([chunk(BASE + "Slide 2", 2)])
+    kept, report = deduplicate_chunks([chunk(BASE + "Slide 9", 9), chunk("Nội dung mới hoàn toàn")], index=index)
+    assert [c.page_content for c in kept] == ["Nội dung mới hoàn toàn"]
+    assert report["removed_exact"] == 1
+    assert len(index.chunks) == 2
@@ -0,0 +1,101 @@
+# Test EmbeddingScheduler với server embedding giả lập (không cần mạng / API key)
+import json
+import urllib.error
+import urllib.request
+
+from embedding_scheduler import EmbeddingScheduler
+from fake_embeddings import deterministic_embedding, start_fake_embedding_server
+
+DIMENSIONS = 64
+
+
+class HTTPStatusError(Exception):
+    def __init__(self, status_code, headers):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = type("Response", (), {"status_code": status_code, "headers": headers})()
+
+
+class HTTPEmbeddings:
+    """Client tối giản gọi /v1/embeddings giống OpenAI SDK"""
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    def embed_documents(self, texts):
+        body = json.dumps({"model": "fake", "input": texts, "dimensions": DIMENSIONS}).encode("utf-8")
+        request = urllib.request.Request(f"{self.base_url}/embeddings", data=body,
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request) as response:
+                data = json.loads(response.read())["data"]
+        except urllib.error.HTTPError as e:
+            raise HTTPStatusError(e.code, dict(e.headers))
+        return [item["embedding"] for item in sorted(data, key=lambda d: d["index"])]
+
+
+def test_batches_run_concurrently_and_keep_order():
+    """Các batch chạy song song và kết quả giữ đúng thứ tự đầu vào"""
+    server, base_url = start_fake_embedding_server(latency=0.05, dimensions=DIMENSIONS)
+    try:
+        texts = [f"đoạn văn số {i} về cấu trúc dữ liệu" for i in range(100)]
+        scheduler = EmbeddingScheduler(HTTPEmbeddings(base_url), batch_size=10, max_concurrency=4)
+        vectors = scheduler.embed(texts)
+
+        assert vectors == [deterministic_embedding(t, DIMENSIONS) for t in texts]
+        assert server.state["requests"] == 10
+        assert server.state["max_in_flight"] > 1
+    finally:
+        server.shutdown()
+
+
+def test_backs_off_on_rate_limit():
+    """Gặp 429 thì retry (theo Retry-After) và giảm số batch chạy đồng thời"""
+    server, base_url = start_fake_embedding_server(rate_limit_every=3, retry_after=0.01, dimensions=DIMENSIONS)
+    try:
+        texts = [f"chunk {i}" for i in range(40)]
+        progress = []
+        scheduler = EmbeddingScheduler(HTTPEmbeddings(base_url), batch_size=5, max_concurrency=4)
+        vectors = scheduler.embed(texts, progress=progress.append)
+
+        assert len(vectors) == len(texts)
+        assert server.state["rate_limited"] > 0
+        assert scheduler.rate_limited_count == server.state["rate_limited"]
+        assert progress[-1] == 1.0
+    finally:
+        server.shutdown()
+
+
+def test_backs_off_on_openai_rate_limit_error():
+    """OpenAIEmbeddings thật trỏ tới server giả: openai.RateLimitError (429 + Retry-After) được nhận diện và retry"""
+    import pytest
+    import tiktoken
+    from langchain_community.embeddings import OpenAIEmbeddings
+
+    try:
+        tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        pytest.skip("tiktoken cl100k_base chưa có trong cache và không tải được (offline)")
+
+    server, base_url = start_fake_embedding_server(rate_limit_every=2, retry_after=0.01, dimensions=DIMENSIONS)
+    try:
+        embeddings = OpenAIEmbeddings(
+            model="text-embedding-3-small", dimensions=DIMENSIONS, openai_api_base=base_url,
+            openai_api_key="fake", max_retries=0,
+        )
+        texts = [f"chunk {i}" for i in range(12)]
+        scheduler = EmbeddingScheduler(embeddings, batch_size=3, max_concurrency=2, base_delay=5.0)
+        vectors = scheduler.embed(texts)
+
+        # OpenAIEmbeddings gửi token ids nên chỉ kiểm tra số lượng và số chiều
+        assert len(vectors) == len(texts) and all(len(v) == DIMENSIONS for v in vectors)
+        assert scheduler.rate_limited_count == server.state["rate_limited"] > 0
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    print("Testing EmbeddingScheduler against fake embedding server...")
+    test_batches_run_concurrently_and_keep_order()
+    test_backs_off_on_rate_limit()
+    test_backs_off_on_openai_rate_limit_error()
+    print("Testing completed!")
@@ -0,0 +1,29 @@
+# Test phần ghép ngữ cảnh của luồng trả lời nhanh: trích dẫn phải dùng tên file gốc, không phải file tạm
+import fitz
+
+from agent_core import load_documents, split_documents
+from query_router import format_context
+
+
+class Upload:
+    """Giống UploadedPDF trong index.py: tên file gốc + đường dẫn file tạm trên đĩa"""
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+
+
+def test_format_context_cites_original_file_name(tmp_path):
+    temp_path = tmp_path / "tmpab12cd.pdf"
+    pdf = fitz.open()
+    for i in range(2):
+        text = " ".join([f"Noi dung trang {i + 1} ve cay nhi phan tim kiem."] * 6)
+        pdf.new_page().insert_textbox(fitz.Rect(72, 72, 520, 770), text)
+    pdf.save(str(temp_path))
+
+    chunks = split_documents(load_documents([Upload("Giao_trinh_CTDL.pdf", str(temp_path))], max_workers=1))
+    context = format_context(chunks)
+
+    assert "[Giao_trinh_CTDL.pdf, trang 1]" in context
+    assert "[Giao_trinh_CTDL.pdf, trang 2]" in context
+    assert "tmpab12cd" not in context
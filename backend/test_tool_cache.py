@@ -0,0 +1,69 @@
+# Test memo hóa tool của agent với retriever và web search giả lập (không cần mạng / API key)
+import asyncio
+from typing import List
+
+from langchain.tools.retriever import create_retriever_tool
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from fake_web_search import FakeWebSearchTool
+from tool_cache import CachedWebSearchTool, WebSearchDiskCache, memoize_tool_per_run, tool_run_scope
+
+
+class CountingRetriever(BaseRetriever):
+    calls: List[str] = []
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        self.calls.append(query)
+        return [Document(page_content=f"Nội dung về {query}")]
+
+
+def test_document_search_memoized_within_one_run():
+    """Cùng câu truy vấn trong một lượt chạy chỉ truy xuất một lần; lượt mới truy xuất lại"""
+    retriever = CountingRetriever(calls=[])
+    tool = memoize_tool_per_run(create_retriever_tool(retriever, "document_search", "Tìm trong tài liệu"))
+
+    with tool_run_scope():
+        first = tool.invoke({"query": "cây nhị phân"})
+        second = tool.invoke({"query": "Cây  nhị phân"})
+        asyncio.run(tool.ainvoke({"query": "cây nhị phân"}))
+        tool.invoke({"query": "bảng băm"})
+    assert first == second
+    assert retriever.calls == ["cây nhị phân", "bảng băm"]
+
+    with tool_run_scope():
+        tool.invoke({"query": "cây nhị phân"})
+    assert len(retriever.calls) == 3
+
+    # Ngoài lượt chạy agent thì không memo hóa
+    tool.invoke({"query": "cây nhị phân"})
+    tool.invoke({"query": "cây nhị phân"})
+    assert len(retriever.calls) == 5
+
+
+def test_web_search_disk_cache_with_ttl(tmp_path):
+    """Kết quả web search được đọc lại từ đĩa (kể cả sau khi mở lại cache) cho tới khi hết TTL"""
+    fake = FakeWebSearchTool()
+    tool = CachedWebSearchTool.wrap(fake, WebSearchDiskCache(str(tmp_path), ttl=3600))
+    first = tool.invoke({"query": "tin tức AI mới nhất"})
+    assert asyncio.run(tool.ainvoke({"query": "tin tức AI mới nhất"})) == first
+    assert fake.total_calls == 1
+
+    reopened = CachedWebSearchTool.wrap(fake, WebSearchDiskCache(str(tmp_path), ttl=3600))
+    assert reopened.invoke({"query": "tin tức AI mới nhất"}) == first
+    assert fake.total_calls == 1
+
+    expired = CachedWebSearchTool.wrap(fake, WebSearchDiskCache(str(tmp_path), ttl=0))
+    expired.invoke({"query": "tin tức AI mới nhất"})
+    assert fake.total_calls == 2
+
+
+def test_web_search_cache_evicts_oldest(tmp_path):
+    fake = FakeWebSearchTool(max_results=1)
+    cache = WebSearchDiskCache(str(tmp_path), max_entries=2)
+    tool = CachedWebSearchTool.wrap(fake, cache)
+    for query in ["a b", "c d", "e f"]:
+        tool.invoke({"query": query})
+    assert cache.stats()["entries"] == 2
+    tool.invoke({"query": "a b"})
+    assert fake.calls["a b"] == 2
@@ -0,0 +1,225 @@
+# tool_cache.py - Memo hóa lời gọi tool của agent:
+# - document_search: cache theo lượt chạy (một lần invoke agent), cùng câu truy vấn chỉ truy xuất một lần
+# - web_search: cache trên đĩa (SQLite) có TTL, dùng chung giữa các lượt chat và các session
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from inspect import signature
+from typing import Any, Optional
+
+from langchain_core.tools import BaseTool
+
+from embedding_cache import normalize_query_for_embedding
+
+WEB_SEARCH_CACHE_DIR = os.getenv("WEB_SEARCH_CACHE_DIR", os.path.join(".cache", "web_search"))
+WEB_SEARCH_CACHE_TTL = float(os.getenv("WEB_SEARCH_CACHE_TTL", str(6 * 3600)))
+WEB_SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("WEB_SEARCH_CACHE_MAX_ENTRIES", "5000"))
+
+# Cache của lượt chạy hiện tại; None = không nằm trong tool_run_scope nên không memo hóa
+_run_cache: ContextVar[Optional[dict]] = ContextVar("tool_run_cache", default=None)
+
+
+class ToolCacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+
+    def incr(self, tool: str, event: str):
+        with self._lock:
+            per_tool = self.counters.setdefault(tool, {})
+            per_tool[event] = per_tool.get(event, 0) + 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {tool: dict(events) for tool, events in self.counters.items()}
+
+
+tool_cache_stats = ToolCacheStats()
+
+
+@contextmanager
+def tool_run_scope():
+    """Mở cache mới cho một lượt chạy agent (các tool chạy trong thread/task con vẫn thấy cùng cache)"""
+    token = _run_cache.set({})
+    try:
+        yield
+    finally:
+        try:
+            _run_cache.reset(token)
+        except ValueError:
+            # Generator của response streaming bị đóng ở context khác (client ngắt kết nối)
+            _run_cache.set(None)
+
+
+def _query_of(args, kwargs) -> str:
+    query = args[0] if args else kwargs.get("query", "")
+    return normalize_query_for_embedding(str(query))
+
+
+def memoize_tool_per_run(tool):
+    """
+    Bọc func/coroutine của Tool (VD: tool từ create_retriever_tool): trong cùng một lượt chạy,
+    các lời gọi với cùng câu truy vấn trả về kết quả đã có thay vì truy xuất lại.
+    """
+    func, coroutine = tool.func, tool.coroutine
+    name = tool.name
+
+    def call_kwargs(target, callbacks, kwargs):
+        # Giữ callbacks (tracing) nếu hàm gốc hỗ trợ
+        if target is not None and signature(target).parameters.get("callbacks"):
+            return {**kwargs, "callbacks": callbacks}
+        return kwargs
+
+    def cached_func(*args, callbacks=None, **kwargs):
+        cache = _run_cache.get()
+        key = (name, _query_of(args, kwargs))
+        if cache is not None and key in cache:
+            tool_cache_stats.incr(name, "run_hits")
+            return cache[key]
+        result = func(*args, **call_kwargs(func, callbacks, kwargs))
+        if cache is not None:
+            tool_cache_stats.incr(name, "run_misses")
+            cache[key] = result
+        return result
+
+    async def cached_coroutine(*args, callbacks=None, **kwargs):
+        cache = _run_cache.get()
+        key = (name, _query_of(args, kwargs))
+        if cache is not None and key in cache:
+            tool_cache_stats.incr(name, "run_hits")
+            return cache[key]
+        result = await coroutine(*args, **call_kwargs(coroutine, callbacks, kwargs))
+        if cache is not None:
+            tool_cache_stats.incr(name, "run_misses")
+            cache[key] = result
+        return result
+
+    if func is not None:
+        tool.func = cached_func
+    if coroutine is not None:
+        tool.coroutine = cached_coroutine
+    return tool
+
+
+class WebSearchDiskCache:
+    """Kết quả web search trên đĩa (SQLite), hết hạn sau ttl giây, giữ tối đa max_entries bản ghi mới nhất"""
+
+    def __init__(self, cache_dir: str = WEB_SEARCH_CACHE_DIR, ttl: float = WEB_SEARCH_CACHE_TTL,
+                 max_entries: int = WEB_SEARCH_CACHE_MAX_ENTRIES):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "web_search.sqlite3")
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS web_search ("
+            " key TEXT PRIMARY KEY,"
+            " query TEXT NOT NULL,"
+            " results TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_created_at ON web_search(created_at)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(backend: str, query: str, max_results: int) -> str:
+        digest = hashlib.sha256()
+        digest.update(f"{backend}\x1f{max_results}\x1f{normalize_query_for_embedding(query)}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute("SELECT results, created_at FROM web_search WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if time.time() - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM web_search WHERE key = ?", (key,))
+                self._conn.commit()
+                tool_cache_stats.incr("web_search", "expired")
+                return None
+        return json.loads(row[0])
+
+    def put(self, key: str, query: str, results):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO web_search (key, query, results, created_at) VALUES (?, ?, ?, ?)",
+                (key, query, json.dumps(results, ensure_ascii=False), time.time()),
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM web_search").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM web_search WHERE key IN "
+                    "(SELECT key FROM web_search ORDER BY created_at ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM web_search").fetchone()[0]
+        return {"entries": entries, "ttl_seconds": self.ttl, "max_entries": self.max_entries, "path": self.path}
+
+
+_web_search_cache: Optional[WebSearchDiskCache] = None
+_web_search_cache_lock = threading.Lock()
+
+
+def get_web_search_cache() -> WebSearchDiskCache:
+    """Cache web search dùng chung cho cả process"""
+    global _web_search_cache
+    if _web_search_cache is None:
+        with _web_search_cache_lock:
+            if _web_search_cache is None:
+                _web_search_cache = WebSearchDiskCache()
+    return _web_search_cache
+
+
+class CachedWebSearchTool(BaseTool):
+    """Bọc một tool web search (Tavily hoặc fake): tra cache đĩa trước, chỉ gọi API khi chưa có hoặc đã hết hạn"""
+
+    inner: Any
+    search_cache: Any
+
+    @classmethod
+    def wrap(cls, inner: BaseTool, cache: WebSearchDiskCache) -> "CachedWebSearchTool":
+        return cls(name=inner.name, description=inner.description, args_schema=inner.args_schema,
+                   inner=inner, search_cache=cache)
+
+    def _key(self, query: str) -> str:
+        return self.search_cache.make_key(type(self.inner).__name__, query, getattr(self.inner, "max_results", 0))
+
+    def _lookup(self, query: str):
+        cached = self.search_cache.get(self._key(query))
+        tool_cache_stats.incr(self.name, "disk_hits" if cached is not None else "disk_misses")
+        return cached
+
+    def _store(self, query: str, results):
+        # Tavily trả về chuỗi lỗi khi gọi API thất bại; chỉ cache kết quả hợp lệ
+        if isinstance(results, list):
+            self.search_cache.put(self._key(query), query, results)
+
+    def _run(self, query: str, run_manager=None):
+        cached = self._lookup(query)
+        if cached is not None:
+            return cached
+        config = {"callbacks": run_manager.get_child()} if run_manager else None
+        results = self.inner.invoke({"query": query}, config=config)
+        self._store(query, results)
+        return results
+
+    async def _arun(self, query: str, run_manager=None):
+        cached = self._lookup(query)
+        if cached is not None:
+            return cached
+        config = {"callbacks": run_manager.get_child()} if run_manager else None
+        results = await self.inner.ainvoke({"query": query}, config=config)
+        self._store(query, results)
+        return results
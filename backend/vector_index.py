@@ -0,0 +1,91 @@
+# vector_index.py - Tạo FAISS index dạng flat hoặc nén (int8 scalar quantization / PQ)
+
+import os
+import uuid
+from typing import List
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from logging_setup import get_logger
+
+logger = get_logger("vector_index")
+
+# flat: float32 đầy đủ | sq8: int8 scalar quantization (~4x nhỏ hơn) | pq: product quantization (~16x+)
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "flat")
+# Số byte mỗi vector khi dùng PQ (số chiều phải chia hết cho giá trị này)
+PQ_CODE_BYTES = int(os.getenv("PQ_CODE_BYTES", "96"))
+# PQ cần đủ dữ liệu để train codebook 256 tâm (FAISS khuyến nghị >= 39 điểm/tâm); ít hơn thì dùng sq8
+PQ_MIN_TRAIN_VECTORS = 39 * 256
+INDEX_TYPES = ("flat", "sq8", "pq")
+
+
+def build_faiss_index(vectors: np.ndarray, index_type: str = VECTOR_INDEX_TYPE):
+    """Tạo, train (nếu cần) và nạp vectors vào FAISS index theo loại được chọn"""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    num_vectors, dimensions = vectors.shape
+
+    if index_type == "pq" and dimensions % PQ_CODE_BYTES:
+        logger.info("Dimensions not divisible by PQ_CODE_BYTES, falling back to sq8", extra={
+            "dimensions": dimensions, "pq_code_bytes": PQ_CODE_BYTES,
+        })
+        index_type = "sq8"
+    elif index_type == "pq" and num_vectors < PQ_MIN_TRAIN_VECTORS:
+        logger.info("Not enough vectors for PQ, falling back to sq8", extra={
+            "vectors": num_vectors, "min_train_vectors": PQ_MIN_TRAIN_VECTORS,
+        })
+        index_type = "sq8"
+
+    if index_type == "sq8":
+        index = faiss.IndexScalarQuantizer(dimensions, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+        index.train(vectors)
+    elif index_type == "pq":
+        index = faiss.IndexPQ(dimensions, PQ_CODE_BYTES, 8, faiss.METRIC_L2)
+        index.train(vectors)
+    else:
+        index = faiss.IndexFlatL2(dimensions)
+
+    index.add(vectors)
+    return index
+
+
+def index_memory_bytes(index) -> int:
+    """Dung lượng phần mã vector của index (không tính docstore)"""
+    try:
+        return int(index.sa_code_size()) * int(index.ntotal)
+    except (AttributeError, RuntimeError):
+        return int(index.ntotal) * int(index.d) * 4
+
+
+def create_faiss_store(embeddings, texts: List[str], vectors: List[List[float]], metadatas: List[dict],
+                       index_type: str = VECTOR_INDEX_TYPE) -> FAISS:
+    """Ráp LangChain FAISS vector store từ vectors đã tính sẵn với loại index tùy chọn"""
+    index = build_faiss_index(np.array(vectors, dtype=np.float32), index_type)
+    ids = [str(uuid.uuid4()) for _ in texts]
+    docstore = InMemoryDocstore({
+        doc_id: Document(page_content=text, metadata=metadata)
+        for doc_id, text, metadata in zip(ids, texts, metadatas)
+    })
+    index_to_docstore_id = dict(enumerate(ids))
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+
+def describe_index(index) -> dict:
+    """Thông tin để báo cáo footprint bộ nhớ của từng session"""
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        index_type = "sq8"
+    elif isinstance(index, faiss.IndexPQ):
+        index_type = "pq"
+    else:
+        index_type = "flat"
+    return {
+        "index_type": index_type,
+        "num_vectors": int(index.ntotal),
+        "dimensions": int(index.d),
+        "index_memory_bytes": index_memory_bytes(index),
+    }
@@ -0,0 +1,44 @@
+# vn_tokenizer.py - Tokenizer cho keyword search tiếng Việt (bỏ dấu + bigram âm tiết)
+
+import re
+import unicodedata
+from functools import lru_cache
+from typing import List, Tuple
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+# Dấu câu ngắt cụm: không tạo bigram vượt qua ranh giới câu/mệnh đề
+_SEGMENT_RE = re.compile(r"[.,;:!?()\[\]{}\"'“”\n\r\t/|-]+")
+
+
+def fold_diacritics(text: str) -> str:
+    """Bỏ dấu tiếng Việt: "Cấu trúc dữ liệu" -> "Cau truc du lieu" """
+    decomposed = unicodedata.normalize("NFD", text)
+    stripped = "".join(ch for ch in decomposed if unicodedata.category(ch) != "Mn")
+    return stripped.replace("đ", "d").replace("Đ", "D")
+
+
+def normalize_query_text(text: str) -> str:
+    """Chuẩn hóa câu hỏi: chữ thường, bỏ dấu, gộp khoảng trắng (dùng làm cache key)"""
+    folded = fold_diacritics(unicodedata.normalize("NFC", text).lower())
+    return " ".join(_WORD_RE.findall(folded))
+
+
+def tokenize_vi(text: str) -> List[str]:
+    """
+    Tách term cho BM25: mỗi âm tiết đã bỏ dấu + bigram của hai âm tiết liền kề.
+    Từ ghép nhiều âm tiết ("cấu trúc") khớp qua bigram "cau_truc", còn câu hỏi
+    gõ thiếu dấu vẫn khớp với tài liệu có dấu.
+    """
+    text = fold_diacritics(unicodedata.normalize("NFC", text).lower())
+    terms = []
+    for segment in _SEGMENT_RE.split(text):
+        syllables = _WORD_RE.findall(segment)
+        terms.extend(syllables)
+        terms.extend(f"{a}_{b}" for a, b in zip(syllables, syllables[1:]))
+    return terms
+
+
+@lru_cache(maxsize=4096)
+def tokenize_query_vi(text: str) -> Tuple[str, ...]:
+    """tokenize_vi có cache cho câu hỏi (câu hỏi lặp lại không phải tokenize lại)"""
+    return tuple(tokenize_vi(text))